@@ -0,0 +1,172 @@
+"""Columns, batched aggregates and materialized views over products for the in-memory database."""
+from array import array
+import math
+from typing import Any, Callable, Collection, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from columnar import ValueDictionary
+from models import GroupTotals, PriceStats, Product
+
+_NOT_LOADED = object()
+# numpy is optional and slow to import, so load_numpy imports it for the
+# first aggregate; None when it is not installed
+np: Any = _NOT_LOADED
+
+
+def load_numpy():
+    """The numpy module, imported on first use, or None if it is not installed."""
+    global np
+    if np is _NOT_LOADED:
+        try:
+            import numpy as np
+        except ImportError:  # pragma: no cover - numpy is optional
+            np = None
+    return np
+
+
+def price_stats(group: Hashable, count: int, total: float, low: float, high: float) -> PriceStats:
+    """Build the stats row of one non-empty group."""
+    return PriceStats.model_construct(group=group, count=count, sum=total, min=low, max=high, avg=total / count)
+
+
+def group_order(row) -> tuple:
+    """Sort key putting stats rows in group order, with a missing value first."""
+    return row.group is not None, row.group
+
+
+class ProductColumns:
+    """Price, category and stock flag of every product, in arrays indexed by id.
+
+    Kept in sync with the products table like the secondary indexes, so
+    aggregates run over contiguous columns instead of Product objects.
+    With numpy installed, grouping by category or stock flag is done with
+    bincount over the whole columns; otherwise, and for tags, each group's
+    prices are gathered through its id set in the database's indexes.
+    The caller serializes writes and keeps them out while a query runs.
+    """
+
+    def __init__(self):
+        self.live = array("b", [0])
+        self.prices = array("d", [0.0])
+        self.in_stock = array("b", [0])
+        self.categories = array("I", [0])
+        self.category_codes = ValueDictionary()
+
+    def add(self, product_id: int, price: float, category: str, in_stock: bool):
+        """Record a product's column values."""
+        grow = product_id + 1 - len(self.live)
+        if grow > 0:
+            self.live.extend(array("b", bytes(grow)))
+            self.prices.extend(array("d", bytes(8 * grow)))
+            self.in_stock.extend(array("b", bytes(grow)))
+            self.categories.extend(array("I", bytes(4 * grow)))
+        self.prices[product_id] = price
+        self.in_stock[product_id] = in_stock
+        self.categories[product_id] = self.category_codes.encode(category)
+        self.live[product_id] = 1
+
+    def remove(self, product_id: int):
+        """Forget a product's column values."""
+        self.live[product_id] = 0
+        self.category_codes.release(self.categories[product_id])
+
+    def stats_by_column(self, group_by: Optional[str]) -> List[PriceStats]:
+        """Price stats of all products, optionally grouped by "category" or "in_stock"; needs numpy."""
+        np = load_numpy()
+        live = np.frombuffer(self.live, dtype=np.int8).astype(bool)
+        prices = np.frombuffer(self.prices, dtype=np.float64)[live]
+        if group_by is None:
+            codes = np.zeros(len(prices), dtype=np.intp)
+            labels: list = [None]
+        elif group_by == "category":
+            codes = np.frombuffer(self.categories, dtype=np.uint32)[live].astype(np.intp)
+            labels = self.category_codes.values
+        else:
+            codes = np.frombuffer(self.in_stock, dtype=np.int8)[live].astype(np.intp)
+            labels = [False, True]
+        counts = np.bincount(codes, minlength=len(labels))
+        sums = np.bincount(codes, weights=prices, minlength=len(labels))
+        mins = np.full(len(labels), np.inf)
+        maxes = np.full(len(labels), -np.inf)
+        np.minimum.at(mins, codes, prices)
+        np.maximum.at(maxes, codes, prices)
+        stats = [
+            price_stats(labels[code], int(counts[code]), float(sums[code]), float(mins[code]), float(maxes[code]))
+            for code in np.flatnonzero(counts).tolist()
+        ]
+        return sorted(stats, key=group_order)
+
+    def stats_by_ids(self, groups: Iterable[Tuple[Hashable, Collection[int]]]) -> List[PriceStats]:
+        """Price stats of each (group, product ids) pair, skipping empty groups."""
+        stats = []
+        np = load_numpy()
+        if np is not None:
+            prices = np.frombuffer(self.prices, dtype=np.float64)
+        for group, ids in groups:
+            if not ids:
+                continue
+            if np is not None:
+                values = prices[np.fromiter(ids, dtype=np.intp, count=len(ids))]
+                stats.append(price_stats(group, len(values), float(values.sum()),
+                                         float(values.min()), float(values.max())))
+            else:
+                values = list(map(self.prices.__getitem__, ids))
+                stats.append(price_stats(group, len(values), math.fsum(values), min(values), max(values)))
+        return sorted(stats, key=group_order)
+
+    def stats(self, group_by: Optional[str], id_groups: Dict[Hashable, Collection[int]]) -> List[PriceStats]:
+        """Price stats grouped by `group_by`, whose groups of ids are `id_groups`."""
+        if load_numpy() is not None and group_by != "tag":
+            return self.stats_by_column(group_by)
+        return self.stats_by_ids(id_groups.items())
+
+
+class GroupTotalsView:
+    """Materialized count and price sum of products per group.
+
+    `groups` maps a product to the groups it belongs to, which may be
+    several (tags) or none; `fields` are the product fields it reads. The
+    database applies every write as a before/after pair of rows, so keeping
+    the view current costs O(1) per write for single-valued groups. Sums
+    are kept by adding and subtracting prices, so they can drift from a
+    recompute by float rounding; a group's totals restart from zero when
+    its last product leaves it.
+    """
+
+    def __init__(self, name: str, fields: Iterable[str], groups: Callable[[Product], Iterable[Hashable]]):
+        self.name = name
+        self.fields = frozenset(fields)
+        self.groups = groups
+        self.totals: Dict[Hashable, List] = {}
+
+    def apply(self, before: Optional[Product], after: Optional[Product]):
+        """Move a written row's contribution from its old groups to its new ones."""
+        if before is not None:
+            for group in self.groups(before):
+                totals = self.totals[group]
+                totals[0] -= 1
+                totals[1] -= before.price
+                if not totals[0]:
+                    del self.totals[group]
+        if after is not None:
+            for group in self.groups(after):
+                totals = self.totals.get(group)
+                if totals is None:
+                    self.totals[group] = [1, after.price]
+                else:
+                    totals[0] += 1
+                    totals[1] += after.price
+
+    def rows(self) -> List[GroupTotals]:
+        """The view's current rows, in group order."""
+        rows = [GroupTotals.model_construct(group=group, count=count, sum=total)
+                for group, (count, total) in self.totals.items()]
+        return sorted(rows, key=group_order)
+
+
+def default_product_views() -> List[GroupTotalsView]:
+    """Views every in-memory database maintains."""
+    return [
+        GroupTotalsView("category_totals", ["category", "price"], lambda product: (product.category,)),
+        GroupTotalsView("stock_totals", ["in_stock", "price"], lambda product: (product.in_stock,)),
+        GroupTotalsView("tag_totals", ["tags", "price"], lambda product: set(product.tags or ())),
+    ]
@@ -0,0 +1,118 @@
+"""Async access to a storage backend for async route handlers."""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import time
+from typing import Any, Callable, Optional
+
+from changes import ChangeLog
+from metrics import Metrics
+from storage import StorageBackend
+
+
+def _async_method(name: str) -> Callable:
+    """Build an async method that runs the backend method of the same name."""
+
+    async def method(self: "AsyncDatabase", *args, **kwargs) -> Any:
+        func = getattr(self.backend, name)
+        if self.executor is None or not self.backend.executor_workers:
+            # Inline calls take microseconds; timing them would cost a
+            # noticeable share of the call, so they are not recorded
+            return func(*args, **kwargs)
+        if self.metrics is None:
+            return await self.run(func, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return await self.run(func, *args, **kwargs)
+        finally:
+            self.metrics.observe_db_call(name, time.perf_counter() - start)
+
+    method.__name__ = name
+    method.__qualname__ = f"AsyncDatabase.{name}"
+    return method
+
+
+class AsyncDatabase:
+    """Async variant of the StorageBackend API.
+
+    Backends whose calls block on I/O (`executor_workers` is set) run in a
+    thread pool of exactly that many threads, so a slow call never holds
+    up the event loop and the number of threads cannot grow with load.
+    Purely in-memory calls take microseconds and run directly on the event
+    loop, which is cheaper than handing them to a thread; that includes a
+    backend's calls once its `executor_workers` drops to None.
+
+    Given `metrics`, the latency of every call handed to the thread pool,
+    including any wait for a thread, is recorded under the method's name.
+    Calls run on the event loop are not timed: they are over before timing
+    them would tell anything the request latency does not.
+    """
+
+    def __init__(self, backend: StorageBackend, metrics: Optional[Metrics] = None):
+        self.backend = backend
+        self.metrics = metrics
+        self.executor: Optional[ThreadPoolExecutor] = None
+        if backend.executor_workers:
+            self.executor = ThreadPoolExecutor(max_workers=backend.executor_workers, thread_name_prefix="db")
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Call a blocking backend function without blocking the event loop."""
+        if self.executor is None or not self.backend.executor_workers:
+            return func(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    @property
+    def changes(self) -> ChangeLog:
+        """The backend's change log; appends and reads never block, so it is used directly."""
+        return self.backend.changes
+
+    def collection_version(self, table: str) -> int:
+        """Change counter of a collection; never blocks, so it is not a coroutine."""
+        return self.backend.collection_version(table)
+
+    async def close(self):
+        """Close the backend, then stop the executor's threads."""
+        await self.run(self.backend.close)
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    create_product = _async_method("create_product")
+    create_products = _async_method("create_products")
+    get_all_products = _async_method("get_all_products")
+    get_products_page = _async_method("get_products_page")
+    find_products = _async_method("find_products")
+    search_products = _async_method("search_products")
+    product_stats = _async_method("product_stats")
+    product_view = _async_method("product_view")
+    product_changes = _async_method("product_changes")
+    get_product = _async_method("get_product")
+    update_product = _async_method("update_product")
+    update_products = _async_method("update_products")
+    delete_product = _async_method("delete_product")
+    delete_products = _async_method("delete_products")
+
+    create_user = _async_method("create_user")
+    create_users = _async_method("create_users")
+    get_all_users = _async_method("get_all_users")
+    get_users_page = _async_method("get_users_page")
+    get_user = _async_method("get_user")
+    get_user_by_email = _async_method("get_user_by_email")
+    update_user = _async_method("update_user")
+    update_users = _async_method("update_users")
+    delete_user = _async_method("delete_user")
+    delete_users = _async_method("delete_users")
+
+    create_setting = _async_method("create_setting")
+    create_settings = _async_method("create_settings")
+    get_all_settings = _async_method("get_all_settings")
+    get_settings_page = _async_method("get_settings_page")
+    get_setting = _async_method("get_setting")
+    get_setting_by_key = _async_method("get_setting_by_key")
+    update_setting = _async_method("update_setting")
+    update_settings = _async_method("update_settings")
+    delete_setting = _async_method("delete_setting")
+    delete_settings = _async_method("delete_settings")
+
+    row_counts = _async_method("row_counts")
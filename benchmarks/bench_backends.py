@@ -0,0 +1,82 @@
+"""Benchmark the same workload against every storage backend.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_backends
+    python -m benchmarks.bench_backends --rows 1000000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from database import InMemoryDatabase
+from models import ProductCreate, ProductUpdate
+from sqlite_backend import SQLiteDatabase
+
+CATEGORIES = [f"Category {i}" for i in range(50)]
+WORDS = [f"word{i}" for i in range(5000)]
+
+
+def product(rng: random.Random, i: int) -> ProductCreate:
+    return ProductCreate(
+        name=f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}",
+        description=" ".join(rng.choices(WORDS, k=8)),
+        price=round(rng.uniform(1, 1000), 2),
+        category=rng.choice(CATEGORIES),
+        tags=rng.sample(WORDS, 2),
+    )
+
+
+def timed(label: str, ops: int, func):
+    """Run func once and print its throughput and mean latency."""
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<28} {ops / elapsed:12.0f} ops/s {elapsed / ops * 1e6:10.1f} us/op")
+
+
+def run(name: str, db, args):
+    rng = random.Random(42)
+    rows = [product(rng, i) for i in range(args.rows)]
+    print(f"{name}:")
+
+    def bulk_insert():
+        for offset in range(0, len(rows), args.batch_size):
+            db.create_products(rows[offset:offset + args.batch_size])
+
+    timed(f"bulk insert x{args.batch_size}", args.rows, bulk_insert)
+    ids = [rng.randint(1, args.rows) for _ in range(args.ops)]
+    timed("get by id", args.ops, lambda: [db.get_product(i) for i in ids])
+    timed("single insert", args.ops // 10, lambda: [db.create_product(rows[i]) for i in range(args.ops // 10)])
+    timed("update by id", args.ops // 10,
+          lambda: [db.update_product(i, ProductUpdate(price=1.0)) for i in ids[:args.ops // 10]])
+    categories = rng.choices(CATEGORIES, k=args.ops // 10)
+    timed("category page of 50", len(categories),
+          lambda: [db.find_products(category=c, limit=50) for c in categories])
+    timed("price page of 50", len(categories),
+          lambda: [db.find_products(min_price=500, sort="price", limit=50) for _ in categories])
+    timed("id page of 100", len(ids) // 10, lambda: [db.get_products_page(i, 100) for i in ids[:args.ops // 10]])
+    timed("search top 10", args.ops // 10,
+          lambda: [db.search_products(f"{rng.choice(WORDS)} {rng.choice(WORDS)[:-1]}") for _ in range(args.ops // 10)])
+    timed("delete by id", args.ops // 10, lambda: [db.delete_product(i) for i in set(ids[:args.ops // 10])])
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--ops", type=int, default=20_000)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    args = parser.parse_args()
+
+    run("memory", InMemoryDatabase(), args)
+    with tempfile.TemporaryDirectory() as directory:
+        run("sqlite", SQLiteDatabase(os.path.join(directory, "bench.sqlite3")), args)
+        size = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+        print(f"  sqlite files: {size / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
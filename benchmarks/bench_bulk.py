@@ -0,0 +1,54 @@
+"""Benchmark bulk product creation against one POST /products per row.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_bulk
+"""
+import argparse
+import time
+
+from fastapi.testclient import TestClient
+
+from database import InMemoryDatabase
+
+
+def make_client() -> TestClient:
+    """Return a TestClient backed by a fresh database."""
+    import main
+    return TestClient(main.create_app(InMemoryDatabase()))
+
+
+def product(i: int) -> dict:
+    return {"name": f"Bulk {i}", "description": "Benchmark row", "price": 9.99, "category": "Bench", "tags": ["bench"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--single-rows", type=int, default=5_000,
+                        help="rows to time with single POSTs (extrapolated to --rows)")
+    args = parser.parse_args()
+
+    client = make_client()
+    start = time.perf_counter()
+    for i in range(args.single_rows):
+        client.post("/products", json=product(i))
+    single_rate = args.single_rows / (time.perf_counter() - start)
+
+    client = make_client()
+    start = time.perf_counter()
+    for offset in range(0, args.rows, args.batch_size):
+        batch = [product(i) for i in range(offset, min(offset + args.batch_size, args.rows))]
+        response = client.post("/products/bulk", json=batch)
+        response.raise_for_status()
+    bulk_rate = args.rows / (time.perf_counter() - start)
+
+    print(f"single POST /products:      {single_rate:10.0f} rows/s "
+          f"(~{args.rows / single_rate:.0f} s for {args.rows} rows)")
+    print(f"POST /products/bulk x{args.batch_size}: {bulk_rate:10.0f} rows/s "
+          f"({args.rows / bulk_rate:.1f} s, {bulk_rate / single_rate:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
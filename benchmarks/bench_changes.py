@@ -0,0 +1,77 @@
+"""Benchmark the change feed: writer cost and fan-out to many subscribers.
+
+Product updates are run on a writer thread against an in-memory database
+while asyncio subscribers follow its change log on the main thread, as
+route handlers do. Reported per subscriber count:
+
+  update us   mean time per update_product call on the writer thread
+  lag ms      time from the last update until every subscriber has it
+  events/s    events delivered per second across all subscribers
+
+Run from the repository root:
+
+    python -m benchmarks.bench_changes
+    python -m benchmarks.bench_changes --subscribers 0 10 1000 --updates 50000
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+from changes import ChangeNotifier
+from database import InMemoryDatabase
+from models import ProductUpdate
+
+
+async def run(subscribers: int, updates: int) -> tuple:
+    db = InMemoryDatabase()
+    notifier = ChangeNotifier(db.changes, asyncio.get_running_loop())
+    delivered = 0
+
+    async def subscriber():
+        nonlocal delivered
+        async for events in notifier.follow(0):
+            delivered += len(events)
+            if events[-1].seq >= updates:
+                return
+
+    tasks = [asyncio.ensure_future(subscriber()) for _ in range(subscribers)]
+    await asyncio.sleep(0)
+    update = ProductUpdate(price=9.99)
+    product_ids = list(db.products)
+    timing = {}
+
+    def write():
+        start = time.perf_counter()
+        for i in range(updates):
+            db.update_product(product_ids[i % len(product_ids)], update)
+        timing["write"] = time.perf_counter() - start
+        timing["done"] = time.perf_counter()
+
+    start = time.perf_counter()
+    writer = threading.Thread(target=write)
+    writer.start()
+    while writer.is_alive():
+        await asyncio.sleep(0.001)
+    await asyncio.gather(*tasks)
+    lag = time.perf_counter() - timing["done"]
+    elapsed = time.perf_counter() - start
+    notifier.close()
+    return timing["write"] / updates * 1e6, lag * 1000, delivered / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[0, 1, 100, 1000, 5000])
+    parser.add_argument("--updates", type=int, default=5_000)
+    args = parser.parse_args()
+
+    print(f"{args.updates} updates")
+    print(f"{'subscribers':>11} {'update us':>10} {'lag ms':>8} {'events/s':>12}")
+    for subscribers in args.subscribers:
+        update_us, lag_ms, rate = asyncio.run(run(subscribers, args.updates))
+        print(f"{subscribers:>11} {update_us:10.1f} {lag_ms:8.1f} {rate:12.0f}")
+
+
+if __name__ == "__main__":
+    main()
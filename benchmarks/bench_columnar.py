@@ -0,0 +1,107 @@
+"""Benchmark memory per row and throughput of the row and columnar product stores.
+
+Memory is measured with tracemalloc: once for the products table alone and
+once for the whole database, which also holds the secondary and
+full-text indexes.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_columnar
+    python -m benchmarks.bench_columnar --rows 1000000
+"""
+import argparse
+from datetime import datetime
+import gc
+import json
+import random
+import time
+import tracemalloc
+from typing import List
+
+from database import InMemoryDatabase
+from models import Product, ProductCreate, ProductUpdate
+
+CATEGORIES = [f"Category {i}" for i in range(20)]
+TAGS = ["sale", "new", "eco", "premium", "bundle", "clearance", "gift", "imported"]
+
+
+def make_rows(count: int) -> List[ProductCreate]:
+    rng = random.Random(42)
+    return [
+        ProductCreate(
+            name=f"Product {i}",
+            description=f"Description of product {i}",
+            price=round(rng.uniform(1, 500), 2),
+            category=rng.choice(CATEGORIES),
+            tags=rng.sample(TAGS, rng.randint(0, 3)),
+            in_stock=rng.random() < 0.8,
+        )
+        for i in range(count)
+    ]
+
+
+def database_bytes(store: str, rows: List[ProductCreate]) -> int:
+    """Bytes held by a database loaded with `rows`, indexes included."""
+    gc.collect()
+    tracemalloc.start()
+    db = InMemoryDatabase(product_store=store)
+    db.create_products(rows)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return used
+
+
+def table_bytes_only(store: str, rows: List[ProductCreate]) -> int:
+    """Bytes held by the products table alone, strings included, without the indexes."""
+    table = InMemoryDatabase(product_store=store).products
+    created_at = datetime.now()
+    gc.collect()
+    tracemalloc.start()
+    for product_id, row in enumerate(rows, start=4):
+        # Decode a fresh copy so the strings are counted, not shared with the input
+        table[product_id] = Product(id=product_id, created_at=created_at, **json.loads(row.model_dump_json()))
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return used
+
+
+def rate(func, count: int) -> float:
+    """Operations per second of `func`, which performs `count` of them."""
+    start = time.perf_counter()
+    func()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    ids = random.Random(7).sample(range(4, args.rows + 4), min(args.rows, 50_000))
+    print(f"{args.rows} products")
+    print(f"{'store':<10} {'table B/row':>12} {'db B/row':>10} {'create/s':>10} {'get/s':>10} "
+          f"{'update/s':>10} {'get_all ms':>11} {'page ms':>8}")
+    for store in ("rows", "columnar"):
+        table = table_bytes_only(store, rows)
+        total = database_bytes(store, rows)
+        db = InMemoryDatabase(product_store=store)
+        create_rate = rate(lambda: db.create_products(rows), args.rows)
+        get_rate = rate(lambda: [db.get_product(i) for i in ids], len(ids))
+        update = ProductUpdate(price=9.99)
+        update_rate = rate(lambda: [db.update_product(i, update) for i in ids[:10_000]], min(len(ids), 10_000))
+        start = time.perf_counter()
+        db.get_all_products()
+        get_all_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        for _ in range(100):
+            db.find_products(category="Category 3", limit=100)
+        page_ms = (time.perf_counter() - start) * 10
+        print(f"{store:<10} {table / args.rows:12.0f} {total / args.rows:10.0f} {create_rate:10.0f} {get_rate:10.0f} "
+              f"{update_rate:10.0f} {get_all_ms:11.1f} {page_ms:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
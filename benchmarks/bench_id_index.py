@@ -0,0 +1,57 @@
+"""Benchmark primary-key lookups, updates and deletes as the table grows.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_id_index
+    python -m benchmarks.bench_id_index --sizes 1000 10000
+"""
+import argparse
+import random
+import time
+
+from database import InMemoryDatabase
+from models import ProductCreate, ProductUpdate
+
+
+def build_db(size: int) -> InMemoryDatabase:
+    """Create a database holding `size` products (including sample data)."""
+    db = InMemoryDatabase()
+    template = ProductCreate(
+        name="Bench Product",
+        description="Benchmark row",
+        price=9.99,
+        category="Bench",
+        tags=["bench"],
+    )
+    for _ in range(size - len(db.products)):
+        db.create_product(template)
+    return db
+
+
+def time_per_op(func, ids) -> float:
+    """Return the mean time in microseconds of calling `func` on each id."""
+    start = time.perf_counter()
+    for product_id in ids:
+        func(product_id)
+    return (time.perf_counter() - start) / len(ids) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--ops", type=int, default=1_000)
+    args = parser.parse_args()
+
+    update = ProductUpdate(price=19.99)
+    print(f"{'rows':>10} {'get (us)':>10} {'update (us)':>12} {'delete (us)':>12}")
+    for size in args.sizes:
+        db = build_db(size)
+        ids = random.sample(list(db.products), min(args.ops, size))
+        get_us = time_per_op(db.get_product, ids)
+        update_us = time_per_op(lambda i: db.update_product(i, update), ids)
+        delete_us = time_per_op(db.delete_product, ids)
+        print(f"{size:>10} {get_us:>10.2f} {update_us:>12.2f} {delete_us:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
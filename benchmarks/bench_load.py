@@ -0,0 +1,128 @@
+"""Load-test a running server: requests/sec and latency percentiles.
+
+Starts uvicorn on the app, opens --connections keep-alive connections and
+has each send GET requests back to back for --duration seconds. The client
+speaks minimal HTTP/1.1 over raw asyncio streams so it stays cheap enough
+not to be the bottleneck.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_load
+    python -m benchmarks.bench_load --backend sqlite --connections 1000
+
+To compare against another version of the app, check it out elsewhere
+(e.g. with `git worktree add`) and pass --app-dir.
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+HOST = "127.0.0.1"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+async def read_response(reader: asyncio.StreamReader) -> int:
+    """Read one HTTP/1.1 response and return its status code."""
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head[9:12])
+    length = 0
+    for line in head.split(b"\r\n"):
+        if line[:15].lower() == b"content-length:":
+            length = int(line[15:])
+    await reader.readexactly(length)
+    return status
+
+
+async def connection(port: int, paths: List[bytes], deadline: float, latencies: List[float], errors: List[int]):
+    """Send requests over one keep-alive connection until the deadline."""
+    reader, writer = await asyncio.open_connection(HOST, port)
+    try:
+        while time.perf_counter() < deadline:
+            request = b"GET " + random.choice(paths) + b" HTTP/1.1\r\nHost: bench\r\n\r\n"
+            start = time.perf_counter()
+            writer.write(request)
+            status = await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def load(port: int, connections: int, duration: float, paths: List[bytes]):
+    latencies: List[float] = []
+    errors: List[int] = []
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(connection(port, paths, deadline, latencies, errors) for _ in range(connections)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def wait_until_up(port: int, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("Server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app-dir", default=".", help="directory holding main.py")
+    parser.add_argument("--backend", default="memory", choices=["memory", "sqlite"])
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--rows", type=int, default=10_000, help="products to load before the test")
+    args = parser.parse_args()
+
+    port = free_port()
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, DB_BACKEND=args.backend, DB_SQLITE_PATH=os.path.join(directory, "bench.sqlite3"))
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", args.app_dir,
+             "--host", HOST, "--port", str(port), "--log-level", "warning", "--backlog", "4096"],
+            env=env,
+        )
+        try:
+            wait_until_up(port)
+            import httpx
+            batch = [{"name": f"Load {i}", "description": "Load test row", "price": 9.99, "category": "Load"}
+                     for i in range(1000)]
+            with httpx.Client(base_url=f"http://{HOST}:{port}", timeout=60) as client:
+                for _ in range(args.rows // len(batch)):
+                    client.post("/products/bulk", json=batch).raise_for_status()
+            paths = [f"/products/{i}".encode() for i in range(1, args.rows + 1)]
+
+            latencies, errors, elapsed = asyncio.run(load(port, args.connections, args.duration, paths))
+        finally:
+            server.terminate()
+            server.wait()
+
+    latencies.sort()
+
+    def percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    print(f"{args.backend} backend, {args.connections} connections, {args.duration:.0f} s, app in {args.app_dir}")
+    print(f"  requests/sec: {len(latencies) / elapsed:10.0f}")
+    print(f"  p50 / p99 / max: {percentile(0.50):.1f} / {percentile(0.99):.1f} / {latencies[-1] * 1000:.1f} ms")
+    print(f"  non-200 responses: {len(errors)}")
+
+
+if __name__ == "__main__":
+    main()
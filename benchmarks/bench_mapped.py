@@ -0,0 +1,131 @@
+"""Benchmark startup from a mapped snapshot against recovering a JSON snapshot.
+
+Writes a catalog of --rows products both as a mapped snapshot and as the
+NDJSON snapshot of a data directory, then starts the app on each and
+reports:
+
+  first ms     time from starting the server process until GET
+               /products/{id} first succeeds
+  rss MB       resident memory of the server after that request
+  anon MB      the part of it that is private to the process; the rest is
+               file pages shared with every process mapping the same file
+  get us       mean latency of GET /products/{id} over random ids
+  search s     time of the first search, which waits for the background
+               build of a mapped catalog's secondary indexes (--search only)
+
+Recovering a JSON snapshot builds every model and index up front, so it is
+only run up to --max-json-rows.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_mapped
+    python -m benchmarks.bench_mapped --rows 100000 1000000 5000000 --search
+"""
+import argparse
+from datetime import datetime
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.bench_load import HOST, free_port
+from mapped import write_mapped
+from models import Product
+from persistence import SNAPSHOT_FILE, write_snapshot
+
+CATEGORIES = [f"Category {i}" for i in range(50)]
+TAGS = [[], ["sale"], ["new", "featured"], ["clearance", "sale", "outlet"]]
+
+
+def catalog(rows: int):
+    """Generate `rows` products in id order without holding them all."""
+    rng = random.Random(1)
+    created_at = datetime(2024, 1, 1)
+    for i in range(1, rows + 1):
+        yield Product.model_construct(
+            id=i, name=f"Item {i}", description=f"Bench row {i} with a short description",
+            price=round(rng.uniform(1, 500), 2), category=rng.choice(CATEGORIES), tags=rng.choice(TAGS),
+            in_stock=rng.random() < 0.9, created_at=created_at, version=1, seq=i,
+        )
+
+
+def memory_mb(pid: int) -> tuple:
+    """Resident and anonymous (private) memory of a process in MB."""
+    fields = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            fields[name] = value
+    return int(fields["VmRSS"].split()[0]) / 1024, int(fields["RssAnon"].split()[0]) / 1024
+
+
+def run(env: dict, rows: int, search: bool) -> tuple:
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", HOST, "--port", str(port), "--log-level", "warning"],
+        env=dict(os.environ, **env),
+    )
+    try:
+        with httpx.Client(base_url=f"http://{HOST}:{port}", timeout=600) as client:
+            while True:
+                try:
+                    client.get(f"/products/{rows // 2}").raise_for_status()
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.01)
+            first = time.perf_counter() - start
+            rss, anon = memory_mb(server.pid)
+            ids = random.Random(2).sample(range(1, rows + 1), 1000)
+            get_start = time.perf_counter()
+            for product_id in ids:
+                client.get(f"/products/{product_id}").raise_for_status()
+            get_us = (time.perf_counter() - get_start) / len(ids) * 1e6
+            search_s = None
+            if search:
+                search_start = time.perf_counter()
+                client.get("/products/search", params={"q": "outlet"}).raise_for_status()
+                search_s = time.perf_counter() - search_start
+        return first * 1000, rss, anon, get_us, search_s
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--max-json-rows", type=int, default=1_000_000)
+    parser.add_argument("--search", action="store_true", help="also time the first search")
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'source':<7} {'file MB':>8} {'first ms':>9} {'rss MB':>8} {'anon MB':>8} "
+          f"{'get us':>7} {'search s':>9}")
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            counters = {"next_ids": {"products": rows + 1, "users": 1, "settings": 1},
+                        "product_seq": rows, "tombstone_horizon": 0}
+            runs = {}
+            path = os.path.join(tmp, "catalog.map")
+            write_mapped(path, {"products": catalog(rows), "users": [], "settings": []}, counters)
+            runs["mapped"] = (path, {"DB_MAPPED_SNAPSHOT": path})
+            if rows <= args.max_json_rows:
+                data_dir = os.path.join(tmp, "data")
+                os.mkdir(data_dir)
+                write_snapshot(os.path.join(data_dir, SNAPSHOT_FILE), 0, counters["next_ids"],
+                               {"products": catalog(rows)}, {"product_seq": rows})
+                runs["json"] = (os.path.join(data_dir, SNAPSHOT_FILE), {"DB_DATA_DIR": data_dir})
+            for source, (file, env) in runs.items():
+                file_mb = os.path.getsize(file) / 2**20
+                first, rss, anon, get_us, search_s = run(env, rows, args.search)
+                search = "" if search_s is None else f"{search_s:9.1f}"
+                print(f"{rows:>9} {source:<7} {file_mb:8.0f} {first:9.0f} {rss:8.0f} {anon:8.0f} "
+                      f"{get_us:7.0f} {search:>9}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Benchmark the cost of request and storage metrics: API_METRICS on against off.
+
+Reported:
+
+  fixed cost   microseconds metrics add to one request: the middleware
+               around an app that does nothing, plus timing one storage
+               call
+  in-process   the app called directly as an ASGI application, with no
+               server or network, serving GET /products/{id} from the
+               response cache, the cheapest request there is and so the
+               one the fixed cost is the largest share of, and pages of
+               GET /products?limit=20 with the cache off. Both apps are
+               built up front and run in alternating blocks of --block
+               requests, each first in turn, so drift on the machine
+               affects both alike,
+               and each is reported as its median block, so a block
+               slowed by other work on the machine does not count
+  server       uvicorn serving the same requests to --connections
+               keep-alive connections, as in bench_load, alternating
+               between servers with metrics on and off for --rounds rounds
+
+Run from the repository root:
+
+    python -m benchmarks.bench_metrics
+    python -m benchmarks.bench_metrics --rounds 10 --duration 10
+"""
+import argparse
+import asyncio
+import gc
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.bench_id_index import build_db
+from benchmarks.bench_load import HOST, free_port, load, wait_until_up
+from async_database import AsyncDatabase
+import config
+from database import InMemoryDatabase
+from metrics import Metrics, MetricsMiddleware
+
+
+class _Route:
+    path = "/products/{product_id}"
+
+
+async def _bare_app(scope, receive, send):
+    scope["route"] = _Route
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _bare_requests(app, count: int) -> float:
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(count):
+        await app({"type": "http", "method": "GET"}, None, send)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+async def _db_calls(async_db: AsyncDatabase, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        await async_db.get_product(1)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def fixed_cost(count: int = 200_000) -> float:
+    """Best-of-five microseconds metrics add to a request making one storage call."""
+    db = InMemoryDatabase()
+    middleware = min(asyncio.run(_bare_requests(MetricsMiddleware(_bare_app, Metrics()), count))
+                     - asyncio.run(_bare_requests(_bare_app, count)) for _ in range(5))
+    storage = min(asyncio.run(_db_calls(AsyncDatabase(db, Metrics()), count))
+                  - asyncio.run(_db_calls(AsyncDatabase(db), count)) for _ in range(5))
+    return middleware + storage
+
+
+async def asgi_requests(app, paths: list) -> float:
+    """Mean microseconds of calling the app with a GET of each path, with its query string, in turn."""
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start" and message["status"] != 200:
+            raise RuntimeError(f"GET returned {message['status']}")
+
+    start = time.perf_counter()
+    for path in paths:
+        path, _, query = path.partition("?")
+        await app({
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+            "root_path": "",
+            "headers": [(b"host", b"bench")], "client": (HOST, 1), "server": (HOST, 80),
+        }, receive, send)
+    return (time.perf_counter() - start) / len(paths) * 1e6
+
+
+def in_process(args, paths: list, cache: bool) -> dict:
+    """Microseconds per request with metrics on and off, in the median block of each."""
+    import main
+    db = build_db(args.rows)
+    paths = [paths[i % len(paths)] for i in range(args.block)]
+    apps = {}
+    for enabled in (True, False):
+        config.METRICS = enabled
+        apps[enabled] = main.create_app(db)
+        if not cache:
+            apps[enabled].state.response_cache.max_entries = 0
+    times = {True: [], False: []}
+    for block in range(-1, args.requests // args.block):
+        # Which app runs first alternates, so neither gains from going first
+        for enabled in (True, False) if block % 2 else (False, True):
+            app = apps[enabled]
+            gc.collect()
+            elapsed = asyncio.run(asgi_requests(app, paths))
+            # The first block fills the response caches and is not counted
+            if block >= 0:
+                times[enabled].append(elapsed)
+    return {enabled: statistics.median(block_times) for enabled, block_times in times.items()}
+
+
+def server_rate(enabled: bool, args) -> float:
+    """Requests per second of a server started with metrics on or off."""
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", HOST, "--port", str(port),
+         "--log-level", "warning", "--backlog", "4096"],
+        env=dict(os.environ, API_METRICS="1" if enabled else "0"),
+    )
+    try:
+        wait_until_up(port)
+        batch = [{"name": f"Load {i}", "description": "Load test row", "price": 9.99, "category": "Load"}
+                 for i in range(1000)]
+        with httpx.Client(base_url=f"http://{HOST}:{port}", timeout=60) as client:
+            for _ in range(max(1, args.rows // len(batch))):
+                client.post("/products/bulk", json=batch).raise_for_status()
+        paths = [f"/products/{i}".encode() for i in range(1, args.rows + 1)]
+        latencies, errors, elapsed = asyncio.run(load(port, args.connections, args.duration, paths))
+        if errors:
+            raise RuntimeError(f"{len(errors)} requests failed")
+        return len(latencies) / elapsed
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=200_000, help="in-process requests per setting")
+    parser.add_argument("--block", type=int, default=2000, help="in-process requests per block")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per server round")
+    parser.add_argument("--skip-server", action="store_true")
+    args = parser.parse_args()
+
+    print(f"fixed cost  {fixed_cost():7.2f} us/request")
+    workloads = {
+        "GET /products/{id}, cached": ([f"/products/{i}" for i in range(1, args.rows + 1)], True),
+        "GET /products?limit=20, cache off": (
+            [f"/products?limit=20&after_id={i}" for i in range(0, args.rows - 20, 20)], False),
+    }
+    for name, (paths, cache) in workloads.items():
+        mean = in_process(args, paths, cache)
+        print(f"in-process {name}, {args.requests} requests each")
+        print(f"  metrics off {mean[False]:7.1f} us/request")
+        print(f"  metrics on  {mean[True]:7.1f} us/request  ({(mean[True] / mean[False] - 1) * 100:+.1f}%)")
+    if args.skip_server:
+        return
+
+    rounds = {True: [], False: []}
+    for _ in range(args.rounds):
+        for enabled in (True, False):
+            rounds[enabled].append(server_rate(enabled, args))
+    rates = {enabled: statistics.median(rates) for enabled, rates in rounds.items()}
+    print(f"server, {args.connections} connections, median of {args.rounds} rounds of {args.duration:.0f} s")
+    print(f"  metrics off {rates[False]:7.0f} requests/s")
+    print(f"  metrics on  {rates[True]:7.0f} requests/s  ({(rates[True] / rates[False] - 1) * 100:+.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
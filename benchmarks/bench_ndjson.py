@@ -0,0 +1,89 @@
+"""Benchmark transient memory of NDJSON export/import as the catalog grows.
+
+Peak memory is measured with tracemalloc around the transfer itself, so the
+numbers show what moving the data costs on top of the rows being stored.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_ndjson
+    python -m benchmarks.bench_ndjson --sizes 10000 1000000
+"""
+import argparse
+import asyncio
+import json
+import tracemalloc
+
+from starlette.requests import Request
+
+from benchmarks.bench_id_index import build_db
+from database import InMemoryDatabase
+
+CHUNK_SIZE = 64 * 1024
+
+
+def peak_mib(func) -> float:
+    """Run func under tracemalloc and return its peak allocation in MiB, net of what it keeps."""
+    tracemalloc.start()
+    func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (peak - current) / 2**20
+
+
+def stream_export(app):
+    """Consume the NDJSON export, discarding the bytes."""
+    import main
+
+    async def drain():
+        async for _ in main.export_products_ndjson(app.state):
+            pass
+
+    asyncio.run(drain())
+
+
+def json_array_export(db: InMemoryDatabase):
+    """Serialize the whole catalog as one JSON array, as GET /products does."""
+    json.dumps([product.model_dump(mode="json") for product in db.get_all_products()])
+
+
+def ndjson_body(size: int):
+    """Yield an NDJSON upload of `size` products in CHUNK_SIZE pieces."""
+    line = json.dumps({"name": "Imported", "description": "Imported", "price": 1.0, "category": "Import"}) + "\n"
+    lines_per_chunk = CHUNK_SIZE // len(line)
+    for offset in range(0, size, lines_per_chunk):
+        yield (line * min(lines_per_chunk, size - offset)).encode()
+
+
+def stream_import(app, size: int):
+    """Feed an NDJSON upload through the import endpoint chunk by chunk."""
+    import main
+    chunks = ndjson_body(size)
+
+    async def receive():
+        chunk = next(chunks, None)
+        return {"type": "http.request", "body": chunk or b"", "more_body": chunk is not None}
+
+    request = Request({"type": "http", "method": "POST", "headers": [], "app": app}, receive)
+    result = asyncio.run(main.import_products(request))
+    assert result["imported"] == size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    import main as app_main
+    print(f"{'rows':>10} {'ndjson export':>14} {'json array':>12} {'ndjson import':>14}  (transient MiB)")
+    for size in args.sizes:
+        db = build_db(size)
+        app = app_main.create_app(db)
+        export_mib = peak_mib(lambda: stream_export(app))
+        array_mib = peak_mib(lambda: json_array_export(db))
+        app_main.use_database(app.state, InMemoryDatabase())
+        import_mib = peak_mib(lambda: stream_import(app, size))
+        print(f"{size:>10} {export_mib:>14.1f} {array_mib:>12.1f} {import_mib:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""Benchmark keyset pagination cost at different offsets into the table.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_pagination
+"""
+import argparse
+import time
+
+from benchmarks.bench_id_index import build_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=1_000)
+    args = parser.parse_args()
+
+    db = build_db(args.size)
+    print(f"{'after_id':>10} {'page (us)':>10}")
+    for after_id in (None, args.size // 10, args.size // 2, args.size - args.limit * 2):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            db.get_products_page(after_id, args.limit)
+        elapsed = (time.perf_counter() - start) / args.repeat * 1e6
+        print(f"{str(after_id):>10} {elapsed:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Benchmark price range and top-N queries against a naive filter-and-sort.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_price_index
+"""
+import argparse
+import random
+import time
+
+from database import InMemoryDatabase
+from models import ProductCreate
+
+
+def build_db(size: int) -> InMemoryDatabase:
+    """Create a database holding `size` products with random prices."""
+    db = InMemoryDatabase()
+    for i in range(size - len(db.products)):
+        db.create_product(ProductCreate(
+            name=f"Bench Product {i}",
+            description="Benchmark row",
+            price=round(random.uniform(1, 1000), 2),
+            category="Bench",
+        ))
+    return db
+
+
+def naive(db: InMemoryDatabase, min_price: float, max_price: float, limit: int):
+    """Filter and sort the full product list, as a client would today."""
+    products = [p for p in db.get_all_products() if min_price <= p.price <= max_price]
+    products.sort(key=lambda p: (p.price, p.id))
+    return products[:limit]
+
+
+def indexed(db: InMemoryDatabase, min_price: float, max_price: float, limit: int):
+    """Answer the same query from the sorted price index."""
+    products, _ = db.find_products(min_price=min_price, max_price=max_price, sort="price", limit=limit)
+    return products
+
+
+def bench(func, db, repeat, *args) -> float:
+    """Return the mean time in milliseconds of calling func(db, *args)."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(db, *args)
+    return (time.perf_counter() - start) / repeat * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    db = build_db(args.size)
+    assert naive(db, 40, 100, args.limit) == indexed(db, 40, 100, args.limit)
+    naive_ms = bench(naive, db, 3, 40, 100, args.limit)
+    indexed_ms = bench(indexed, db, args.repeat, 40, 100, args.limit)
+    print(f"rows={args.size} range=[40, 100] limit={args.limit}")
+    print(f"naive filter+sort: {naive_ms:10.3f} ms")
+    print(f"price index:       {indexed_ms:10.3f} ms  ({naive_ms / indexed_ms:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Benchmark the cost of the profiling hooks when unused, while sampling and while tracing.
+
+Reported:
+
+  disabled     in-process cached GET /products/{id} with no admin token,
+               where the app has no profiling middleware at all, against
+               an admin token set but no trace asked for, which checks
+               each request's headers. Both apps run in alternating blocks
+               of --block requests, as in bench_metrics
+  sampling     requests/s of a live server serving GET /products?limit=20
+               while a sampling session runs at each --interval-ms,
+               against the same server not sampling, alternating for
+               --rounds rounds
+  trace        latency of one traced GET /products?limit=500 with the
+               response cache off against the untraced request, and the
+               time per phase it reports
+
+Run from the repository root:
+
+    python -m benchmarks.bench_profiling
+    python -m benchmarks.bench_profiling --interval-ms 10 1 --rounds 5
+"""
+import argparse
+import asyncio
+import gc
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+
+from benchmarks.bench_id_index import build_db
+from benchmarks.bench_load import HOST, free_port, load, wait_until_up
+from benchmarks.bench_metrics import asgi_requests
+import config
+
+TOKEN = "bench"
+
+
+def disabled_cost(args) -> dict:
+    """Mean microseconds per cached read with and without an admin token configured."""
+    import main
+    db = build_db(args.rows)
+    paths = [f"/products/{i % args.rows + 1}" for i in range(args.block)]
+    apps = {}
+    for token in (None, TOKEN):
+        config.ADMIN_TOKEN = token
+        apps[token] = main.create_app(db)
+    config.ADMIN_TOKEN = None
+    times = {token: [] for token in apps}
+    for block in range(-1, args.requests // args.block):
+        for token, app in apps.items():
+            gc.collect()
+            elapsed = asyncio.run(asgi_requests(app, paths))
+            # The first block fills the response caches and is not counted
+            if block >= 0:
+                times[token].append(elapsed)
+    return {token: statistics.fmean(block_times) for token, block_times in times.items()}
+
+
+def sampling_rates(args) -> dict:
+    """Median requests/s of a live server by sampling interval in ms, None meaning not sampling."""
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", HOST, "--port", str(port),
+         "--log-level", "warning", "--backlog", "4096"],
+        env=dict(os.environ, API_ADMIN_TOKEN=TOKEN, API_CACHE_MAX_ENTRIES="0"),
+    )
+    try:
+        wait_until_up(port)
+        batch = [{"name": f"Load {i}", "description": "Load test row", "price": 9.99, "category": "Load"}
+                 for i in range(1000)]
+        with httpx.Client(base_url=f"http://{HOST}:{port}", timeout=60) as client:
+            for _ in range(max(1, args.rows // len(batch))):
+                client.post("/products/bulk", json=batch).raise_for_status()
+        paths = [f"/products?limit=20&after_id={i}".encode() for i in range(0, args.rows - 20, 20)]
+        rates = {interval: [] for interval in [None, *args.interval_ms]}
+        for _ in range(args.rounds):
+            for interval in rates:
+                session = None
+                if interval is not None:
+                    session = threading.Thread(target=httpx.post, args=(f"http://{HOST}:{port}/admin/profile",), kwargs={
+                        "params": {"seconds": args.duration + 1, "interval_ms": interval},
+                        "headers": {"X-Admin-Token": TOKEN}, "timeout": args.duration + 30,
+                    })
+                    session.start()
+                    time.sleep(0.5)
+                latencies, errors, elapsed = asyncio.run(load(port, args.connections, args.duration, paths))
+                if errors:
+                    raise RuntimeError(f"{len(errors)} requests failed")
+                rates[interval].append(len(latencies) / elapsed)
+                if session is not None:
+                    session.join()
+        return {interval: statistics.median(interval_rates) for interval, interval_rates in rates.items()}
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def trace(args) -> tuple:
+    """Untraced and traced milliseconds of one list request, and the traced request's Server-Timing."""
+    from fastapi.testclient import TestClient
+    import main
+    config.ADMIN_TOKEN = TOKEN
+    app = main.create_app(build_db(args.rows))
+    config.ADMIN_TOKEN = None
+    app.state.response_cache.max_entries = 0
+    path = "/products?limit=500"
+    with TestClient(app) as client:
+        # The first trace measures the tracer's own cost per event
+        client.get(path, headers={"X-Profile": "trace", "X-Admin-Token": TOKEN})
+        start = time.perf_counter()
+        for _ in range(20):
+            client.get(path)
+        untraced = (time.perf_counter() - start) / 20 * 1000
+        start = time.perf_counter()
+        response = client.get(path, headers={"X-Profile": "trace", "X-Admin-Token": TOKEN})
+        traced = (time.perf_counter() - start) * 1000
+    return untraced, traced, response.headers["server-timing"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=100_000, help="in-process requests per setting")
+    parser.add_argument("--block", type=int, default=2000, help="in-process requests per block")
+    parser.add_argument("--interval-ms", type=float, nargs="+", default=[10.0, 1.0])
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per server round")
+    args = parser.parse_args()
+
+    mean = disabled_cost(args)
+    print(f"disabled: in-process GET /products/{{id}}, cached, {args.requests} requests each")
+    print(f"  no admin token   {mean[None]:7.1f} us/request")
+    print(f"  admin token set  {mean[TOKEN]:7.1f} us/request  ({(mean[TOKEN] / mean[None] - 1) * 100:+.1f}%)")
+
+    rates = sampling_rates(args)
+    print(f"sampling: GET /products?limit=20, {args.connections} connections, median of {args.rounds} rounds")
+    print(f"  not sampling     {rates[None]:7.0f} requests/s")
+    for interval in args.interval_ms:
+        print(f"  every {interval:4g} ms    {rates[interval]:7.0f} requests/s  "
+              f"({(rates[interval] / rates[None] - 1) * 100:+.1f}%)")
+
+    untraced, traced, server_timing = trace(args)
+    print(f"trace: GET /products?limit=500, cache off")
+    print(f"  untraced {untraced:.2f} ms, traced {traced:.2f} ms ({traced / untraced:.1f}x)")
+    print(f"  Server-Timing: {server_timing}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Benchmark full-text search latency over a synthetic catalog.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_search
+"""
+import argparse
+import itertools
+import random
+import statistics
+import time
+
+from database import InMemoryDatabase
+from models import ProductCreate
+
+VOCABULARY_SIZE = 20_000
+
+
+def make_words(rng: random.Random):
+    """Build a synthetic vocabulary of pronounceable words."""
+    syllables = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "pa", "qu", "dor", "len", "mar"]
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    # Sort for reproducibility, then shuffle so word frequency does not
+    # follow alphabetical order
+    words = sorted(words)
+    rng.shuffle(words)
+    return words
+
+
+def build_db(size: int, words, rng: random.Random) -> InMemoryDatabase:
+    """Create a database of `size` products with Zipf-distributed words."""
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    db = InMemoryDatabase()
+    for _ in range(size - len(db.products)):
+        text = rng.choices(words, cum_weights=cum_weights, k=14)
+        db.create_product(ProductCreate(
+            name=" ".join(text[:3]),
+            description=" ".join(text[3:12]),
+            price=9.99,
+            category="Bench",
+            tags=text[12:],
+        ))
+    return db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=500_000)
+    parser.add_argument("--queries", type=int, default=2_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    words = make_words(rng)
+    start = time.perf_counter()
+    db = build_db(args.size, words, rng)
+    print(f"indexed {args.size} products in {time.perf_counter() - start:.1f} s")
+
+    # Queries pick words uniformly, so most are rarer than the catalog's
+    # most common words, with a partially typed last term.
+    latencies = []
+    for _ in range(args.queries):
+        terms = rng.sample(words, rng.randint(1, 3))
+        terms[-1] = terms[-1][:max(3, len(terms[-1]) - 2)]
+        query = " ".join(terms)
+        start = time.perf_counter()
+        db.search_products(query, 10)
+        latencies.append((time.perf_counter() - start) * 1e3)
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"queries={args.queries} p50={statistics.median(latencies):.3f} ms "
+          f"p99={p99:.3f} ms max={latencies[-1]:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Benchmark GET /products with FastAPI's response handling against each JSON encoder.
+
+The response cache is disabled so every request serializes the rows. The
+baseline is the same handler declared the usual way, returning the rows
+and letting FastAPI validate and encode them against `List[Product]`.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_serialization
+    python -m benchmarks.bench_serialization --rows 100000
+"""
+import argparse
+import time
+from typing import List
+
+from fastapi.testclient import TestClient
+
+from benchmarks.bench_id_index import build_db
+from models import Product
+from serialization import JSON_ENCODERS, create_encoder
+
+
+def time_per_request(client: TestClient, path: str, repeat: int) -> float:
+    """Return the mean time in milliseconds of GET `path`."""
+    client.get(path).raise_for_status()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        client.get(path)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    import main as app_module
+    app = app_module.create_app(build_db(args.rows))
+    app.state.response_cache.max_entries = 0
+
+    @app.get("/bench/products", response_model=List[Product])
+    async def products_with_response_model():
+        return await app.state.async_db.get_all_products()
+
+    print(f"GET /products, {args.rows} rows, response cache off")
+    with TestClient(app) as client:
+        baseline = time_per_request(client, "/bench/products", args.repeat)
+        print(f"  {'FastAPI':<16} {baseline:8.1f} ms")
+        for name in JSON_ENCODERS:
+            try:
+                app.state.encode_json = create_encoder(name)
+            except ValueError as error:
+                print(f"  {name:<16} skipped: {error}")
+                continue
+            elapsed = time_per_request(client, "/products", args.repeat)
+            print(f"  {name:<16} {elapsed:8.1f} ms  ({baseline / elapsed:.1f}x as fast)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Benchmark import time and the per-test setup cost of an app.
+
+Reported:
+
+  import main        fresh interpreter importing main, less an empty
+                     interpreter's startup; best of --repeat processes
+  heaviest imports   modules with the largest cumulative import time
+  fixture            building an app around a fresh database and entering
+                     and leaving a TestClient, as tests/conftest.py does,
+                     against reloading main as the fixture used to
+
+Run from the repository root:
+
+    python -m benchmarks.bench_startup
+"""
+import argparse
+import importlib
+import subprocess
+import sys
+import time
+
+from fastapi.testclient import TestClient
+
+from database import InMemoryDatabase
+
+
+def process_seconds(code: str, repeat: int) -> float:
+    """Best wall time of a fresh interpreter running `code`."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def heaviest_imports(count: int) -> list:
+    """(cumulative microseconds, module) of the slowest top-level imports of main."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            capture_output=True, text=True, check=True)
+    rows = []
+    # A module is listed after everything it imports, indented two spaces
+    # deeper than its importer; main is the last top-level entry
+    for line in result.stderr.splitlines()[1:]:
+        _, cumulative_us, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0 and name.strip() != "main":
+            rows = []
+        elif depth <= 1:
+            rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def fixture_ms(setup, repeat: int) -> float:
+    """Mean milliseconds of building an app with `setup` and running its startup and shutdown."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        with TestClient(setup(InMemoryDatabase())):
+            pass
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="processes per import measurement")
+    parser.add_argument("--fixtures", type=int, default=200, help="apps built per fixture measurement")
+    args = parser.parse_args()
+
+    empty = process_seconds("pass", args.repeat)
+    imported = process_seconds("import main", args.repeat)
+    print(f"import main: {(imported - empty) * 1000:7.0f} ms (interpreter startup {empty * 1000:.0f} ms)")
+    for cumulative_us, name in heaviest_imports(6):
+        print(f"  {name:<24} {cumulative_us / 1000:7.0f} ms")
+
+    import main as app_module
+    import database
+
+    def create_app(db):
+        return app_module.create_app(db)
+
+    def reload_main(db):
+        # What the fixture did before create_app: patch the global database
+        # and re-execute main so every route is built again around it
+        database._db = db
+        importlib.reload(app_module)
+        return app_module.app
+
+    factory = fixture_ms(create_app, args.fixtures)
+    reload = fixture_ms(reload_main, args.fixtures)
+    print(f"fixture: create_app {factory:.2f} ms, reload main {reload:.2f} ms ({reload / factory:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark product price stats against aggregating the product list in a Python loop.
+
+The baseline is what a dashboard does today with the rows of GET
+/products, minus the HTTP transfer: one pass over every Product model.
+Stats are timed with numpy, when it is installed, and with the pure
+Python fallback, and compared with reading the matching materialized
+view, which holds counts and sums only.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_stats
+    python -m benchmarks.bench_stats --rows 100000
+"""
+import argparse
+import random
+import time
+
+import analytics
+from database import InMemoryDatabase
+from models import ProductCreate
+
+TAGS = ["sale", "new", "eco", "premium", "gift"]
+# Materialized view holding the same groups as each group_by
+VIEWS = {"category": "category_totals", "in_stock": "stock_totals", "tag": "tag_totals"}
+
+
+def build_db(rows: int, batch_size: int = 10_000) -> InMemoryDatabase:
+    rng = random.Random(1)
+    db = InMemoryDatabase()
+    for offset in range(0, rows, batch_size):
+        db.create_products([
+            ProductCreate(
+                name="Item",
+                description="Bench row",
+                price=round(rng.uniform(1, 500), 2),
+                category=f"Category {rng.randrange(50)}",
+                tags=rng.sample(TAGS, rng.randint(0, 2)),
+                in_stock=rng.random() < 0.8,
+            )
+            for _ in range(min(batch_size, rows - offset))
+        ])
+    return db
+
+
+def python_loop(db: InMemoryDatabase, group_by):
+    """Aggregate price per group one Product at a time."""
+    groups = {}
+    for product in db.get_all_products():
+        if group_by is None:
+            keys = [None]
+        elif group_by == "tag":
+            keys = set(product.tags)
+        else:
+            keys = [getattr(product, group_by)]
+        for key in keys:
+            stats = groups.get(key)
+            if stats is None:
+                groups[key] = [1, product.price, product.price, product.price]
+            else:
+                stats[0] += 1
+                stats[1] += product.price
+                stats[2] = min(stats[2], product.price)
+                stats[3] = max(stats[3], product.price)
+    return groups
+
+
+def best_ms(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    db = build_db(args.rows)
+    numpy = analytics.load_numpy()
+    print(f"{args.rows} products, best of {args.repeat} (ms)")
+    print(f"{'group_by':<10} {'python loop':>12} {'numpy':>10} {'fallback':>10} {'view':>8}")
+    for group_by in (None, "category", "in_stock", "tag"):
+        loop = best_ms(lambda: python_loop(db, group_by), 1)
+        with_numpy = "-"
+        if numpy is not None:
+            with_numpy = f"{best_ms(lambda: db.product_stats(group_by), args.repeat):10.1f}"
+        analytics.np = None
+        fallback = best_ms(lambda: db.product_stats(group_by), args.repeat)
+        analytics.np = numpy
+        view = VIEWS.get(group_by)
+        view_ms = "-" if view is None else f"{best_ms(lambda: db.product_view(view), args.repeat):8.3f}"
+        print(f"{str(group_by):<10} {loop:12.1f} {with_numpy:>10} {fallback:10.1f} {view_ms:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Benchmark delta sync against reloading the whole catalog.
+
+A client that last synced before `k` writes either fetches every product,
+as GET /products does, or only the changes after its watermark, as GET
+/products/changes does. Both are timed with JSON encoding and without the
+HTTP transfer, on each storage backend.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_sync
+    python -m benchmarks.bench_sync --rows 1000000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from database import InMemoryDatabase
+from models import ProductCreate, ProductUpdate
+from serialization import create_encoder
+from sqlite_backend import SQLiteDatabase
+
+encode_json = create_encoder("pydantic")
+
+
+def load(db, rows: int, batch_size: int = 10_000):
+    rng = random.Random(1)
+    for offset in range(0, rows, batch_size):
+        db.create_products([
+            ProductCreate(name=f"Item {offset + i}", description="Bench row", price=round(rng.uniform(1, 500), 2),
+                          category=f"Category {rng.randrange(50)}")
+            for i in range(min(batch_size, rows - offset))
+        ])
+
+
+def best_ms(func, repeat: int = 3) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--changes", type=int, nargs="+", default=[10, 1000, 10_000])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            "memory": InMemoryDatabase(),
+            "sqlite": SQLiteDatabase(os.path.join(tmp, "bench.sqlite3")),
+        }
+        print(f"{args.rows} products")
+        print(f"{'backend':<8} {'changes':>8} {'full ms':>9} {'delta ms':>9} {'full KB':>9} {'delta KB':>9}")
+        for name, db in backends.items():
+            load(db, args.rows)
+            ids = list(range(4, args.rows + 4))
+            rng = random.Random(2)
+            since = db.product_changes(0).seq
+            for changes in args.changes:
+                changed = rng.sample(ids, changes)
+                # One in ten changes is a delete
+                deleted = set(changed[: changes // 10])
+                for product_id in changed[changes // 10:]:
+                    db.update_product(product_id, ProductUpdate(price=1.0))
+                db.delete_products(list(deleted))
+                ids = [i for i in ids if i not in deleted]
+                full = best_ms(lambda: encode_json(db.get_all_products()))
+                delta = best_ms(lambda: encode_json(db.product_changes(since)))
+                full_kb = len(encode_json(db.get_all_products())) / 1024
+                delta_kb = len(encode_json(db.product_changes(since))) / 1024
+                print(f"{name:<8} {changes:8} {full:9.1f} {delta:9.2f} {full_kb:9.0f} {delta_kb:9.1f}")
+                since = db.product_changes(since).seq
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
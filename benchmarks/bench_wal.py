@@ -0,0 +1,69 @@
+"""Benchmark write throughput per fsync policy and recovery time.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_wal
+    python -m benchmarks.bench_wal --writes 5000 --recovery-rows 100000
+"""
+import argparse
+import tempfile
+import time
+
+from database import InMemoryDatabase
+from models import ProductCreate
+
+TEMPLATE = ProductCreate(name="Durable", description="Benchmark row", price=9.99, category="Bench", tags=["bench"])
+
+
+def write_rate(fsync: str, writes: int) -> float:
+    """Return creates per second with the given fsync policy."""
+    with tempfile.TemporaryDirectory() as data_dir:
+        db = InMemoryDatabase(data_dir=data_dir, fsync=fsync, snapshot_every=10**9)
+        start = time.perf_counter()
+        for _ in range(writes):
+            db.create_product(TEMPLATE)
+        db.close()
+        return writes / (time.perf_counter() - start)
+
+
+def recovery_time(rows: int, tail: int) -> float:
+    """Return seconds to recover `rows` products from a snapshot plus a `tail`-record log."""
+    with tempfile.TemporaryDirectory() as data_dir:
+        db = InMemoryDatabase(data_dir=data_dir, fsync="never", snapshot_every=10**9)
+        db.create_products([TEMPLATE] * (rows - tail))
+        db.snapshot()
+        for _ in range(tail):
+            db.create_product(TEMPLATE)
+        db.close()
+
+        start = time.perf_counter()
+        recovered = InMemoryDatabase(data_dir=data_dir)
+        elapsed = time.perf_counter() - start
+        assert len(recovered.products) == rows + 3
+        recovered.close()
+        return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writes", type=int, default=20_000)
+    parser.add_argument("--recovery-rows", type=int, default=1_000_000)
+    parser.add_argument("--tail", type=int, default=100_000, help="log records replayed after the snapshot")
+    args = parser.parse_args()
+
+    baseline = InMemoryDatabase()
+    start = time.perf_counter()
+    for _ in range(args.writes):
+        baseline.create_product(TEMPLATE)
+    print(f"{'no log':>8}: {args.writes / (time.perf_counter() - start):10.0f} writes/s")
+    for fsync in ("never", "batch", "always"):
+        # fsync per write is slow, so time fewer of them
+        writes = args.writes if fsync != "always" else max(args.writes // 20, 100)
+        print(f"{fsync:>8}: {write_rate(fsync, writes):10.0f} writes/s")
+
+    elapsed = recovery_time(args.recovery_rows, args.tail)
+    print(f"recovered {args.recovery_rows} rows (snapshot + {args.tail} log records) in {elapsed:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
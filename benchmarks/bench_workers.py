@@ -0,0 +1,95 @@
+"""Benchmark read throughput against the number of uvicorn worker processes.
+
+Starts the app on the SQLite backend with --workers N, which all serve one
+database file, and drives GET /products/{id} from several client
+processes for --duration seconds. Before each run it checks that a write
+through one connection is seen by reads on fresh connections, which land
+on any worker, so the response caches stay consistent across processes.
+
+Throughput can only scale while there are idle cores for both the
+workers and the clients; the core count is printed with the results.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_workers
+    python -m benchmarks.bench_workers --workers 1 2 4 8 --clients 4
+"""
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import os
+import subprocess
+import sys
+import tempfile
+
+import httpx
+
+from benchmarks.bench_load import HOST, free_port, load, wait_until_up
+
+
+def client_process(port: int, connections: int, duration: float, rows: int) -> int:
+    """Requests completed by one client process."""
+    paths = [f"/products/{i}".encode() for i in range(1, rows + 1)]
+    latencies, errors, _ = asyncio.run(load(port, connections, duration, paths))
+    return len(latencies) - len(errors)
+
+
+def check_consistency(port: int, reads: int = 50):
+    """Raise unless every read after a write, on new connections, returns the written row."""
+    with httpx.Client(base_url=f"http://{HOST}:{port}") as client:
+        client.get("/products/1").raise_for_status()
+        price = client.get("/products/1").json()["price"] + 1
+        client.put("/products/1", json={"price": price}).raise_for_status()
+    for _ in range(reads):
+        response = httpx.get(f"http://{HOST}:{port}/products/1", headers={"Connection": "close"})
+        if response.json()["price"] != price:
+            raise AssertionError("A worker served a stale product after a write")
+
+
+def run(workers: int, args) -> float:
+    port = free_port()
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, DB_BACKEND="sqlite", DB_SQLITE_PATH=os.path.join(directory, "bench.sqlite3"))
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", HOST, "--port", str(port),
+             "--workers", str(workers), "--log-level", "warning", "--backlog", "4096"],
+            env=env,
+        )
+        try:
+            wait_until_up(port)
+            batch = [{"name": f"Load {i}", "description": "Load test row", "price": 9.99, "category": "Load"}
+                     for i in range(1000)]
+            with httpx.Client(base_url=f"http://{HOST}:{port}", timeout=60) as client:
+                for _ in range(args.rows // len(batch)):
+                    client.post("/products/bulk", json=batch).raise_for_status()
+            check_consistency(port)
+            with ProcessPoolExecutor(args.clients) as pool:
+                counts = pool.map(client_process, [port] * args.clients,
+                                  [args.connections // args.clients] * args.clients,
+                                  [args.duration] * args.clients, [args.rows] * args.clients)
+                return sum(counts) / args.duration
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=2, help="load generator processes")
+    parser.add_argument("--connections", type=int, default=64, help="connections across all clients")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--rows", type=int, default=10_000)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, {args.clients} client processes, {args.connections} connections")
+    print(f"{'workers':>7} {'requests/s':>11} {'speedup':>8}")
+    baseline = None
+    for workers in args.workers:
+        rate = run(workers, args)
+        baseline = baseline or rate
+        print(f"{workers:>7} {rate:11.0f} {rate / baseline:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
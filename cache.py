@@ -0,0 +1,76 @@
+"""LRU cache of serialized API responses."""
+from collections import OrderedDict
+import threading
+from typing import Dict, Hashable, NamedTuple, Optional
+
+
+class CachedResponse(NamedTuple):
+    """A response body with the headers sent alongside it."""
+    body: bytes
+    headers: Dict[str, str]
+
+
+class ResponseCache:
+    """Serialized responses keyed by request, bounded by entry count and total bytes.
+
+    Every entry is stored with a `version` token describing the data it was
+    built from, such as a collection's change counter or a row's version.
+    A lookup with a different token is a miss, so a write invalidates
+    exactly the entries built from what it changed without the cache
+    having to know which those are. Stale entries are replaced on their
+    next lookup or age out through LRU eviction.
+    """
+
+    def __init__(self, max_entries: int = 10_000, max_bytes: int = 64 * 2**20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str, version: Hashable) -> Optional[CachedResponse]:
+        """Return the cached response for `key` if it was built from `version`."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, version: Hashable, response: CachedResponse):
+        """Store a response, evicting the least recently used entries to make room."""
+        size = len(response.body)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old[1].body)
+            self._entries[key] = (version, response)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= len(evicted.body)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry, keeping the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Hit, miss and eviction counters plus the current size."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+            }
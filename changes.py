@@ -0,0 +1,172 @@
+"""In-process change feed: a ring buffer of row changes and async subscribers to it.
+
+A log can also mirror a feed shared by several processes, such as the SQLite
+engine's change table, by appending each change with the sequence number
+the shared feed gave it.
+"""
+import asyncio
+import secrets
+import threading
+from typing import Any, AsyncIterator, Callable, Container, List, Optional
+
+from pydantic_core import to_json
+
+from storage import SequenceExpiredError
+
+
+class ChangeEvent:
+    """One committed create, update or delete of a row."""
+
+    __slots__ = ("epoch", "seq", "table", "op", "id", "row", "_json")
+
+    def __init__(self, epoch: str, seq: int, table: str, op: str, row_id: int, row: Optional[Any]):
+        self.epoch = epoch
+        self.seq = seq
+        self.table = table
+        self.op = op
+        self.id = row_id
+        # The row as written, or its JSON decoded when read back from a
+        # shared feed; None for deletes
+        self.row = row
+        self._json: Optional[bytes] = None
+
+    def json(self) -> bytes:
+        """The event as JSON, encoded once however many subscribers send it."""
+        if self._json is None:
+            self._json = to_json({
+                "epoch": self.epoch, "seq": self.seq, "table": self.table, "op": self.op, "id": self.id, "row": self.row,
+            })
+        return self._json
+
+
+class ChangeLog:
+    """The most recent `capacity` changes, numbered from 1 in commit order.
+
+    Every log has an epoch, random unless given. Each process, and each
+    restart, numbers its changes afresh, so a sequence number only
+    identifies a change together with the epoch of the log that assigned
+    it. A log mirroring a shared feed takes that feed's epoch instead.
+
+    Writers append under a short lock and never wait for readers. Readers
+    take no lock: an event is read from its slot and checked against the
+    sequence number it should have, so a slot overwritten mid-read is
+    reported as expired instead of returning the wrong event.
+    """
+
+    def __init__(self, capacity: int = 10_000, epoch: Optional[str] = None):
+        self.capacity = capacity
+        self.epoch = epoch or secrets.token_hex(4)
+        self.last_seq = 0
+        # Changes up to this one were never appended, as when a mirror
+        # starts or skips ahead, so resuming from before it has expired
+        self._first_seq = 0
+        self._events: List[Optional[ChangeEvent]] = [None] * capacity
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[], None]] = []
+
+    def append(self, op: str, table: str, row_id: int, row: Optional[Any] = None, seq: Optional[int] = None) -> int:
+        """Record a committed change and return its sequence number.
+
+        A mirror passes the `seq` its shared feed gave the change, which
+        must be after the last one; any it skipped count as expired.
+        """
+        with self._lock:
+            if seq is None:
+                seq = self.last_seq + 1
+            elif seq != self.last_seq + 1:
+                self._first_seq = seq - 1
+            self._events[seq % self.capacity] = ChangeEvent(self.epoch, seq, table, op, row_id, row)
+            self.last_seq = seq
+        for listener in self._listeners:
+            listener()
+        return seq
+
+    def add_listener(self, listener: Callable[[], None]):
+        """Call `listener` after every append, on the writing thread; it must not block."""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[], None]):
+        self._listeners.remove(listener)
+
+    def since(self, seq: int, limit: Optional[int] = None) -> List[ChangeEvent]:
+        """Events after sequence number `seq`, oldest first.
+
+        Raises SequenceExpiredError if some of them are no longer retained,
+        or if `seq` is ahead of the log, as after a restart; either way the
+        caller has to resynchronize from the full data.
+        """
+        last = self.last_seq
+        if seq > last or seq < max(last - self.capacity, self._first_seq):
+            raise SequenceExpiredError(seq)
+        if limit is not None:
+            last = min(last, seq + limit)
+        events = [self._events[s % self.capacity] for s in range(seq + 1, last + 1)]
+        if events and events[0].seq != seq + 1:
+            raise SequenceExpiredError(seq)
+        return events
+
+
+class ChangeNotifier:
+    """Wakes asyncio subscribers of a change log when it grows.
+
+    An append from any thread schedules at most one wake-up on the event
+    loop until that wake-up has run, so the cost to writers does not grow
+    with the number of subscribers; all of them wait on one shared future.
+    """
+
+    def __init__(self, log: ChangeLog, loop: asyncio.AbstractEventLoop):
+        self.log = log
+        self.loop = loop
+        self._waiter: Optional[asyncio.Future] = None
+        self._wake_scheduled = False
+        log.add_listener(self._on_append)
+
+    def close(self):
+        self.log.remove_listener(self._on_append)
+
+    def _on_append(self):
+        if not self._wake_scheduled:
+            self._wake_scheduled = True
+            try:
+                self.loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:
+                # The loop is closed, so nobody is left to wake; writers
+                # must not fail because of it
+                pass
+
+    def _wake(self):
+        self._wake_scheduled = False
+        if self._waiter is not None:
+            self._waiter.set_result(None)
+            self._waiter = None
+
+    async def wait(self, seq: int):
+        """Return once the log has an event after `seq`."""
+        while self.log.last_seq <= seq:
+            if self._waiter is None:
+                self._waiter = self.loop.create_future()
+            # Shielded so a subscriber that gives up does not cancel the
+            # future the others are waiting on
+            await asyncio.shield(self._waiter)
+
+    async def follow(self, seq: int, tables: Optional[Container[str]] = None, batch_size: int = 500,
+                     idle_timeout: Optional[float] = None) -> AsyncIterator[List[ChangeEvent]]:
+        """Yield batches of events after `seq` as they are committed, forever.
+
+        Each subscriber reads the log at its own pace, so a slow one only
+        delays itself; once it falls more than the log's capacity behind,
+        SequenceExpiredError is raised. With `idle_timeout`, an empty batch
+        is yielded after that many seconds without events, for keep-alives.
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self.wait(seq), idle_timeout)
+            except asyncio.TimeoutError:
+                yield []
+                continue
+            events = self.log.since(seq, batch_size)
+            seq = events[-1].seq
+            if tables is not None:
+                events = [event for event in events if event.table in tables]
+            if events:
+                yield events
@@ -0,0 +1,214 @@
+"""Column-oriented product table for the in-memory database."""
+from array import array
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+import time
+from typing import Dict, Hashable, Iterator, List, Optional
+
+from models import Product
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_PRODUCT_FIELDS = frozenset(Product.model_fields)
+
+
+def to_epoch_micros(value: datetime) -> int:
+    """Encode a datetime as microseconds since 1970-01-01.
+
+    Naive datetimes are stored as they are; aware ones are converted to
+    naive UTC.
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - _EPOCH) // _MICROSECOND
+
+
+# Rows created in one batch share a timestamp, so most decodes are repeats
+@lru_cache(maxsize=4096)
+def from_epoch_micros(micros: int) -> datetime:
+    """Decode a datetime stored by to_epoch_micros."""
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+class ValueDictionary:
+    """Assigns small integer codes to distinct values, freeing a code when no row uses it."""
+
+    def __init__(self):
+        self.values: list = []
+        self.codes: Dict[Hashable, int] = {}
+        self.refs: List[int] = []
+        self._free: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def encode(self, value: Hashable) -> int:
+        """Return the code of a value, counting one more row that uses it."""
+        code = self.codes.get(value)
+        if code is None:
+            if self._free:
+                code = self._free.pop()
+                self.values[code] = value
+                self.refs[code] = 0
+            else:
+                code = len(self.values)
+                self.values.append(value)
+                self.refs.append(0)
+            self.codes[value] = code
+        self.refs[code] += 1
+        return code
+
+    def release(self, code: int):
+        """Count one row fewer using a code, freeing it when none are left."""
+        self.refs[code] -= 1
+        if not self.refs[code]:
+            del self.codes[self.values[code]]
+            self._free.append(code)
+
+
+class ColumnarProductTable(MutableMapping):
+    """Products stored column by column, behaving as a dict of id -> Product.
+
+    Ids index the columns directly. Prices, stock flags, versions,
+    modification sequence numbers and creation times (as epoch microseconds) live in typed arrays; categories
+    and tag lists are dictionary-encoded, so each row only holds a code
+    for them. Only names and descriptions stay Python strings. A Product is
+    built when a row is read and is not kept.
+
+    Rows are updated in place, so reads follow a seqlock protocol instead
+    of relying on stored rows being immutable: a writer sets the row's
+    version to minus its old value while it changes the columns, and a
+    reader retries if the version it started with has changed by the time
+    it has read the row. Versions only grow and ids are never reused, so
+    a reader cannot mistake a changed row for the one it started with.
+    Writes must be serialized by the caller.
+    """
+
+    def __init__(self):
+        # Version 0 marks an id with no row
+        self._versions = array("q", [0])
+        self._seqs = array("q", [0])
+        self._prices = array("d", [0.0])
+        self._in_stock = array("b", [0])
+        self._created_at = array("q", [0])
+        self._categories = array("I", [0])
+        self._tags = array("I", [0])
+        self._names: List[Optional[str]] = [None]
+        self._descriptions: List[Optional[str]] = [None]
+        self.category_codes = ValueDictionary()
+        self.tag_list_codes = ValueDictionary()
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _version(self, product_id: int) -> int:
+        if 0 <= product_id < len(self._versions):
+            return self._versions[product_id]
+        return 0
+
+    def __contains__(self, product_id) -> bool:
+        return isinstance(product_id, int) and self._version(product_id) != 0
+
+    def _build(self, product_id: int, version: int) -> Product:
+        # What Product.model_construct does, without its per-field default
+        # handling, which takes most of the time when every field is given
+        product = object.__new__(Product)
+        object.__setattr__(product, "__dict__", {
+            "id": product_id,
+            "name": self._names[product_id],
+            "description": self._descriptions[product_id],
+            "price": self._prices[product_id],
+            "category": self.category_codes.values[self._categories[product_id]],
+            "tags": list(self.tag_list_codes.values[self._tags[product_id]]),
+            "in_stock": bool(self._in_stock[product_id]),
+            "created_at": from_epoch_micros(self._created_at[product_id]),
+            "version": version,
+            "seq": self._seqs[product_id],
+        })
+        object.__setattr__(product, "__pydantic_fields_set__", set(_PRODUCT_FIELDS))
+        object.__setattr__(product, "__pydantic_extra__", None)
+        object.__setattr__(product, "__pydantic_private__", None)
+        return product
+
+    def get(self, product_id: int, default=None) -> Optional[Product]:
+        while True:
+            version = self._version(product_id)
+            if version == 0:
+                return default
+            if version < 0:
+                # A writer is part way through this row; let it finish
+                time.sleep(0)
+                continue
+            product = self._build(product_id, version)
+            if self._versions[product_id] == version:
+                return product
+
+    def __getitem__(self, product_id: int) -> Product:
+        product = self.get(product_id)
+        if product is None:
+            raise KeyError(product_id)
+        return product
+
+    def __iter__(self) -> Iterator[int]:
+        versions = self._versions
+        return (product_id for product_id in range(len(versions)) if versions[product_id] != 0)
+
+    def values(self) -> Iterator[Product]:
+        """Build every row in id order, which is also creation order."""
+        versions = self._versions
+        for product_id, version in enumerate(versions):
+            if version > 0:
+                product = self._build(product_id, version)
+                if versions[product_id] != version:
+                    product = self.get(product_id)
+                if product is not None:
+                    yield product
+            elif version < 0:
+                product = self.get(product_id)
+                if product is not None:
+                    yield product
+
+    def __setitem__(self, product_id: int, product: Product):
+        if product_id <= 0:
+            raise KeyError(product_id)
+        grow = product_id + 1 - len(self._versions)
+        if grow > 0:
+            self._versions.extend(array("q", bytes(8 * grow)))
+            self._seqs.extend(array("q", bytes(8 * grow)))
+            self._prices.extend(array("d", bytes(8 * grow)))
+            self._in_stock.extend(array("b", bytes(grow)))
+            self._created_at.extend(array("q", bytes(8 * grow)))
+            self._categories.extend(array("I", bytes(4 * grow)))
+            self._tags.extend(array("I", bytes(4 * grow)))
+            self._names.extend([None] * grow)
+            self._descriptions.extend([None] * grow)
+        old_version = self._versions[product_id]
+        if old_version:
+            self._versions[product_id] = -old_version
+            old_codes = (self._categories[product_id], self._tags[product_id])
+        else:
+            old_codes = None
+            self._len += 1
+        self._names[product_id] = product.name
+        self._descriptions[product_id] = product.description
+        self._prices[product_id] = product.price
+        self._categories[product_id] = self.category_codes.encode(product.category)
+        self._tags[product_id] = self.tag_list_codes.encode(tuple(product.tags or ()))
+        self._in_stock[product_id] = product.in_stock
+        self._created_at[product_id] = to_epoch_micros(product.created_at)
+        self._seqs[product_id] = product.seq
+        if old_codes is not None:
+            self.category_codes.release(old_codes[0])
+            self.tag_list_codes.release(old_codes[1])
+        self._versions[product_id] = product.version
+
+    def __delitem__(self, product_id: int):
+        if self._version(product_id) == 0:
+            raise KeyError(product_id)
+        self._versions[product_id] = 0
+        self._len -= 1
+        self.category_codes.release(self._categories[product_id])
+        self.tag_list_codes.release(self._tags[product_id])
+        self._names[product_id] = self._descriptions[product_id] = None
@@ -0,0 +1,37 @@
+"""Runtime configuration read from environment variables."""
+import os
+
+# Directory for the write-ahead log and snapshots; unset keeps data in memory only
+DATA_DIR = os.environ.get("DB_DATA_DIR") or None
+# fsync policy for the write-ahead log: "always", "batch" or "never"
+WAL_FSYNC = os.environ.get("DB_WAL_FSYNC", "batch")
+# Number of logged changes between snapshots
+SNAPSHOT_EVERY = int(os.environ.get("DB_SNAPSHOT_EVERY", "100000"))
+# Seed a new database with the sample products ("1"); off by default
+SAMPLE_DATA = os.environ.get("DB_SAMPLE_DATA", "0") == "1"
+# Storage engine: "memory" or "sqlite"
+BACKEND = os.environ.get("DB_BACKEND", "memory")
+# Recent changes kept for change feed subscribers to resume from
+CHANGE_LOG_CAPACITY = int(os.environ.get("DB_CHANGE_LOG_CAPACITY", "10000"))
+# Seconds a deleted product's tombstone is kept for delta sync clients
+TOMBSTONE_RETENTION = float(os.environ.get("DB_TOMBSTONE_RETENTION", str(7 * 24 * 3600)))
+# Mapped snapshot file the in-memory tables are served from instead of the
+# sample data; writes on top of it are not persisted
+MAPPED_SNAPSHOT = os.environ.get("DB_MAPPED_SNAPSHOT") or None
+# Layout of the in-memory products table: "rows" or "columnar"
+PRODUCT_STORE = os.environ.get("DB_PRODUCT_STORE", "rows")
+# SQLite database file and the number of pooled connections to it
+SQLITE_PATH = os.environ.get("DB_SQLITE_PATH", "app.sqlite3")
+SQLITE_POOL_SIZE = int(os.environ.get("DB_SQLITE_POOL_SIZE", "8"))
+# uvicorn worker processes started by `python main.py`; more than one needs the sqlite backend
+WORKERS = int(os.environ.get("API_WORKERS", "1"))
+# Bounds of the cache of serialized GET responses; 0 entries disables it
+CACHE_MAX_ENTRIES = int(os.environ.get("API_CACHE_MAX_ENTRIES", "10000"))
+CACHE_MAX_BYTES = int(os.environ.get("API_CACHE_MAX_BYTES", str(64 * 2**20)))
+# Encoder for JSON responses: "response_model" validates them first; "pydantic" or
+# "orjson" (needs the orjson package) skip that for speed
+JSON_ENCODER = os.environ.get("API_JSON_ENCODER", "response_model")
+# Record request and storage latencies and serve them at GET /metrics ("0" turns it off)
+METRICS = os.environ.get("API_METRICS", "1") == "1"
+# Token admin requests send in X-Admin-Token; unset disables the admin endpoints and request tracing
+ADMIN_TOKEN = os.environ.get("API_ADMIN_TOKEN") or None
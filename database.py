@@ -1,184 +1,1013 @@
 """Database module for in-memory product storage."""
-from typing import List, Optional
-from datetime import datetime
+from collections import deque
+from contextlib import contextmanager
+import math
+import os
+import threading
+from typing import Any, Container, Dict, Iterable, Iterator, List, MutableMapping, Optional, Set, Tuple
+from datetime import datetime, timedelta
 
-from models import Product, ProductCreate, ProductUpdate, User, UserCreate, UserUpdate, Setting, SettingCreate, SettingUpdate
+from analytics import GroupTotalsView, ProductColumns, default_product_views
+from changes import ChangeLog
+from columnar import ColumnarProductTable
+import config
+from locks import ReadWriteLock
+from mapped import MappedSnapshot, OverlayTable, write_mapped
+from indexes import OrderedIdIndex, SortedIndex, first_ids_after, index_add, index_remove
+from persistence import SNAPSHOT_FILE, WAL_FILE, WriteAheadLog, read_snapshot, read_wal, write_snapshot
+from search import SearchIndex
+from storage import (
+    BACKENDS, DuplicateKeyError, InvalidCursorError, NotFoundError, SequenceExpiredError, StorageBackend,
+    VersionConflictError, sample_products, setting_changes,
+)
+from models import (
+    GroupTotals, PriceStats, Product, ProductChanges, ProductCreate, ProductTombstone, ProductUpdate,
+    ProductBatchUpdate,
+    User, UserCreate, UserUpdate, UserBatchUpdate,
+    Setting, SettingCreate, SettingUpdate, SettingBatchUpdate,
+)
+
+# Product fields covered by the full-text search index
+SEARCHABLE_PRODUCT_FIELDS = frozenset({"name", "description", "tags"})
+# Product fields that have a secondary index
+INDEXED_PRODUCT_FIELDS = frozenset({"category", "tags", "in_stock", "price"}) | SEARCHABLE_PRODUCT_FIELDS
+# Product fields copied into the aggregate columns
+COLUMN_PRODUCT_FIELDS = frozenset({"category", "in_stock", "price"})
+# Layouts for the products table: a dict of models, or ColumnarProductTable
+PRODUCT_STORES = ("rows", "columnar")
 
 
 class InMemoryDatabase:
-    """In-memory database for storing and managing products."""
+    """In-memory database for storing and managing products.
+
+    With a `data_dir`, every change is also written to a write-ahead log in
+    that directory and the tables are snapshotted every `snapshot_every` log
+    records. A new instance pointed at the same directory recovers its rows
+    from the last snapshot plus the log tail. Without a data directory, or
+    with an empty one, the database starts with the sample products unless
+    `sample_data` is false.
+
+    The database is safe to use from many threads. Each collection has a
+    reader-writer lock: writes, including id allocation, hold it
+    exclusively, and multi-row reads share it. Stored rows are never
+    modified; an update stores a changed copy, so a single-row lookup
+    needs no lock and never sees a half-applied update.
+
+    With `product_store="columnar"`, products are kept in a
+    ColumnarProductTable, which uses far less memory per row and builds
+    Product models only when rows are read.
+
+    With a `mapped_snapshot` file, written by write_mapped_snapshot, the
+    tables are served from the memory-mapped file instead of the sample
+    data: rows are decoded as they are read, and writes are kept in memory
+    over the file and lost on restart. Lookups by id and paging start at
+    once, whatever the size of the file. The secondary indexes are built
+    by a background thread, unless `index_in_background` is false; a
+    query or write that needs a table's indexes before then waits for
+    them, or builds them itself. Until the build is over, async callers
+    are asked to run calls in threads, so the wait never holds up an
+    event loop.
+    """
+
+    # Threads async callers may use when calls block on the write-ahead log
+    DURABLE_EXECUTOR_WORKERS = 4
 
-    def __init__(self):
-        self.products: List[Product] = []
-        self.users: List[User] = []
-        self.settings: List[Setting] = []
+    def __init__(self, data_dir: Optional[str] = None, fsync: str = "batch", snapshot_every: int = 100_000,
+                 product_store: str = "rows", change_log_capacity: int = 10_000,
+                 tombstone_retention: float = 7 * 24 * 3600, mapped_snapshot: Optional[str] = None,
+                 sample_data: bool = True, index_in_background: bool = True):
+        if product_store not in PRODUCT_STORES:
+            raise ValueError(f"Unknown product store {product_store!r}, expected one of {PRODUCT_STORES}")
+        if mapped_snapshot is not None and data_dir is not None:
+            raise ValueError("A mapped snapshot cannot be combined with a data directory")
+        # Each collection is keyed by id. Dicts preserve insertion order, so
+        # get_all_* still returns rows in the order they were created; the
+        # columnar table returns them in id order, which is the same.
+        self.products: MutableMapping[int, Product] = {} if product_store == "rows" else ColumnarProductTable()
+        self.users: MutableMapping[int, User] = {}
+        self.settings: MutableMapping[int, Setting] = {}
+        self.product_ids = OrderedIdIndex()
+        self.user_ids = OrderedIdIndex()
+        self.setting_ids = OrderedIdIndex()
+        # Secondary product indexes: category -> ids, tag -> ids, in_stock -> ids
+        self.products_by_category: Dict[str, Set[int]] = {}
+        self.products_by_tag: Dict[str, Set[int]] = {}
+        self.products_by_stock: Dict[bool, Set[int]] = {}
+        # Sorted (price, id) pairs for price range scans
+        self.products_by_price = SortedIndex()
+        self.product_search = SearchIndex()
+        # Price, category and stock columns for aggregates
+        self.product_columns = ProductColumns()
+        # Sorted (seq, id) pairs of live products and tombstones, for delta sync
+        self.products_by_seq = SortedIndex()
+        # Tombstones of deleted products by id, and in sequence order for
+        # purging once they are older than tombstone_retention seconds
+        self.product_tombstones: Dict[int, ProductTombstone] = {}
+        self._tombstone_queue: deque = deque()
+        self.tombstone_retention = tombstone_retention
+        # Last product modification sequence number assigned, and the
+        # highest one whose tombstone has been purged
+        self.product_seq = 0
+        self.tombstone_horizon = 0
+        # Materialized views by name, updated by every product write
+        self.product_views: Dict[str, GroupTotalsView] = {view.name: view for view in default_product_views()}
+        # Unique indexes: email -> user id, key -> setting id
+        self.users_by_email: Dict[str, int] = {}
+        self.settings_by_key: Dict[str, int] = {}
         self.next_id = 1
         self.next_user_id = 1
         self.next_setting_id = 1
-        self._init_sample_data()
+        self.locks = {table: ReadWriteLock() for table in self.TABLES}
+        # Tables served from a mapped snapshot whose secondary indexes are not built yet
+        self._unindexed: Set[str] = set()
+        self._index_lock = threading.Lock()
+        self._index_thread: Optional[threading.Thread] = None
+        self.collection_versions = {table: 0 for table in self.TABLES}
+        self.wal: Optional[WriteAheadLog] = None
+        # Changes made by the write in progress on each collection, logged together when it completes
+        self._wal_changes: Dict[str, list] = {table: [] for table in self.TABLES}
+        # Set once the tables are loaded, so seeding and recovery are not reported as changes
+        self.changes: Optional[ChangeLog] = None
+        self.data_dir = data_dir
+        self.snapshot_every = snapshot_every
+        # LSN of the last snapshot, and whether a new one is due
+        self._snapshot_lsn = 0
+        self._snapshot_due = False
+        self._snapshot_lock = threading.Lock()
+        # Logging writes to disk, so async callers offload calls to threads
+        self.executor_workers = None if data_dir is None else self.DURABLE_EXECUTOR_WORKERS
+        recovered_lsn = None
+        if data_dir is not None:
+            recovered_lsn = self._recover(data_dir)
+            self.wal = WriteAheadLog(os.path.join(data_dir, WAL_FILE), fsync=fsync, lsn=recovered_lsn or 0)
+        if mapped_snapshot is not None:
+            self._map_snapshot(mapped_snapshot)
+        elif recovered_lsn is None and sample_data:
+            self._init_sample_data()
+        self.changes = ChangeLog(change_log_capacity)
+        if self._unindexed and index_in_background:
+            self.executor_workers = self.DURABLE_EXECUTOR_WORKERS
+            self._index_thread = threading.Thread(target=self._build_indexes, name="index-build", daemon=True)
+            self._index_thread.start()
 
     def _init_sample_data(self):
         """Initialize the database with sample product data."""
-        sample_products = [
-            ProductCreate(
-                name="Wireless Headphones",
-                description="High-quality wireless headphones with noise cancellation",
-                price=199.99,
-                category="Electronics",
-                tags=["audio", "wireless", "premium"]
-            ),
-            ProductCreate(
-                name="Coffee Maker",
-                description="Programmable coffee maker with built-in grinder",
-                price=89.99,
-                category="Appliances",
-                tags=["kitchen", "coffee", "automatic"]
-            ),
-            ProductCreate(
-                name="Laptop Stand",
-                description="Adjustable aluminum laptop stand for ergonomic work",
-                price=45.99,
-                category="Accessories",
-                tags=["ergonomic", "aluminum", "adjustable"]
+        for product_data in sample_products():
+            self.create_product(product_data)
+
+    # Tables by name, with their model and the attribute holding the next id
+    TABLES = {
+        "products": (Product, "next_id"),
+        "users": (User, "next_user_id"),
+        "settings": (Setting, "next_setting_id"),
+    }
+
+    def _map_snapshot(self, path: str):
+        """Serve every table from a mapped snapshot, deferring their secondary indexes."""
+        snapshot = MappedSnapshot(path)
+        for table, (_, next_attr) in self.TABLES.items():
+            base = snapshot.tables[table]
+            # New rows go to the empty table of the configured layout
+            setattr(self, table, OverlayTable(base, getattr(self, table)))
+            setattr(self, f"{table[:-1]}_ids", OrderedIdIndex(base.ids))
+            setattr(self, next_attr, snapshot.counters["next_ids"][table])
+            self._unindexed.add(table)
+        self.product_seq = snapshot.counters["product_seq"]
+        self.tombstone_horizon = snapshot.counters["tombstone_horizon"]
+
+    def _ensure_indexed(self, table: str):
+        """Build a mapped table's secondary indexes, if that has not been done yet."""
+        if table not in self._unindexed:
+            return
+        with self._index_lock:
+            if table not in self._unindexed:
+                return
+            if table == "products":
+                for product in self.products.values():
+                    self.products_by_seq.add((product.seq, product.id))
+                    self._index_product(product)
+                    self._update_product_views(None, product)
+            elif table == "users":
+                self.users_by_email.update((user.email, user.id) for user in self.users.values())
+            else:
+                self.settings_by_key.update((setting.key, setting.id) for setting in self.settings.values())
+            self._unindexed.discard(table)
+
+    def _build_indexes(self):
+        """Build every mapped table's secondary indexes, then let async callers stay on the event loop."""
+        for table in self.TABLES:
+            # Under the read lock, as when a query builds them, so no write changes the table mid-build
+            with self.locks[table].read():
+                self._ensure_indexed(table)
+        self.executor_workers = None
+
+    def write_mapped_snapshot(self, path: str):
+        """Atomically write every table to a file that `mapped_snapshot` can serve.
+
+        Tombstones are not written; delta sync clients that synced before
+        the last delete have to sync from 0 against the file.
+        """
+        with self.locks["products"].read(), self.locks["users"].read(), self.locks["settings"].read():
+            horizon = max([self.tombstone_horizon, *(tombstone.seq for tombstone in self._tombstone_queue)])
+            write_mapped(
+                path,
+                {table: getattr(self, f"{table[:-1]}_ids").rows(getattr(self, table)) for table in self.TABLES},
+                {
+                    "next_ids": {table: getattr(self, next_attr) for table, (_, next_attr) in self.TABLES.items()},
+                    "product_seq": self.product_seq,
+                    "tombstone_horizon": horizon,
+                },
             )
-        ]
 
-        for product_data in sample_products:
-            self.create_product(product_data)
+    def _recover(self, data_dir: str) -> Optional[int]:
+        """Load the snapshot and replay the log tail.
+
+        Returns the last recovered log sequence number, or None if the
+        directory held no data yet.
+        """
+        os.makedirs(data_dir, exist_ok=True)
+        header, rows = read_snapshot(os.path.join(data_dir, SNAPSHOT_FILE))
+        snapshot_lsn = 0
+        if header is not None:
+            snapshot_lsn = header["lsn"]
+            for table, row_json in rows:
+                if table == "product_tombstones":
+                    self._insert_tombstone(ProductTombstone.model_validate_json(row_json))
+                    continue
+                model, _ = self.TABLES[table]
+                getattr(self, f"_insert_{table[:-1]}")(model.model_validate_json(row_json))
+            for table, (_, next_attr) in self.TABLES.items():
+                setattr(self, next_attr, header["next_ids"][table])
+            self.product_seq = max(self.product_seq, header.get("product_seq", 0))
+            self.tombstone_horizon = header.get("tombstone_horizon", 0)
+
+        self._snapshot_lsn = lsn = snapshot_lsn
+        for record in read_wal(os.path.join(data_dir, WAL_FILE)):
+            lsn = record["lsn"]
+            if lsn <= snapshot_lsn:
+                continue
+            self._replay(record)
+        if header is None and lsn == 0:
+            return None
+        return lsn
+
+    def _replay(self, record: Dict[str, Any]):
+        """Apply one log record to the tables and indexes."""
+        table = record["table"]
+        model, next_attr = self.TABLES[table]
+        entity = table[:-1]
+        existing = getattr(self, table).get(record["id"])
+        if record["op"] == "delete":
+            if existing is None:
+                return
+            if "row" in record:
+                # Product deletes log their tombstone, so retention runs from the delete, not the restart
+                self._remove_product(existing, ProductTombstone.model_validate(record["row"]))
+            else:
+                getattr(self, f"_remove_{entity}")(existing)
+            return
+        row = model.model_validate(record["row"])
+        if existing is None:
+            getattr(self, f"_insert_{entity}")(row)
+            setattr(self, next_attr, max(getattr(self, next_attr), row.id + 1))
+        else:
+            update_dict = {field: getattr(row, field) for field in model.model_fields if field != "id"}
+            getattr(self, f"_apply_{entity}_update")(existing, update_dict)
+
+    def _log(self, op: str, table: str, row_id: int, row: Optional[Any] = None):
+        """Publish a change to the change log and queue it for the write-ahead log, if enabled.
+
+        Deletes log the row's tombstone, if it has one, which the change log
+        does not carry.
+        """
+        if self.changes is not None:
+            self.changes.append(op, table, row_id, None if op == "delete" else row)
+        if self.wal is not None:
+            self._wal_changes[table].append((op, table, row_id, row))
+
+    def _commit_log(self, table: str):
+        """Append the changes of a completed write to the write-ahead log as one batch."""
+        changes = self._wal_changes[table]
+        if self.wal is None or not changes:
+            return
+        lsn = self.wal.append_batch(changes)
+        if lsn - self._snapshot_lsn >= self.snapshot_every:
+            self._snapshot_due = True
+
+    @contextmanager
+    def _writing(self, table: str) -> Iterator[None]:
+        """Hold a collection's write lock, then take a snapshot if one is due.
+
+        A write that completes bumps the collection's change counter and
+        logs its changes in one batch, so a multi-row write is recovered
+        whole or not at all.
+        """
+        with self.locks[table].write():
+            self._ensure_indexed(table)
+            try:
+                yield
+                self._commit_log(table)
+            finally:
+                self._wal_changes[table].clear()
+            self.collection_versions[table] += 1
+        # Snapshots lock every collection, so they run after the write lock
+        # is released
+        if self._snapshot_due:
+            self.snapshot()
+
+    def collection_version(self, table: str) -> int:
+        """Change counter of a collection, bumped by every write to it."""
+        return self.collection_versions[table]
+
+    def row_counts(self) -> Dict[str, int]:
+        """Number of rows in each collection."""
+        return {table: len(getattr(self, table)) for table in self.TABLES}
+
+    def snapshot(self):
+        """Write a snapshot of every table and truncate the write-ahead log."""
+        with self._snapshot_lock:
+            if self.wal is None:
+                return
+            # Read locks on every collection, always taken in the same order,
+            # hold off writes so the tables and the LSN are consistent
+            with self.locks["products"].read(), self.locks["users"].read(), self.locks["settings"].read():
+                self.wal.sync()
+                write_snapshot(
+                    os.path.join(self.data_dir, SNAPSHOT_FILE),
+                    self.wal.lsn,
+                    {table: getattr(self, next_attr) for table, (_, next_attr) in self.TABLES.items()},
+                    {
+                        **{table: getattr(self, table).values() for table in self.TABLES},
+                        "product_tombstones": self._tombstone_queue,
+                    },
+                    {"product_seq": self.product_seq, "tombstone_horizon": self.tombstone_horizon},
+                )
+                self.wal.truncate()
+                self._snapshot_lsn = self.wal.lsn
+                self._snapshot_due = False
+
+    def close(self):
+        """Flush and close the write-ahead log."""
+        if self.wal is not None:
+            self.wal.close()
+            self.wal = None
+
+    @staticmethod
+    def _check_version(row: Any, expected_versions: Optional[Container[int]]):
+        """Raise VersionConflictError unless the row has one of the expected versions."""
+        if expected_versions is not None and row.version not in expected_versions:
+            raise VersionConflictError(f"Row {row.id} is at version {row.version}")
+
+    @staticmethod
+    def _get_batch(table: Dict[int, Any], ids: List[int]) -> list:
+        """Look up every id in a table, raising NotFoundError if any is missing."""
+        missing = [row_id for row_id in ids if row_id not in table]
+        if missing:
+            raise NotFoundError(missing)
+        return [table[row_id] for row_id in ids]
+
+    def _index_product(self, product: Product, fields: Iterable[str] = INDEXED_PRODUCT_FIELDS):
+        """Add a product to the secondary indexes for the given fields."""
+        if "category" in fields:
+            index_add(self.products_by_category, product.category, product.id)
+        if "tags" in fields:
+            for tag in product.tags or []:
+                index_add(self.products_by_tag, tag, product.id)
+        if "in_stock" in fields:
+            index_add(self.products_by_stock, product.in_stock, product.id)
+        if "price" in fields:
+            self.products_by_price.add((product.price, product.id))
+        if SEARCHABLE_PRODUCT_FIELDS.intersection(fields):
+            text = " ".join([product.name, product.description, *(product.tags or [])])
+            self.product_search.add(product.id, text)
+        if COLUMN_PRODUCT_FIELDS.intersection(fields):
+            self.product_columns.add(product.id, product.price, product.category, product.in_stock)
+
+    def _unindex_product(self, product: Product, fields: Iterable[str] = INDEXED_PRODUCT_FIELDS):
+        """Remove a product from the secondary indexes for the given fields."""
+        if "category" in fields:
+            index_remove(self.products_by_category, product.category, product.id)
+        if "tags" in fields:
+            for tag in product.tags or []:
+                index_remove(self.products_by_tag, tag, product.id)
+        if "in_stock" in fields:
+            index_remove(self.products_by_stock, product.in_stock, product.id)
+        if "price" in fields:
+            self.products_by_price.remove((product.price, product.id))
+        if SEARCHABLE_PRODUCT_FIELDS.intersection(fields):
+            self.product_search.remove(product.id)
+        if COLUMN_PRODUCT_FIELDS.intersection(fields):
+            self.product_columns.remove(product.id)
+
+    def _update_product_views(self, before: Optional[Product], after: Optional[Product],
+                              fields: Iterable[str] = INDEXED_PRODUCT_FIELDS):
+        """Apply a product write to the materialized views that read any of the changed fields."""
+        for view in self.product_views.values():
+            if before is None or after is None or view.fields.intersection(fields):
+                view.apply(before, after)
+
+    def _stamp_product(self, product: Product):
+        """Give a product written without a modification sequence number the next one.
+
+        Rows read back from a snapshot or the log keep theirs and only move
+        the counter past it.
+        """
+        if not product.seq:
+            product.seq = self.product_seq + 1
+        self.product_seq = max(self.product_seq, product.seq)
+
+    def _insert_product(self, product: Product):
+        """Store a new product and add it to every index."""
+        self._stamp_product(product)
+        self.products[product.id] = product
+        self.product_ids.add(product.id)
+        self.products_by_seq.add((product.seq, product.id))
+        self._index_product(product)
+        self._update_product_views(None, product)
+        self._log("insert", "products", product.id, product)
+
+    def _apply_product_update(self, product: Product, update_dict: dict) -> Product:
+        """Replace a stored product with a copy carrying validated field changes.
+
+        The copy's version is one higher and its modification sequence
+        number is the next one, unless `update_dict` sets them, as log
+        replay does.
+        """
+        updated = product.model_copy(update={"version": product.version + 1, "seq": 0, **update_dict})
+        self._stamp_product(updated)
+        indexed_fields = INDEXED_PRODUCT_FIELDS.intersection(update_dict)
+        self._unindex_product(product, indexed_fields)
+        self.products[product.id] = updated
+        self.products_by_seq.remove((product.seq, product.id))
+        self.products_by_seq.add((updated.seq, updated.id))
+        self._index_product(updated, indexed_fields)
+        self._update_product_views(product, updated, update_dict)
+        self._log("update", "products", product.id, updated)
+        return updated
+
+    def _remove_product(self, product: Product, tombstone: Optional[ProductTombstone] = None):
+        """Remove a stored product from the table and every index, leaving a tombstone.
+
+        The tombstone is stamped now with the next sequence number, unless
+        log replay passes the one recorded by the delete.
+        """
+        del self.products[product.id]
+        self._unindex_product(product)
+        self._update_product_views(product, None)
+        self.product_ids.discard(self.products)
+        self.products_by_seq.remove((product.seq, product.id))
+        if tombstone is None:
+            tombstone = ProductTombstone.model_construct(id=product.id, seq=self.product_seq + 1,
+                                                         deleted_at=datetime.now())
+        self._purge_tombstones(tombstone.deleted_at)
+        self._insert_tombstone(tombstone)
+        self._log("delete", "products", product.id, tombstone)
+
+    def _insert_tombstone(self, tombstone: ProductTombstone):
+        """Record a deleted product for delta sync."""
+        self.product_tombstones[tombstone.id] = tombstone
+        self._tombstone_queue.append(tombstone)
+        self.products_by_seq.add((tombstone.seq, tombstone.id))
+        self.product_seq = max(self.product_seq, tombstone.seq)
+
+    def _purge_tombstones(self, now: datetime):
+        """Drop tombstones older than the retention window, oldest first."""
+        cutoff = now - timedelta(seconds=self.tombstone_retention)
+        queue = self._tombstone_queue
+        while queue and queue[0].deleted_at < cutoff:
+            tombstone = queue.popleft()
+            del self.product_tombstones[tombstone.id]
+            self.products_by_seq.remove((tombstone.seq, tombstone.id))
+            self.tombstone_horizon = max(self.tombstone_horizon, tombstone.seq)
 
     def create_product(self, product_data: ProductCreate) -> Product:
         """Create a new product in the database."""
-        product = Product(
-            id=self.next_id,
-            **product_data.dict(),
-            created_at=datetime.now()
-        )
-        self.products.append(product)
-        self.next_id += 1
+        with self._writing("products"):
+            product = Product(
+                id=self.next_id,
+                **product_data.dict(),
+                created_at=datetime.now()
+            )
+            self._insert_product(product)
+            self.next_id += 1
         return product
 
+    def create_products(self, products_data: List[ProductCreate]) -> List[Product]:
+        """Create a batch of products with a contiguous block of ids."""
+        created_at = datetime.now()
+        # The input is already validated, so skip re-validating every row
+        rows = [product_data.model_dump() for product_data in products_data]
+        with self._writing("products"):
+            first_id = self.next_id
+            products = [
+                Product.model_construct(id=first_id + i, **row, created_at=created_at)
+                for i, row in enumerate(rows)
+            ]
+            self.next_id += len(products)
+            for product in products:
+                self._insert_product(product)
+        return products
+
     def get_all_products(self) -> List[Product]:
         """Get all products from the database."""
-        return self.products
+        with self.locks["products"].read():
+            return list(self.products.values())
+
+    def get_products_page(self, after_id: Optional[int] = None, limit: Optional[int] = None) -> Tuple[List[Product], Optional[int]]:
+        """Get products with id greater than after_id, plus the cursor for the next page."""
+        with self.locks["products"].read():
+            return self.product_ids.page(self.products, after_id, limit)
+
+    def find_products(
+        self,
+        category: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        in_stock: Optional[bool] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        sort: str = "id",
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> Tuple[List[Product], Optional[int]]:
+        """Get products matching every given filter, plus the cursor for the next page.
+
+        Results are ordered by id, or by price when sort is "price" (cheapest
+        first) or "-price" (most expensive first). Matches are found through
+        the secondary indexes, so the cost depends on the size of the
+        matching index entries, not the table.
+        """
+        with self.locks["products"].read():
+            if (category is not None or tags or in_stock is not None or min_price is not None
+                    or max_price is not None or sort != "id"):
+                self._ensure_indexed("products")
+            return self._find_products(category, tags, in_stock, min_price, max_price, sort, after_id, limit)
+
+    def _find_products(self, category: Optional[str], tags: Optional[List[str]], in_stock: Optional[bool],
+                       min_price: Optional[float], max_price: Optional[float], sort: str,
+                       after_id: Optional[int], limit: Optional[int]) -> Tuple[List[Product], Optional[int]]:
+        """find_products without locking."""
+        candidates: List[Set[int]] = []
+        if category is not None:
+            candidates.append(self.products_by_category.get(category, set()))
+        for tag in tags or []:
+            candidates.append(self.products_by_tag.get(tag, set()))
+        if in_stock is not None:
+            candidates.append(self.products_by_stock.get(in_stock, set()))
+        candidates.sort(key=len)
+        matches = candidates[0].intersection(*candidates[1:]) if candidates else None
+
+        if sort in ("price", "-price"):
+            return self._find_products_by_price(matches, min_price, max_price, sort == "-price", after_id, limit)
+
+        if min_price is not None or max_price is not None:
+            in_range = {product_id for _, product_id in self._price_range(min_price, max_price)}
+            matches = in_range if matches is None else matches & in_range
+        if matches is None:
+            return self.product_ids.page(self.products, after_id, limit)
+
+        ids = first_ids_after(matches, after_id, None if limit is None else limit + 1)
+        next_cursor = None
+        if limit is not None and len(ids) > limit:
+            ids = ids[:limit]
+            next_cursor = ids[-1]
+        return [self.products[i] for i in ids], next_cursor
+
+    def search_products(self, query: str, limit: int = 10) -> List[Product]:
+        """Full-text search over product name, description and tags, best match first."""
+        with self.locks["products"].read():
+            self._ensure_indexed("products")
+            return [self.products[i] for i, _ in self.product_search.search(query, limit)]
+
+    def product_stats(self, group_by: Optional[str] = None) -> List[PriceStats]:
+        """Count, sum, min, max and average price of all products, or of each group.
+
+        `group_by` is "category", "in_stock" or "tag"; a product counts once
+        for each of its tags. Computed over the aggregate columns in batches
+        rather than row by row.
+        """
+        with self.locks["products"].read():
+            self._ensure_indexed("products")
+            id_groups = {
+                None: {None: self.products},
+                "category": self.products_by_category,
+                "in_stock": self.products_by_stock,
+                "tag": self.products_by_tag,
+            }[group_by]
+            return self.product_columns.stats(group_by, id_groups)
+
+    def register_product_view(self, view: GroupTotalsView):
+        """Add a materialized view, computing it from the current products."""
+        with self._writing("products"):
+            view.totals = {}
+            for product in self.products.values():
+                view.apply(None, product)
+            self.product_views[view.name] = view
+
+    def product_view(self, name: str) -> Optional[List[GroupTotals]]:
+        """Read the rows of a materialized view, or None if there is no view by that name."""
+        with self.locks["products"].read():
+            self._ensure_indexed("products")
+            view = self.product_views.get(name)
+            return None if view is None else view.rows()
+
+    def product_changes(self, since: int, limit: Optional[int] = None) -> ProductChanges:
+        """Products created, updated or deleted after modification sequence number `since`.
+
+        Changes come oldest first through the sequence index, so the cost
+        depends on the number of changes, not the table. A row changed
+        several times appears once, as it is now. `since` 0 returns every
+        product. Raises SequenceExpiredError if tombstones after `since`
+        have been purged, or if `since` is ahead of the database; the
+        caller then has to sync from 0.
+        """
+        with self.locks["products"].read():
+            self._ensure_indexed("products")
+            if since > self.product_seq or 0 < since < self.tombstone_horizon:
+                raise SequenceExpiredError(since)
+            products, deleted = [], []
+            seq, more = self.product_seq, False
+            for change_seq, product_id in self.products_by_seq.irange((since + 1,)):
+                if limit is not None and len(products) + len(deleted) == limit:
+                    more = True
+                    break
+                seq = change_seq
+                tombstone = self.product_tombstones.get(product_id)
+                if tombstone is None:
+                    products.append(self.products[product_id])
+                else:
+                    deleted.append(tombstone)
+            if not more:
+                seq = self.product_seq
+        return ProductChanges.model_construct(seq=seq, products=products, deleted=deleted, more=more)
+
+    def _price_range(self, min_price: Optional[float], max_price: Optional[float],
+                     reverse: bool = False, after: Optional[Tuple[float, int]] = None):
+        """Iterate (price, id) pairs within a price range, resuming after `after`."""
+        # (price,) sorts before every (price, id) and (price, inf) after them
+        low = None if min_price is None else (min_price,)
+        high = None if max_price is None else (max_price, math.inf)
+        low_inclusive = high_inclusive = True
+        if after is not None and not reverse and (low is None or after >= low):
+            low, low_inclusive = after, False
+        if after is not None and reverse and (high is None or after <= high):
+            high, high_inclusive = after, False
+        return self.products_by_price.irange(low, high, reverse, low_inclusive, high_inclusive)
+
+    def _find_products_by_price(self, matches: Optional[Set[int]], min_price: Optional[float],
+                                max_price: Optional[float], descending: bool,
+                                after_id: Optional[int], limit: Optional[int]) -> Tuple[List[Product], Optional[int]]:
+        """Walk the price index in order, keeping rows that are in `matches`."""
+        after = None
+        if after_id is not None:
+            after_product = self.products.get(after_id)
+            if after_product is None:
+                raise InvalidCursorError(f"Product {after_id} no longer exists")
+            after = (after_product.price, after_id)
+
+        products: List[Product] = []
+        for _, product_id in self._price_range(min_price, max_price, descending, after):
+            if matches is not None and product_id not in matches:
+                continue
+            if limit is not None and len(products) == limit:
+                return products, products[-1].id
+            products.append(self.products[product_id])
+        return products, None
 
     def get_product(self, product_id: int) -> Optional[Product]:
         """Get a specific product by ID."""
-        for product in self.products:
-            if product.id == product_id:
-                return product
-        return None
+        return self.products.get(product_id)
 
-    def update_product(self, product_id: int, update_data: ProductUpdate) -> Optional[Product]:
+    def update_product(self, product_id: int, update_data: ProductUpdate,
+                      expected_versions: Optional[Container[int]] = None) -> Optional[Product]:
         """Update an existing product in the database."""
-        product = self.get_product(product_id)
-        if not product:
-            return None
-
-        update_dict = update_data.dict(exclude_unset=True)
-        for field, value in update_dict.items():
-            setattr(product, field, value)
+        # No product field is nullable, so an explicit null leaves the field as it is
+        update_dict = update_data.model_dump(exclude_unset=True, exclude_none=True)
+        with self._writing("products"):
+            product = self.products.get(product_id)
+            if not product:
+                return None
+            self._check_version(product, expected_versions)
+            return self._apply_product_update(product, update_dict)
 
-        return product
+    def update_products(self, updates: List[ProductBatchUpdate]) -> List[Product]:
+        """Update a batch of products, applying nothing if any id is missing."""
+        update_dicts = [update.model_dump(exclude_unset=True, exclude_none=True, exclude={"id"}) for update in updates]
+        with self._writing("products"):
+            products = self._get_batch(self.products, [update.id for update in updates])
+            for product, update_dict in zip(products, update_dicts):
+                self._apply_product_update(self.products[product.id], update_dict)
+            return [self.products[product.id] for product in products]
 
-    def delete_product(self, product_id: int) -> bool:
+    def delete_product(self, product_id: int, expected_versions: Optional[Container[int]] = None) -> bool:
         """Delete a product from the database."""
-        for i, product in enumerate(self.products):
-            if product.id == product_id:
-                del self.products[i]
-                return True
-        return False
+        with self._writing("products"):
+            product = self.products.get(product_id)
+            if product is None:
+                return False
+            self._check_version(product, expected_versions)
+            self._remove_product(product)
+        return True
+
+    def delete_products(self, product_ids: List[int]):
+        """Delete a batch of products, deleting nothing if any id is missing."""
+        with self._writing("products"):
+            for product in self._get_batch(self.products, list(dict.fromkeys(product_ids))):
+                self._remove_product(product)
+
+    def _insert_user(self, user: User):
+        """Store a new user and add it to every index."""
+        self.users[user.id] = user
+        self.user_ids.add(user.id)
+        self.users_by_email[user.email] = user.id
+        self._log("insert", "users", user.id, user)
+
+    def _apply_user_update(self, user: User, update_dict: dict) -> User:
+        """Replace a stored user with a copy carrying validated field changes."""
+        updated = user.model_copy(update={"version": user.version + 1, **update_dict})
+        if updated.email != user.email:
+            # Replaying a batch that swapped emails applies its users one at a
+            # time, so the old email may already belong to another of them
+            if self.users_by_email.get(user.email) == user.id:
+                del self.users_by_email[user.email]
+            self.users_by_email[updated.email] = user.id
+        self.users[user.id] = updated
+        self._log("update", "users", user.id, updated)
+        return updated
+
+    def _remove_user(self, user: User):
+        """Remove a stored user from the table and every index."""
+        del self.users[user.id]
+        del self.users_by_email[user.email]
+        self.user_ids.discard(self.users)
+        self._log("delete", "users", user.id)
+
+    def _check_emails(self, emails: Dict[int, str]):
+        """Raise DuplicateKeyError unless the final emails of these users are unique.
+
+        `emails` maps user ids (or placeholders for new users) to the email
+        each will have; users outside the mapping keep their current email.
+        """
+        seen: Set[str] = set()
+        for email in emails.values():
+            owner = self.users_by_email.get(email)
+            if email in seen or (owner is not None and owner not in emails):
+                raise DuplicateKeyError(f"Email {email!r} is already registered")
+            seen.add(email)
 
     def create_user(self, user_data: UserCreate) -> User:
         """Create a new user in the database."""
-        user = User(
-            id=self.next_user_id,
-            **user_data.dict(),
-            created_at=datetime.now()
-        )
-        self.users.append(user)
-        self.next_user_id += 1
+        with self._writing("users"):
+            if user_data.email in self.users_by_email:
+                raise DuplicateKeyError(f"Email {user_data.email!r} is already registered")
+            user = User(
+                id=self.next_user_id,
+                **user_data.dict(),
+                created_at=datetime.now()
+            )
+            self._insert_user(user)
+            self.next_user_id += 1
         return user
 
+    def create_users(self, users_data: List[UserCreate]) -> List[User]:
+        """Create a batch of users, creating none if any email is taken."""
+        created_at = datetime.now()
+        rows = [user_data.model_dump() for user_data in users_data]
+        with self._writing("users"):
+            first_id = self.next_user_id
+            self._check_emails({first_id + i: row["email"] for i, row in enumerate(rows)})
+            users = [User.model_construct(id=first_id + i, **row, created_at=created_at) for i, row in enumerate(rows)]
+            self.next_user_id += len(users)
+            for user in users:
+                self._insert_user(user)
+        return users
+
     def get_all_users(self) -> List[User]:
         """Get all users from the database."""
-        return self.users
+        with self.locks["users"].read():
+            return list(self.users.values())
+
+    def get_users_page(self, after_id: Optional[int] = None, limit: Optional[int] = None) -> Tuple[List[User], Optional[int]]:
+        """Get users with id greater than after_id, plus the cursor for the next page."""
+        with self.locks["users"].read():
+            return self.user_ids.page(self.users, after_id, limit)
 
     def get_user(self, user_id: int) -> Optional[User]:
         """Get a specific user by ID."""
-        for user in self.users:
-            if user.id == user_id:
-                return user
-        return None
+        return self.users.get(user_id)
 
-    def update_user(self, user_id: int, update_data: UserUpdate) -> Optional[User]:
-        """Update an existing user in the database."""
-        user = self.get_user(user_id)
-        if not user:
+    def get_user_by_email(self, email: str) -> Optional[User]:
+        """Get a specific user by email."""
+        self._ensure_indexed("users")
+        user_id = self.users_by_email.get(email)
+        if user_id is None:
             return None
+        # Lock-free, so the user may have been deleted since the lookup
+        return self.users.get(user_id)
 
-        update_dict = update_data.dict(exclude_unset=True)
-        for field, value in update_dict.items():
-            setattr(user, field, value)
+    def update_user(self, user_id: int, update_data: UserUpdate,
+                   expected_versions: Optional[Container[int]] = None) -> Optional[User]:
+        """Update an existing user in the database."""
+        # No user field is nullable, so an explicit null leaves the field as it is
+        update_dict = update_data.model_dump(exclude_unset=True, exclude_none=True)
+        with self._writing("users"):
+            user = self.users.get(user_id)
+            if not user:
+                return None
+            self._check_version(user, expected_versions)
+            new_email = update_dict.get("email", user.email)
+            if new_email != user.email and new_email in self.users_by_email:
+                raise DuplicateKeyError(f"Email {new_email!r} is already registered")
+            return self._apply_user_update(user, update_dict)
 
-        return user
+    def update_users(self, updates: List[UserBatchUpdate]) -> List[User]:
+        """Update a batch of users, applying nothing if any id is missing or an email clashes."""
+        update_dicts = [update.model_dump(exclude_unset=True, exclude_none=True, exclude={"id"}) for update in updates]
+        with self._writing("users"):
+            users = self._get_batch(self.users, [update.id for update in updates])
+            emails = {user.id: user.email for user in users}
+            for user, update_dict in zip(users, update_dicts):
+                emails[user.id] = update_dict.get("email", emails[user.id])
+            self._check_emails(emails)
+
+            # Release every old email first so users can swap emails in one batch
+            for user in users:
+                self.users_by_email.pop(user.email, None)
+            updated: Dict[int, User] = {}
+            for user, update_dict in zip(users, update_dicts):
+                current = updated.get(user.id, user)
+                updated[user.id] = current.model_copy(update={"version": current.version + 1, **update_dict})
+            for user in updated.values():
+                self.users[user.id] = user
+                self.users_by_email[user.email] = user.id
+                self._log("update", "users", user.id, user)
+            return [updated[user.id] for user in users]
 
-    def delete_user(self, user_id: int) -> bool:
+    def delete_user(self, user_id: int, expected_versions: Optional[Container[int]] = None) -> bool:
         """Delete a user from the database."""
-        for i, user in enumerate(self.users):
-            if user.id == user_id:
-                del self.users[i]
-                return True
-        return False
+        with self._writing("users"):
+            user = self.users.get(user_id)
+            if user is None:
+                return False
+            self._check_version(user, expected_versions)
+            self._remove_user(user)
+        return True
+
+    def delete_users(self, user_ids: List[int]):
+        """Delete a batch of users, deleting nothing if any id is missing."""
+        with self._writing("users"):
+            for user in self._get_batch(self.users, list(dict.fromkeys(user_ids))):
+                self._remove_user(user)
+
+    def _insert_setting(self, setting: Setting):
+        """Store a new setting and add it to every index."""
+        self.settings[setting.id] = setting
+        self.setting_ids.add(setting.id)
+        self.settings_by_key[setting.key] = setting.id
+        self._log("insert", "settings", setting.id, setting)
+
+    def _apply_setting_update(self, setting: Setting, update_dict: dict) -> Setting:
+        """Replace a stored setting with a copy carrying validated field changes."""
+        updated = setting.model_copy(update={"version": setting.version + 1, **update_dict})
+        self.settings[setting.id] = updated
+        self._log("update", "settings", setting.id, updated)
+        return updated
+
+    def _remove_setting(self, setting: Setting):
+        """Remove a stored setting from the table and every index."""
+        del self.settings[setting.id]
+        del self.settings_by_key[setting.key]
+        self.setting_ids.discard(self.settings)
+        self._log("delete", "settings", setting.id)
 
     def create_setting(self, setting_data: SettingCreate) -> Setting:
         """Create a new setting in the database."""
-        setting = Setting(
-            id=self.next_setting_id,
-            **setting_data.dict(),
-            created_at=datetime.now()
-        )
-        self.settings.append(setting)
-        self.next_setting_id += 1
+        with self._writing("settings"):
+            if setting_data.key in self.settings_by_key:
+                raise DuplicateKeyError(f"Setting key {setting_data.key!r} already exists")
+            setting = Setting(
+                id=self.next_setting_id,
+                **setting_data.dict(),
+                created_at=datetime.now()
+            )
+            self._insert_setting(setting)
+            self.next_setting_id += 1
         return setting
 
+    def create_settings(self, settings_data: List[SettingCreate]) -> List[Setting]:
+        """Create a batch of settings, creating none if any key already exists."""
+        created_at = datetime.now()
+        rows = [setting_data.model_dump() for setting_data in settings_data]
+        with self._writing("settings"):
+            keys: Set[str] = set()
+            for row in rows:
+                if row["key"] in keys or row["key"] in self.settings_by_key:
+                    raise DuplicateKeyError(f"Setting key {row['key']!r} already exists")
+                keys.add(row["key"])
+            first_id = self.next_setting_id
+            settings = [
+                Setting.model_construct(id=first_id + i, **row, created_at=created_at) for i, row in enumerate(rows)
+            ]
+            self.next_setting_id += len(settings)
+            for setting in settings:
+                self._insert_setting(setting)
+        return settings
+
     def get_all_settings(self) -> List[Setting]:
         """Get all settings from the database."""
-        return self.settings
+        with self.locks["settings"].read():
+            return list(self.settings.values())
+
+    def get_settings_page(self, after_id: Optional[int] = None, limit: Optional[int] = None) -> Tuple[List[Setting], Optional[int]]:
+        """Get settings with id greater than after_id, plus the cursor for the next page."""
+        with self.locks["settings"].read():
+            return self.setting_ids.page(self.settings, after_id, limit)
 
     def get_setting(self, setting_id: int) -> Optional[Setting]:
         """Get a specific setting by ID."""
-        for setting in self.settings:
-            if setting.id == setting_id:
-                return setting
-        return None
+        return self.settings.get(setting_id)
 
     def get_setting_by_key(self, key: str) -> Optional[Setting]:
         """Get a specific setting by key."""
-        for setting in self.settings:
-            if setting.key == key:
-                return setting
-        return None
-
-    def update_setting(self, setting_id: int, update_data: SettingUpdate) -> Optional[Setting]:
-        """Update an existing setting in the database."""
-        setting = self.get_setting(setting_id)
-        if not setting:
+        self._ensure_indexed("settings")
+        setting_id = self.settings_by_key.get(key)
+        if setting_id is None:
             return None
+        # Lock-free, so the setting may have been deleted since the lookup
+        return self.settings.get(setting_id)
 
-        update_dict = update_data.dict(exclude_unset=True)
-        for field, value in update_dict.items():
-            setattr(setting, field, value)
+    def update_setting(self, setting_id: int, update_data: SettingUpdate,
+                      expected_versions: Optional[Container[int]] = None) -> Optional[Setting]:
+        """Update an existing setting in the database."""
+        update_dict = setting_changes(update_data)
+        with self._writing("settings"):
+            setting = self.settings.get(setting_id)
+            if not setting:
+                return None
+            self._check_version(setting, expected_versions)
+            return self._apply_setting_update(setting, update_dict)
 
-        return setting
+    def update_settings(self, updates: List[SettingBatchUpdate]) -> List[Setting]:
+        """Update a batch of settings, applying nothing if any id is missing."""
+        update_dicts = [setting_changes(update) for update in updates]
+        with self._writing("settings"):
+            settings = self._get_batch(self.settings, [update.id for update in updates])
+            for setting, update_dict in zip(settings, update_dicts):
+                self._apply_setting_update(self.settings[setting.id], update_dict)
+            return [self.settings[setting.id] for setting in settings]
 
-    def delete_setting(self, setting_id: int) -> bool:
+    def delete_setting(self, setting_id: int, expected_versions: Optional[Container[int]] = None) -> bool:
         """Delete a setting from the database."""
-        for i, setting in enumerate(self.settings):
-            if setting.id == setting_id:
-                del self.settings[i]
-                return True
-        return False
+        with self._writing("settings"):
+            setting = self.settings.get(setting_id)
+            if setting is None:
+                return False
+            self._check_version(setting, expected_versions)
+            self._remove_setting(setting)
+        return True
+
+    def delete_settings(self, setting_ids: List[int]):
+        """Delete a batch of settings, deleting nothing if any id is missing."""
+        with self._writing("settings"):
+            for setting in self._get_batch(self.settings, list(dict.fromkeys(setting_ids))):
+                self._remove_setting(setting)
+
+def create_database() -> StorageBackend:
+    """Build the storage backend selected by configuration."""
+    if config.BACKEND == "sqlite":
+        # Imported lazily so the in-memory engine does not load sqlite3
+        from sqlite_backend import SQLiteDatabase
+        return SQLiteDatabase(config.SQLITE_PATH, pool_size=config.SQLITE_POOL_SIZE, fsync=config.WAL_FSYNC,
+                              change_log_capacity=config.CHANGE_LOG_CAPACITY,
+                              tombstone_retention=config.TOMBSTONE_RETENTION, sample_data=config.SAMPLE_DATA)
+    if config.BACKEND != "memory":
+        raise ValueError(f"Unknown storage backend {config.BACKEND!r}, expected one of {BACKENDS}")
+    return InMemoryDatabase(
+        data_dir=config.DATA_DIR,
+        fsync=config.WAL_FSYNC,
+        snapshot_every=config.SNAPSHOT_EVERY,
+        product_store=config.PRODUCT_STORE,
+        change_log_capacity=config.CHANGE_LOG_CAPACITY,
+        tombstone_retention=config.TOMBSTONE_RETENTION,
+        mapped_snapshot=config.MAPPED_SNAPSHOT,
+        sample_data=config.SAMPLE_DATA,
+    )
+
+
+# Process-wide database, created by get_database on first use
+_db: Optional[StorageBackend] = None
+
+
+def get_database() -> StorageBackend:
+    """The process-wide database, created from configuration on first use."""
+    global _db
+    if _db is None:
+        _db = create_database()
+    return _db
 
 
-# Global database instance
-db = InMemoryDatabase()
+def __getattr__(name: str):
+    # `database.db` is the process-wide database, so importing this module
+    # does not build it
+    if name == "db":
+        return get_database()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
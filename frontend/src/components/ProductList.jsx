@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react';
-import { getProducts, deleteProduct } from '../services/api';
+import { getProducts, deleteProduct, getNextCursor, PAGE_SIZE } from '../services/api';
 import ProductForm from './ProductForm';
 import '../styles/ProductList.css';
 
@@ -7,6 +7,7 @@ export default function ProductList() {
   const [products, setProducts] = useState([]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
   const [showForm, setShowForm] = useState(false);
   const [editingProduct, setEditingProduct] = useState(null);
 
@@ -14,12 +15,21 @@ export default function ProductList() {
     fetchProducts();
   }, []);
 
-  const fetchProducts = async () => {
+  const handleLoadMore = () => {
+    fetchProducts(nextCursor);
+  };
+
+  const fetchProducts = async (afterId = null) => {
     setLoading(true);
     setError(null);
     try {
-      const response = await getProducts();
-      setProducts(response.data);
+      const params = { limit: PAGE_SIZE };
+      if (afterId !== null) {
+        params.after_id = afterId;
+      }
+      const response = await getProducts(params);
+      setProducts(afterId === null ? response.data : (prev) => [...prev, ...response.data]);
+      setNextCursor(getNextCursor(response));
     } catch (err) {
       setError('Failed to fetch products');
       console.error(err);
@@ -81,7 +91,7 @@ export default function ProductList() {
 
       {error && <div className="error-message">{error}</div>}
 
-      {loading ? (
+      {loading && products.length === 0 ? (
         <p>Loading products...</p>
       ) : products.length === 0 ? (
         <p>No products found.</p>
@@ -128,6 +138,12 @@ export default function ProductList() {
           </tbody>
         </table>
       )}
+
+      {nextCursor !== null && (
+        <button className="btn btn-secondary" onClick={handleLoadMore} disabled={loading}>
+          {loading ? 'Loading...' : 'Load more'}
+        </button>
+      )}
     </div>
   );
 }
@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react';
-import { getUsers, deleteUser } from '../services/api';
+import { getUsers, deleteUser, getNextCursor, PAGE_SIZE } from '../services/api';
 import UserForm from './UserForm';
 import '../styles/UserList.css';
 
@@ -7,6 +7,7 @@ export default function UserList() {
   const [users, setUsers] = useState([]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
   const [showForm, setShowForm] = useState(false);
   const [editingUser, setEditingUser] = useState(null);
 
@@ -14,12 +15,21 @@ export default function UserList() {
     fetchUsers();
   }, []);
 
-  const fetchUsers = async () => {
+  const handleLoadMore = () => {
+    fetchUsers(nextCursor);
+  };
+
+  const fetchUsers = async (afterId = null) => {
     setLoading(true);
     setError(null);
     try {
-      const response = await getUsers();
-      setUsers(response.data);
+      const params = { limit: PAGE_SIZE };
+      if (afterId !== null) {
+        params.after_id = afterId;
+      }
+      const response = await getUsers(params);
+      setUsers(afterId === null ? response.data : (prev) => [...prev, ...response.data]);
+      setNextCursor(getNextCursor(response));
     } catch (err) {
       setError('Failed to fetch users');
       console.error(err);
@@ -81,7 +91,7 @@ export default function UserList() {
 
       {error && <div className="error-message">{error}</div>}
 
-      {loading ? (
+      {loading && users.length === 0 ? (
         <p>Loading users...</p>
       ) : users.length === 0 ? (
         <p>No users found.</p>
@@ -122,6 +132,12 @@ export default function UserList() {
           </tbody>
         </table>
       )}
+
+      {nextCursor !== null && (
+        <button className="btn btn-secondary" onClick={handleLoadMore} disabled={loading}>
+          {loading ? 'Loading...' : 'Load more'}
+        </button>
+      )}
     </div>
   );
 }
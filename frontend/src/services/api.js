@@ -10,17 +10,21 @@ const api = axios.create({
 });
 
 // Product API functions
-export const getProducts = () => api.get('/products');
+export const getProducts = (params) => api.get('/products', { params });
 export const getProduct = (id) => api.get(`/products/${id}`);
 export const createProduct = (data) => api.post('/products', data);
 export const updateProduct = (id, data) => api.put(`/products/${id}`, data);
 export const deleteProduct = (id) => api.delete(`/products/${id}`);
 
 // User API functions
-export const getUsers = () => api.get('/users');
+export const getUsers = (params) => api.get('/users', { params });
 export const getUser = (id) => api.get(`/users/${id}`);
 export const createUser = (data) => api.post('/users', data);
 export const updateUser = (id, data) => api.put(`/users/${id}`, data);
 export const deleteUser = (id) => api.delete(`/users/${id}`);
 
+// Keyset pagination: the cursor for the next page comes back in a header
+export const PAGE_SIZE = 50;
+export const getNextCursor = (response) => response.headers['x-next-cursor'] ?? null;
+
 export default api;
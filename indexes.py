@@ -0,0 +1,194 @@
+"""Index structures used by the in-memory database."""
+from bisect import bisect_left, bisect_right, insort
+import heapq
+from itertools import chain
+from typing import Any, Dict, Hashable, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+
+class OrderedIdIndex:
+    """Sorted list of ids used for keyset pagination.
+
+    Ids are assigned in increasing order, so new ids are simply appended.
+    Deletes are lazy: removed ids stay in the list and are skipped while
+    paging, and the list is compacted once more than half of it is dead.
+
+    `base` is an optional sorted sequence of existing ids, such as the id
+    column of a mapped snapshot, that is read in place rather than copied
+    until the index is compacted.
+    """
+
+    def __init__(self, base: Sequence[int] = ()):
+        self._base = base
+        self._ids: List[int] = []
+        self._dead = 0
+
+    def _last(self) -> Optional[int]:
+        if self._ids:
+            return self._ids[-1]
+        return self._base[-1] if self._base else None
+
+    def add(self, row_id: int):
+        """Record a newly created id.
+
+        New ids are normally the largest so far and are appended; an id that
+        arrives out of order (e.g. while replaying a log) is inserted in place.
+        """
+        last = self._last()
+        if last is not None and row_id < last:
+            if self._base and row_id < self._base[-1]:
+                self._ids = list(chain(self._base, self._ids))
+                self._base = ()
+            insort(self._ids, row_id)
+        else:
+            self._ids.append(row_id)
+
+    def discard(self, live: Dict[int, object]):
+        """Record that an id was deleted from `live`."""
+        self._dead += 1
+        if self._dead > (len(self._base) + len(self._ids)) // 2:
+            self._ids = [i for i in chain(self._base, self._ids) if i in live]
+            self._base = ()
+            self._dead = 0
+
+    def page(self, live: Dict[int, object], after_id: Optional[int], limit: Optional[int]) -> Tuple[list, Optional[int]]:
+        """Return up to `limit` rows with id greater than `after_id`, plus the next cursor.
+
+        The cursor is the id of the last returned row, or None when there
+        are no more rows after it.
+        """
+        rows = []
+        # Every base id is smaller than every id added since
+        for ids in (self._base, self._ids):
+            start = 0 if after_id is None else bisect_right(ids, after_id)
+            for i in range(start, len(ids)):
+                row = live.get(ids[i])
+                if row is None:
+                    continue
+                if limit is not None and len(rows) == limit:
+                    return rows, rows[-1].id
+                rows.append(row)
+        return rows, None
+
+    def rows(self, live: Dict[int, object]) -> Iterator[Any]:
+        """Iterate the rows of `live` in id order."""
+        for row_id in chain(self._base, self._ids):
+            row = live.get(row_id)
+            if row is not None:
+                yield row
+
+
+class SortedIndex:
+    """Sorted multiset of comparable values supporting range scans.
+
+    Values are kept in a list of sorted blocks of bounded size, so an insert
+    or remove costs O(log n) comparisons plus a shift within one block, and
+    a range scan costs O(log n + k).
+    """
+
+    BLOCK_SIZE = 1000
+
+    def __init__(self):
+        self._blocks: List[list] = []
+        self._maxes: list = []
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def add(self, value: Any):
+        """Insert a value."""
+        if not self._blocks:
+            self._blocks.append([value])
+            self._maxes.append(value)
+        else:
+            pos = bisect_left(self._maxes, value)
+            if pos == len(self._maxes):
+                pos -= 1
+                self._blocks[pos].append(value)
+                self._maxes[pos] = value
+            else:
+                insort(self._blocks[pos], value)
+            block = self._blocks[pos]
+            if len(block) > 2 * self.BLOCK_SIZE:
+                self._blocks[pos:pos + 1] = [block[:self.BLOCK_SIZE], block[self.BLOCK_SIZE:]]
+                self._maxes[pos:pos + 1] = [block[self.BLOCK_SIZE - 1], block[-1]]
+        self._len += 1
+
+    def remove(self, value: Any):
+        """Remove one occurrence of a value, raising ValueError if it is absent."""
+        pos = bisect_left(self._maxes, value)
+        if pos == len(self._maxes):
+            raise ValueError(f"{value!r} not in index")
+        block = self._blocks[pos]
+        i = bisect_left(block, value)
+        if block[i] != value:
+            raise ValueError(f"{value!r} not in index")
+        del block[i]
+        if block:
+            self._maxes[pos] = block[-1]
+        else:
+            del self._blocks[pos]
+            del self._maxes[pos]
+        self._len -= 1
+
+    def irange(self, low: Any = None, high: Any = None, reverse: bool = False,
+               low_inclusive: bool = True, high_inclusive: bool = True) -> Iterator[Any]:
+        """Iterate over values between `low` and `high` (None means unbounded)."""
+        if reverse:
+            return self._iter_down(low, high, low_inclusive, high_inclusive)
+        return self._iter_up(low, high, low_inclusive, high_inclusive)
+
+    def _iter_up(self, low, high, low_inclusive, high_inclusive):
+        if low is None:
+            pos, i = 0, 0
+        else:
+            find = bisect_left if low_inclusive else bisect_right
+            pos = find(self._maxes, low)
+            i = find(self._blocks[pos], low) if pos < len(self._blocks) else 0
+        for block in self._blocks[pos:]:
+            for value in block[i:]:
+                if high is not None and (value > high or (value == high and not high_inclusive)):
+                    return
+                yield value
+            i = 0
+
+    def _iter_down(self, low, high, low_inclusive, high_inclusive):
+        if high is None:
+            pos = len(self._blocks) - 1
+            i = len(self._blocks[pos]) if self._blocks else 0
+        else:
+            find = bisect_right if high_inclusive else bisect_left
+            pos = min(find(self._maxes, high), len(self._blocks) - 1)
+            i = find(self._blocks[pos], high) if pos >= 0 else 0
+        while pos >= 0:
+            block = self._blocks[pos]
+            for j in range(i - 1, -1, -1):
+                value = block[j]
+                if low is not None and (value < low or (value == low and not low_inclusive)):
+                    return
+                yield value
+            pos -= 1
+            i = len(self._blocks[pos]) if pos >= 0 else 0
+
+
+def index_add(index: Dict[Hashable, Set[int]], key: Hashable, row_id: int):
+    """Add a row id under `key` in a secondary index."""
+    index.setdefault(key, set()).add(row_id)
+
+
+def index_remove(index: Dict[Hashable, Set[int]], key: Hashable, row_id: int):
+    """Remove a row id from `key` in a secondary index, dropping empty keys."""
+    ids = index.get(key)
+    if ids is not None:
+        ids.discard(row_id)
+        if not ids:
+            del index[key]
+
+
+def first_ids_after(ids: Iterable[int], after_id: Optional[int], limit: Optional[int]) -> List[int]:
+    """Return the smallest ids greater than `after_id`, in order, at most `limit` of them."""
+    if after_id is not None:
+        ids = (i for i in ids if i > after_id)
+    if limit is None:
+        return sorted(ids)
+    return heapq.nsmallest(limit, ids)
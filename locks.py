@@ -0,0 +1,50 @@
+"""Synchronisation primitives used by the in-memory database."""
+from contextlib import contextmanager
+import threading
+from typing import Iterator
+
+
+class ReadWriteLock:
+    """Lock that lets many readers or one writer in at a time.
+
+    Waiting writers block new readers, so a steady stream of reads cannot
+    starve writes. The lock is not reentrant: a thread must not take it
+    again, in either mode, while it holds it.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        """Hold the lock shared with other readers."""
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        """Hold the lock exclusively."""
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
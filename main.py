@@ -1,147 +1,842 @@
 """FastAPI application for Product CRUD operations."""
-from typing import List
-import uvicorn
+import asyncio
+import functools
+from typing import AsyncIterator, Dict, List, Literal, Optional, Set
+from urllib.parse import urlencode
 
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, Body, FastAPI, Header, HTTPException, Query, Request, Response, WebSocket
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import ValidationError
+from starlette.datastructures import State
 
-from models import Product, ProductCreate, ProductUpdate, User, UserCreate, UserUpdate, Setting, SettingCreate, SettingUpdate
-from database import db
-
-app = FastAPI(
-    title="Product CRUD API",
-    description="A simple CRUD API for managing products",
-    version="1.0.0"
+from models import (
+    GroupTotals, PriceStats, Product, ProductChanges, ProductCreate, ProductUpdate, ProductBatchUpdate,
+    User, UserCreate, UserUpdate, UserBatchUpdate,
+    Setting, SettingCreate, SettingUpdate, SettingBatchUpdate,
 )
+from async_database import AsyncDatabase
+from cache import CachedResponse, ResponseCache
+from changes import ChangeEvent, ChangeLog, ChangeNotifier
+import config
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Metrics, MetricsMiddleware
+from profiling import MAX_PROFILE_SECONDS, MIN_INTERVAL_SECONDS, Profile, Profiler, ProfilingMiddleware, Sampler
+from serialization import create_encoder
+from database import get_database, DuplicateKeyError, InvalidCursorError, NotFoundError, VersionConflictError
+from storage import SequenceExpiredError, StorageBackend
+
+# Every route, built once when this module is imported and shared by each
+# app create_app builds
+router = APIRouter()
+
+MAX_PAGE_SIZE = 1000
+# Rows per chunk when streaming NDJSON exports and imports
+NDJSON_BATCH_SIZE = 1000
+# Seconds without changes after which the change stream sends a keep-alive
+CHANGE_KEEPALIVE_SECONDS = 15.0
+# WebSocket close code telling a change feed subscriber to resynchronize
+WS_CLOSE_RESYNC = 4000
 
-# Enable CORS for frontend
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:5173"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+
+def not_found_ids(kind: str, error: NotFoundError) -> HTTPException:
+    """Build the 404 raised when a bulk request names missing ids."""
+    return HTTPException(status_code=404, detail=f"{kind} not found: {', '.join(map(str, error.ids))}")
+
+
+def next_cursor_headers(next_cursor: Optional[int]) -> Dict[str, str]:
+    """Headers advertising the cursor for the next page, if there is one."""
+    if next_cursor is None:
+        return {}
+    return {"X-Next-Cursor": str(next_cursor)}
 
 
-@app.get("/")
-def read_root():
+def cache_key(request: Request) -> str:
+    """Response cache key of a list request: its path and query parameters in name order."""
+    params = sorted(request.query_params.multi_items(), key=lambda item: item[0])
+    return f"{request.url.path}?{urlencode(params)}"
+
+
+def json_response(body: bytes, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Send JSON already serialized by the encoder as is, bypassing FastAPI's response handling."""
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def cache_list(state: State, key: str, version: int, rows: list, headers: Dict[str, str]) -> Response:
+    """Serialize a list of rows, cache it under `version` and send it."""
+    entry = CachedResponse(state.encode_json(rows), headers)
+    state.response_cache.put(key, version, entry)
+    return json_response(entry.body, entry.headers)
+
+
+def row_response(state: State, row, if_none_match: Optional[str]) -> Response:
+    """Send one row with its ETag, from the response cache while its version is current.
+
+    Entries are keyed by model and id rather than path, so a row fetched
+    by id and by key shares one entry, and a recreated key cannot be served
+    the deleted row's body.
+    """
+    cached = not_modified(row, if_none_match)
+    if cached:
+        return cached
+    key = f"{type(row).__name__}/{row.id}"
+    entry = state.response_cache.get(key, row.version)
+    if entry is None:
+        entry = CachedResponse(state.encode_json(row), {"ETag": etag(row)})
+        state.response_cache.put(key, row.version, entry)
+    return json_response(entry.body, entry.headers)
+
+
+def etag(row) -> str:
+    """ETag of a stored row: its version, quoted."""
+    return f'"{row.version}"'
+
+
+def etag_versions(header: str, weak: bool) -> Set[int]:
+    """Row versions named by an If-Match or If-None-Match header.
+
+    Weak validators (W/"...") only count when `weak` is set, since If-Match
+    requires a strong comparison. Tags this API never issued are ignored.
+    """
+    versions = set()
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            if not weak:
+                continue
+            tag = tag[2:]
+        if len(tag) > 2 and tag[0] == tag[-1] == '"' and tag[1:-1].isdigit():
+            versions.add(int(tag[1:-1]))
+    return versions
+
+
+def expected_versions(if_match: Optional[str]) -> Optional[Set[int]]:
+    """Versions a conditional write may apply to, or None for any version."""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    return etag_versions(if_match, weak=False)
+
+
+def not_modified(row, if_none_match: Optional[str]) -> Optional[Response]:
+    """Return a bodiless 304 response if the client already has this version of the row."""
+    if if_none_match is None:
+        return None
+    if if_none_match.strip() == "*" or row.version in etag_versions(if_none_match, weak=True):
+        return Response(status_code=304, headers={"ETag": etag(row)})
+    return None
+
+
+def precondition_failed() -> HTTPException:
+    """Build the 412 raised when If-Match names a version the row no longer has."""
+    return HTTPException(status_code=412, detail="Version does not match If-Match")
+
+
+CONDITIONAL_GET_RESPONSES = {304: {"description": "Not modified"}}
+CONDITIONAL_WRITE_RESPONSES = {412: {"description": "Precondition failed"}}
+
+
+def check_admin(state: State, token: Optional[str]) -> Profiler:
+    """Return the profiler if `token` is the admin token; without one, admin endpoints do not exist."""
+    if state.profiler is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not state.profiler.authorized(token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    return state.profiler
+
+
+def profile_response(profile: Profile, scale: float = 1.0) -> Response:
+    """Collapsed stacks as text, with the time per phase in a Server-Timing header."""
+    return Response(profile.collapsed(scale), media_type="text/plain",
+                    headers={"Server-Timing": profile.server_timing()})
+
+
+def change_feed(state: State) -> ChangeNotifier:
+    """The app's change notifier for the running event loop, created on first use."""
+    loop = asyncio.get_running_loop()
+    notifier = state.change_notifier
+    if notifier is None or notifier.loop is not loop:
+        if notifier is not None:
+            notifier.close()
+        notifier = state.change_notifier = ChangeNotifier(state.async_db.changes, loop)
+    return notifier
+
+
+def change_start(log: ChangeLog, since: Optional[int], epoch: Optional[str], last_event_id: Optional[str]) -> int:
+    """Sequence number a change subscription resumes after, raising 410 if it has expired.
+
+    Without `since` or a Last-Event-ID header, the subscription starts
+    with the next change. A position from another epoch, numbered by
+    another database or before an in-memory one restarted, has expired
+    too: resuming from it would skip the missed changes and send
+    unrelated ones.
+    """
+    if since is None and last_event_id is not None:
+        event_epoch, _, seq = last_event_id.strip().rpartition("-")
+        if seq.isdigit():
+            since, epoch = int(seq), event_epoch
+    if since is None:
+        return log.last_seq
+    expired = epoch is not None and epoch != log.epoch
+    if not expired:
+        try:
+            log.since(since, limit=0)
+        except SequenceExpiredError:
+            expired = True
+    if expired:
+        raise HTTPException(status_code=410, detail=f"Changes after {since} are no longer available")
+    return since
+
+
+def change_tables(table: Optional[str]) -> Optional[Set[str]]:
+    """Tables a subscription is limited to, or None for all of them."""
+    return None if table is None else {table}
+
+
+async def sse_changes(feed: ChangeNotifier, since: int, tables: Optional[Set[str]]) -> AsyncIterator[bytes]:
+    """Yield changes as server-sent events, with keep-alive comments while idle.
+
+    A subscriber that falls behind the retained changes gets a "reset"
+    event and the stream ends.
+    """
+    try:
+        async for events in feed.follow(since, tables, idle_timeout=CHANGE_KEEPALIVE_SECONDS):
+            if not events:
+                yield b": keepalive\n\n"
+                continue
+            yield b"".join(sse_frame(event) for event in events)
+    except SequenceExpiredError as e:
+        yield f"event: reset\ndata: {e.seq}\n\n".encode()
+
+
+def sse_frame(event: ChangeEvent) -> bytes:
+    """One change as a server-sent event whose id, `<epoch>-<seq>`, resumes the stream after it."""
+    return b"id: %s-%d\nevent: change\ndata: %s\n\n" % (event.epoch.encode(), event.seq, event.json())
+
+
+async def close_database(state: State):
+    """Close the storage backend and its executor."""
+    if state.change_notifier is not None:
+        state.change_notifier.close()
+        state.change_notifier = None
+    await state.async_db.close()
+
+
+@router.get("/")
+async def read_root():
     """Root endpoint returning welcome message."""
     return {"message": "Welcome to the Product CRUD API"}
 
 
-@app.get("/health")
-def health_check():
+@router.get("/health")
+async def health_check():
     """Health check endpoint."""
     return {"status": "healthy"}
 
 
-@app.get("/products", response_model=List[Product])
-def get_products():
-    """Get all products"""
-    return db.get_all_products()
-
-@app.get("/products/{product_id}", response_model=Product)
-def get_product(product_id: int):
-    """Get a specific product by ID"""
-    product = db.get_product(product_id)
+@router.get("/cache/stats")
+async def cache_stats(request: Request):
+    """Response cache hit, miss and eviction counters and current size."""
+    state = request.app.state
+    return state.response_cache.stats()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(request: Request):
+    """Request, storage and cache metrics in the Prometheus text exposition format."""
+    state = request.app.state
+    if state.metrics is None:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    cache = state.response_cache.stats()
+    body = state.metrics.render({
+        "db_rows": ("gauge", "Rows in each collection.", "table", await state.async_db.row_counts()),
+        "response_cache_requests_total": ("counter", "Cacheable GET requests by result.", "result",
+                                          {"hit": cache["hits"], "miss": cache["misses"]}),
+        "response_cache_evictions_total": ("counter", "Responses evicted from the cache.", "",
+                                           {None: cache["evictions"]}),
+        "response_cache_size": ("gauge", "Entries and bytes held by the response cache.", "unit",
+                                {"entries": cache["entries"], "bytes": cache["bytes"]}),
+    })
+    return Response(body, media_type=METRICS_CONTENT_TYPE)
+
+
+@router.post("/admin/profile", response_class=PlainTextResponse)
+async def profile_server(
+    request: Request,
+    seconds: float = Query(10.0, gt=0, le=MAX_PROFILE_SECONDS),
+    interval_ms: float = Query(10.0, ge=MIN_INTERVAL_SECONDS * 1000, le=1000),
+    x_admin_token: Optional[str] = Header(None),
+):
+    """Sample every thread's stack for `seconds`; returns collapsed stacks weighted by sample count."""
+    admin = check_admin(request.app.state, x_admin_token)
+    if admin.sampling:
+        raise HTTPException(status_code=409, detail="A profile is already being taken")
+    admin.sampling = True
+    sampler = Sampler(interval_ms / 1000)
+    sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profile = sampler.stop()
+        admin.sampling = False
+    return profile_response(profile)
+
+
+@router.get("/admin/profile/traces/{trace_id}", response_class=PlainTextResponse)
+async def get_trace(request: Request, trace_id: int, x_admin_token: Optional[str] = Header(None)):
+    """A traced request's collapsed stacks, weighted in microseconds."""
+    profile = check_admin(request.app.state, x_admin_token).traces.get(trace_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return profile_response(profile, scale=1e6)
+
+
+@router.get("/changes", response_class=StreamingResponse, responses={410: {"description": "Changes expired"}})
+async def stream_changes(
+    request: Request,
+    since: Optional[int] = Query(None, ge=0),
+    epoch: Optional[str] = None,
+    table: Optional[Literal["products", "users", "settings"]] = None,
+    last_event_id: Optional[str] = Header(None),
+):
+    """Stream committed creates, updates and deletes as server-sent events"""
+    state = request.app.state
+    start = change_start(state.async_db.changes, since, epoch, last_event_id)
+    return StreamingResponse(
+        sse_changes(change_feed(state), start, change_tables(table)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@router.websocket("/changes/ws")
+async def changes_websocket(
+    websocket: WebSocket,
+    since: Optional[int] = Query(None, ge=0),
+    epoch: Optional[str] = None,
+    table: Optional[Literal["products", "users", "settings"]] = None,
+):
+    """Send committed changes as JSON text messages until the client disconnects.
+
+    The connection is closed with code 4000 when the subscriber has to
+    resynchronize: `since` has expired, or it fell too far behind.
+    """
+    state = websocket.app.state
+    await websocket.accept()
+    try:
+        start = change_start(state.async_db.changes, since, epoch, None)
+    except HTTPException as e:
+        await websocket.close(code=WS_CLOSE_RESYNC, reason=e.detail)
+        return
+
+    async def send_changes():
+        async for events in change_feed(state).follow(start, change_tables(table)):
+            for event in events:
+                await websocket.send_text(event.json().decode())
+
+    async def wait_for_disconnect():
+        # Messages from the client are ignored
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    sender = asyncio.ensure_future(send_changes())
+    receiver = asyncio.ensure_future(wait_for_disconnect())
+    await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    for task in (sender, receiver):
+        task.cancel()
+    if sender.done() and not sender.cancelled():
+        error = sender.exception()
+        if isinstance(error, SequenceExpiredError):
+            await websocket.close(code=WS_CLOSE_RESYNC, reason="Change feed subscriber fell behind")
+        elif error is not None:
+            raise error
+
+
+@router.get("/products", response_model=List[Product])
+async def get_products(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after_id: Optional[int] = None,
+    category: Optional[str] = None,
+    tag: Optional[List[str]] = Query(None),
+    in_stock: Optional[bool] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    sort: Literal["id", "price", "-price"] = "id",
+):
+    """Get all products, optionally filtered and sorted, one page at a time"""
+    state = request.app.state
+    # The version is read before the data, so a write racing the read can
+    # only make the entry look stale, never make stale data look current
+    key, version = cache_key(request), state.async_db.collection_version("products")
+    cached = state.response_cache.get(key, version)
+    if cached:
+        return json_response(cached.body, cached.headers)
+    filters = (limit, after_id, category, tag, in_stock, min_price, max_price)
+    if sort == "id" and all(value is None for value in filters):
+        return cache_list(state, key, version, await state.async_db.get_all_products(), {})
+    try:
+        products, next_cursor = await state.async_db.find_products(
+            category=category,
+            tags=tag,
+            in_stock=in_stock,
+            min_price=min_price,
+            max_price=max_price,
+            sort=sort,
+            after_id=after_id,
+            limit=limit,
+        )
+    except InvalidCursorError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return cache_list(state, key, version, products, next_cursor_headers(next_cursor))
+
+@router.get("/products/search", response_model=List[Product])
+async def search_products(
+    request: Request,
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+):
+    """Full-text search over product name, description and tags, best match first"""
+    state = request.app.state
+    key, version = cache_key(request), state.async_db.collection_version("products")
+    cached = state.response_cache.get(key, version)
+    if cached:
+        return json_response(cached.body, cached.headers)
+    return cache_list(state, key, version, await state.async_db.search_products(q, limit), {})
+
+@router.get("/products/stats", response_model=List[PriceStats])
+async def product_stats(request: Request, group_by: Optional[Literal["category", "in_stock", "tag"]] = None):
+    """Count, sum, min, max and average price of all products, or per category, stock flag or tag"""
+    state = request.app.state
+    key, version = cache_key(request), state.async_db.collection_version("products")
+    cached = state.response_cache.get(key, version)
+    if cached:
+        return json_response(cached.body, cached.headers)
+    return cache_list(state, key, version, await state.async_db.product_stats(group_by), {})
+
+@router.get("/products/stats/views/{name}", response_model=List[GroupTotals])
+async def product_view(request: Request, name: str):
+    """Read a materialized view of product counts and price sums, e.g. category_totals or tag_totals"""
+    state = request.app.state
+    rows = await state.async_db.product_view(name)
+    if rows is None:
+        raise HTTPException(status_code=404, detail="View not found")
+    return json_response(state.encode_json(rows))
+
+@router.get("/products/changes", response_model=ProductChanges, responses={410: {"description": "Watermark expired"}})
+async def product_changes(
+    request: Request,
+    since: int = Query(0, ge=0),
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    """Products created, updated or deleted after a sync watermark, oldest change first
+
+    Pass the returned `seq` as `since` next time; while `more` is true,
+    further changes follow right away. A watermark older than the
+    tombstone retention window gets 410, and the client resyncs from 0.
+    """
+    state = request.app.state
+    key, version = cache_key(request), state.async_db.collection_version("products")
+    cached = state.response_cache.get(key, version)
+    if cached:
+        return json_response(cached.body, cached.headers)
+    try:
+        changes = await state.async_db.product_changes(since, limit)
+    except SequenceExpiredError:
+        raise HTTPException(status_code=410, detail=f"Changes after {since} are no longer available; sync from 0")
+    return cache_list(state, key, version, changes, {})
+
+@router.post("/products/bulk", response_model=List[Product])
+async def create_products(request: Request, products: List[ProductCreate]):
+    """Create a batch of products"""
+    state = request.app.state
+    return json_response(state.encode_json(await state.async_db.create_products(products)))
+
+
+@router.patch("/products/bulk", response_model=List[Product])
+async def update_products(request: Request, updates: List[ProductBatchUpdate]):
+    """Update a batch of products; nothing is changed if any id is missing"""
+    state = request.app.state
+    try:
+        return json_response(state.encode_json(await state.async_db.update_products(updates)))
+    except NotFoundError as e:
+        raise not_found_ids("Products", e)
+
+
+@router.delete("/products/bulk", status_code=204)
+async def delete_products(request: Request, product_ids: List[int] = Body(...)):
+    """Delete a batch of products; nothing is deleted if any id is missing"""
+    state = request.app.state
+    try:
+        await state.async_db.delete_products(product_ids)
+    except NotFoundError as e:
+        raise not_found_ids("Products", e)
+
+async def export_products_ndjson(state: State) -> AsyncIterator[bytes]:
+    """Yield every product as NDJSON, one chunk of rows at a time."""
+    after_id = None
+    while True:
+        products, after_id = await state.async_db.get_products_page(after_id, NDJSON_BATCH_SIZE)
+        if products:
+            yield b"".join(state.encode_json(product) + b"\n" for product in products)
+        if after_id is None:
+            return
+
+
+@router.get("/products/export", response_class=StreamingResponse)
+async def export_products(request: Request):
+    """Stream every product as newline-delimited JSON"""
+    return StreamingResponse(export_products_ndjson(request.app.state), media_type="application/x-ndjson")
+
+
+async def ndjson_lines(request: Request) -> AsyncIterator[bytes]:
+    """Yield the lines of a streamed request body without buffering all of it."""
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+@router.post("/products/import")
+async def import_products(request: Request):
+    """Import products from a newline-delimited JSON body, in batches.
+
+    Each line is validated as a product to create; ids and timestamps in the
+    input are ignored. Batches are applied as they are read, so if a line is
+    invalid the rows before its batch stay imported.
+    """
+    state = request.app.state
+    imported = 0
+    batch: List[ProductCreate] = []
+    line_number = 0
+    async for line in ndjson_lines(request):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            batch.append(ProductCreate.model_validate_json(line))
+        except ValidationError as e:
+            raise HTTPException(
+                status_code=422,
+                detail={"line": line_number, "imported": imported, "errors": e.errors(include_url=False, include_input=False)},
+            )
+        if len(batch) == NDJSON_BATCH_SIZE:
+            imported += len(await state.async_db.create_products(batch))
+            batch = []
+    if batch:
+        imported += len(await state.async_db.create_products(batch))
+    return {"imported": imported}
+
+
+@router.get("/products/{product_id}", response_model=Product, responses=CONDITIONAL_GET_RESPONSES)
+async def get_product(request: Request, product_id: int, if_none_match: Optional[str] = Header(None)):
+    """Get a specific product by ID; 304 if If-None-Match names its current ETag"""
+    state = request.app.state
+    product = await state.async_db.get_product(product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
+    return row_response(state, product, if_none_match)
 
 
-@app.post("/products", response_model=Product)
-def create_product(product: ProductCreate):
+@router.post("/products", response_model=Product)
+async def create_product(request: Request, product: ProductCreate):
     """Create a new product"""
+    state = request.app.state
     # TODO: Add validation logic here
-    return db.create_product(product)
+    return await state.async_db.create_product(product)
 
 
-@app.put("/products/{product_id}", response_model=Product)
-def update_product(product_id: int, product_update: ProductUpdate):
-    """Update an existing product"""
+@router.put("/products/{product_id}", response_model=Product, responses=CONDITIONAL_WRITE_RESPONSES)
+async def update_product(request: Request, product_id: int, product_update: ProductUpdate,
+                         response: Response, if_match: Optional[str] = Header(None)):
+    """Update an existing product; 412 if If-Match does not name its current ETag"""
+    state = request.app.state
     # TODO: Add validation and error handling
-    updated_product = db.update_product(product_id, product_update)
+    try:
+        updated_product = await state.async_db.update_product(product_id, product_update, expected_versions(if_match))
+    except VersionConflictError:
+        raise precondition_failed()
     if not updated_product:
         raise HTTPException(status_code=404, detail="Product not found")
+    response.headers["ETag"] = etag(updated_product)
     return updated_product
 
 
-@app.delete("/products/{product_id}", status_code=204)
-def delete_product(product_id: int):
-    """Delete a product"""
-    if not db.delete_product(product_id):
+@router.delete("/products/{product_id}", status_code=204, responses=CONDITIONAL_WRITE_RESPONSES)
+async def delete_product(request: Request, product_id: int, if_match: Optional[str] = Header(None)):
+    """Delete a product; 412 if If-Match does not name its current ETag"""
+    state = request.app.state
+    try:
+        deleted = await state.async_db.delete_product(product_id, expected_versions(if_match))
+    except VersionConflictError:
+        raise precondition_failed()
+    if not deleted:
         raise HTTPException(status_code=404, detail="Product not found")
 
 
-@app.post("/users", response_model=User)
-def create_user(user: UserCreate):
+@router.post("/users", response_model=User)
+async def create_user(request: Request, user: UserCreate):
     """Create a new user"""
-    return db.create_user(user)
-
-@app.get("/users", response_model=List[User])
-def get_users():
-    """Get all users"""
-    return db.get_all_users()
-
-@app.get("/users/{user_id}", response_model=User)
-def get_user(user_id: int):
-    """Get a specific user by ID"""
-    user = db.get_user(user_id)
+    state = request.app.state
+    try:
+        return await state.async_db.create_user(user)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Email already registered")
+
+@router.get("/users", response_model=List[User])
+async def get_users(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after_id: Optional[int] = None,
+):
+    """Get all users, or one page of them when limit or after_id is given"""
+    state = request.app.state
+    key, version = cache_key(request), state.async_db.collection_version("users")
+    cached = state.response_cache.get(key, version)
+    if cached:
+        return json_response(cached.body, cached.headers)
+    if limit is None and after_id is None:
+        return cache_list(state, key, version, await state.async_db.get_all_users(), {})
+    users, next_cursor = await state.async_db.get_users_page(after_id, limit)
+    return cache_list(state, key, version, users, next_cursor_headers(next_cursor))
+
+@router.post("/users/bulk", response_model=List[User])
+async def create_users(request: Request, users: List[UserCreate]):
+    """Create a batch of users; none are created if any email is taken"""
+    state = request.app.state
+    try:
+        return json_response(state.encode_json(await state.async_db.create_users(users)))
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Email already registered")
+
+@router.patch("/users/bulk", response_model=List[User])
+async def update_users(request: Request, updates: List[UserBatchUpdate]):
+    """Update a batch of users; nothing is changed if any id is missing or an email is taken"""
+    state = request.app.state
+    try:
+        return json_response(state.encode_json(await state.async_db.update_users(updates)))
+    except NotFoundError as e:
+        raise not_found_ids("Users", e)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Email already registered")
+
+@router.delete("/users/bulk", status_code=204)
+async def delete_users(request: Request, user_ids: List[int] = Body(...)):
+    """Delete a batch of users; nothing is deleted if any id is missing"""
+    state = request.app.state
+    try:
+        await state.async_db.delete_users(user_ids)
+    except NotFoundError as e:
+        raise not_found_ids("Users", e)
+
+@router.get("/users/{user_id}", response_model=User, responses=CONDITIONAL_GET_RESPONSES)
+async def get_user(request: Request, user_id: int, if_none_match: Optional[str] = Header(None)):
+    """Get a specific user by ID; 304 if If-None-Match names its current ETag"""
+    state = request.app.state
+    user = await state.async_db.get_user(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
-
-@app.put("/users/{user_id}", response_model=User)
-def update_user(user_id: int, user_update: UserUpdate):
-    """Update an existing user"""
-    updated_user = db.update_user(user_id, user_update)
+    return row_response(state, user, if_none_match)
+
+@router.put("/users/{user_id}", response_model=User, responses=CONDITIONAL_WRITE_RESPONSES)
+async def update_user(request: Request, user_id: int, user_update: UserUpdate, response: Response,
+                      if_match: Optional[str] = Header(None)):
+    """Update an existing user; 412 if If-Match does not name its current ETag"""
+    state = request.app.state
+    try:
+        updated_user = await state.async_db.update_user(user_id, user_update, expected_versions(if_match))
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Email already registered")
+    except VersionConflictError:
+        raise precondition_failed()
     if not updated_user:
         raise HTTPException(status_code=404, detail="User not found")
+    response.headers["ETag"] = etag(updated_user)
     return updated_user
 
-@app.delete("/users/{user_id}", status_code=204)
-def delete_user(user_id: int):
-    """Delete a user"""
-    if not db.delete_user(user_id):
+@router.delete("/users/{user_id}", status_code=204, responses=CONDITIONAL_WRITE_RESPONSES)
+async def delete_user(request: Request, user_id: int, if_match: Optional[str] = Header(None)):
+    """Delete a user; 412 if If-Match does not name its current ETag"""
+    state = request.app.state
+    try:
+        deleted = await state.async_db.delete_user(user_id, expected_versions(if_match))
+    except VersionConflictError:
+        raise precondition_failed()
+    if not deleted:
         raise HTTPException(status_code=404, detail="User not found")
 
 
-@app.get("/settings", response_model=List[Setting])
-def get_settings():
-    """Get all settings"""
-    return db.get_all_settings()
-
-@app.get("/settings/{setting_id}", response_model=Setting)
-def get_setting(setting_id: int):
-    """Get a specific setting by ID"""
-    setting = db.get_setting(setting_id)
+@router.get("/settings", response_model=List[Setting])
+async def get_settings(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after_id: Optional[int] = None,
+):
+    """Get all settings, or one page of them when limit or after_id is given"""
+    state = request.app.state
+    key, version = cache_key(request), state.async_db.collection_version("settings")
+    cached = state.response_cache.get(key, version)
+    if cached:
+        return json_response(cached.body, cached.headers)
+    if limit is None and after_id is None:
+        return cache_list(state, key, version, await state.async_db.get_all_settings(), {})
+    settings, next_cursor = await state.async_db.get_settings_page(after_id, limit)
+    return cache_list(state, key, version, settings, next_cursor_headers(next_cursor))
+
+@router.get("/settings/by-key/{key}", response_model=Setting, responses=CONDITIONAL_GET_RESPONSES)
+async def get_setting_by_key(request: Request, key: str, if_none_match: Optional[str] = Header(None)):
+    """Get a specific setting by key; 304 if If-None-Match names its current ETag"""
+    state = request.app.state
+    setting = await state.async_db.get_setting_by_key(key)
+    if not setting:
+        raise HTTPException(status_code=404, detail="Setting not found")
+    return row_response(state, setting, if_none_match)
+
+@router.post("/settings/bulk", response_model=List[Setting])
+async def create_settings(request: Request, settings: List[SettingCreate]):
+    """Create a batch of settings; none are created if any key already exists"""
+    state = request.app.state
+    try:
+        return json_response(state.encode_json(await state.async_db.create_settings(settings)))
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Setting key already exists")
+
+
+@router.patch("/settings/bulk", response_model=List[Setting])
+async def update_settings(request: Request, updates: List[SettingBatchUpdate]):
+    """Update a batch of settings; nothing is changed if any id is missing"""
+    state = request.app.state
+    try:
+        return json_response(state.encode_json(await state.async_db.update_settings(updates)))
+    except NotFoundError as e:
+        raise not_found_ids("Settings", e)
+
+
+@router.delete("/settings/bulk", status_code=204)
+async def delete_settings(request: Request, setting_ids: List[int] = Body(...)):
+    """Delete a batch of settings; nothing is deleted if any id is missing"""
+    state = request.app.state
+    try:
+        await state.async_db.delete_settings(setting_ids)
+    except NotFoundError as e:
+        raise not_found_ids("Settings", e)
+
+@router.get("/settings/{setting_id}", response_model=Setting, responses=CONDITIONAL_GET_RESPONSES)
+async def get_setting(request: Request, setting_id: int, if_none_match: Optional[str] = Header(None)):
+    """Get a specific setting by ID; 304 if If-None-Match names its current ETag"""
+    state = request.app.state
+    setting = await state.async_db.get_setting(setting_id)
     if not setting:
         raise HTTPException(status_code=404, detail="Setting not found")
-    return setting
+    return row_response(state, setting, if_none_match)
 
 
-@app.post("/settings", response_model=Setting)
-def create_setting(setting: SettingCreate):
+@router.post("/settings", response_model=Setting)
+async def create_setting(request: Request, setting: SettingCreate):
     """Create a new setting"""
-    return db.create_setting(setting)
-
-
-@app.put("/settings/{setting_id}", response_model=Setting)
-def update_setting(setting_id: int, setting_update: SettingUpdate):
-    """Update an existing setting"""
-    updated_setting = db.update_setting(setting_id, setting_update)
+    state = request.app.state
+    try:
+        return await state.async_db.create_setting(setting)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Setting key already exists")
+
+
+@router.put("/settings/{setting_id}", response_model=Setting, responses=CONDITIONAL_WRITE_RESPONSES)
+async def update_setting(request: Request, setting_id: int, setting_update: SettingUpdate,
+                         response: Response, if_match: Optional[str] = Header(None)):
+    """Update an existing setting; 412 if If-Match does not name its current ETag"""
+    state = request.app.state
+    try:
+        updated_setting = await state.async_db.update_setting(setting_id, setting_update, expected_versions(if_match))
+    except VersionConflictError:
+        raise precondition_failed()
     if not updated_setting:
         raise HTTPException(status_code=404, detail="Setting not found")
+    response.headers["ETag"] = etag(updated_setting)
     return updated_setting
 
 
-@app.delete("/settings/{setting_id}", status_code=204)
-def delete_setting(setting_id: int):
-    """Delete a setting"""
-    if not db.delete_setting(setting_id):
+@router.delete("/settings/{setting_id}", status_code=204, responses=CONDITIONAL_WRITE_RESPONSES)
+async def delete_setting(request: Request, setting_id: int, if_match: Optional[str] = Header(None)):
+    """Delete a setting; 412 if If-Match does not name its current ETag"""
+    state = request.app.state
+    try:
+        deleted = await state.async_db.delete_setting(setting_id, expected_versions(if_match))
+    except VersionConflictError:
+        raise precondition_failed()
+    if not deleted:
         raise HTTPException(status_code=404, detail="Setting not found")
 
 
+def use_database(state: State, database: StorageBackend):
+    """Serve `database` from the app owning `state`, with an empty response cache."""
+    if state.change_notifier is not None:
+        state.change_notifier.close()
+        state.change_notifier = None
+    state.async_db = AsyncDatabase(database, state.metrics)
+    state.response_cache = ResponseCache(config.CACHE_MAX_ENTRIES, config.CACHE_MAX_BYTES)
+
+
+def create_app(database: Optional[StorageBackend] = None) -> FastAPI:
+    """Build the application serving `database`.
+
+    Without a database, the configured one is created, and seeded if
+    DB_SAMPLE_DATA is set, when the app starts rather than on import.
+    Everything routes use is kept on `application.state`, so apps built in
+    one process do not share a database, cache, encoder or metrics.
+    """
+    application = FastAPI(
+        title="Product CRUD API",
+        description="A simple CRUD API for managing products",
+        version="1.0.0"
+    )
+    # Enable CORS for frontend
+    application.add_middleware(
+        CORSMiddleware,
+        allow_origins=["http://localhost:5173"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "ETag"],
+    )
+    state = application.state
+    # Routes reach the storage backend through its async API; set by use_database
+    state.async_db = None
+    # Serialized GET responses, invalidated by collection and row versions
+    state.response_cache = ResponseCache(config.CACHE_MAX_ENTRIES, config.CACHE_MAX_BYTES)
+    # Serializes stored rows to JSON bytes for the routes that send them as is
+    state.encode_json = create_encoder(config.JSON_ENCODER)
+    # Wakes change feed subscribers; bound to the event loop serving them
+    state.change_notifier = None
+    # Sampling sessions and request traces; None without API_ADMIN_TOKEN
+    state.profiler = Profiler(config.ADMIN_TOKEN) if config.ADMIN_TOKEN else None
+    if state.profiler is not None:
+        application.add_middleware(ProfilingMiddleware, profiler=state.profiler)
+    # Request and storage latencies; None when API_METRICS is off
+    state.metrics = Metrics() if config.METRICS else None
+    if state.metrics is not None:
+        # Added last, so it is outermost and times everything the app does
+        application.add_middleware(MetricsMiddleware, metrics=state.metrics)
+    # Route objects hold no per-app state, so the router's are reused
+    # instead of being rebuilt by include_router
+    application.router.routes.extend(router.routes)
+    if database is not None:
+        use_database(state, database)
+    else:
+        application.add_event_handler("startup", lambda: use_database(state, get_database()))
+    application.add_event_handler("shutdown", functools.partial(close_database, state))
+    return application
+
+
+app = create_app()
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    import uvicorn
+    if config.WORKERS > 1 and config.BACKEND != "sqlite":
+        # Each worker would hold its own diverging copy of an in-memory database
+        raise SystemExit("API_WORKERS > 1 requires DB_BACKEND=sqlite, which worker processes share")
+    # Workers import the app themselves, so it is passed by name
+    uvicorn.run("main:app" if config.WORKERS > 1 else app, host="0.0.0.0", port=8000, workers=config.WORKERS)
@@ -0,0 +1,333 @@
+"""Read-only binary snapshot files served straight from memory-mapped pages.
+
+A mapped snapshot stores the products, users and settings tables column by
+column: fixed-width values in typed arrays, strings as end offsets into a
+heap of UTF-8 bytes per column, and low-cardinality values (categories,
+tag lists) as codes into a list kept in the header. Each table's id
+column is sorted, so it is also the table's id index.
+
+Opening a file parses only the header. Rows are decoded from the mapped
+pages when they are read and are not kept, so opening a large catalog
+costs no more than opening a small one, and the pages are shared through
+the page cache by every process that maps the same file.
+
+Layout, in native byte order:
+
+    b"CRUDMAP1"   magic
+    u64           header length
+    header        JSON: byte order, counters, and each table's row count
+                  and column locations, relative to the data section
+    data          columns, each starting on an 8-byte boundary
+"""
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, MutableMapping
+import json
+import mmap
+import os
+import struct
+import sys
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+
+from columnar import from_epoch_micros, to_epoch_micros
+from models import Product, Setting, User
+from persistence import replace_durably
+
+MAGIC = b"CRUDMAP1"
+_PREAMBLE = struct.Struct("<8sQ")
+
+# Encoding of every stored field of each table
+SCHEMAS = {
+    "products": {
+        "id": "int", "name": "str", "description": "str", "price": "float", "category": "enum",
+        "tags": "enum", "in_stock": "bool", "created_at": "datetime", "version": "int", "seq": "int",
+    },
+    "users": {
+        "id": "int", "name": "str", "email": "str", "password": "str", "created_at": "datetime", "version": "int",
+    },
+    "settings": {
+        "id": "int", "key": "str", "value": "str", "description": "optional str", "created_at": "datetime",
+        "version": "int",
+    },
+}
+MODELS = {"products": Product, "users": User, "settings": Setting}
+# Array type of each encoding's values; strings store end offsets into their heap
+_TYPECODES = {
+    "int": "q", "float": "d", "bool": "b", "datetime": "q", "enum": "I", "str": "q", "optional str": "q",
+}
+
+
+def _aligned(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+class _ColumnWriter:
+    """Accumulates one column's values in their stored encoding."""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.values = array(_TYPECODES[kind])
+        self.heap = bytearray()
+        self.nulls = array("b")
+        self.codes: Dict[Any, int] = {}
+
+    def append(self, value: Any):
+        kind = self.kind
+        if kind == "datetime":
+            self.values.append(to_epoch_micros(value))
+        elif kind == "enum":
+            key = tuple(value) if isinstance(value, list) else value
+            self.values.append(self.codes.setdefault(key, len(self.codes)))
+        elif kind in ("str", "optional str"):
+            if kind == "optional str":
+                self.nulls.append(value is None)
+            self.heap += (value or "").encode()
+            self.values.append(len(self.heap))
+        else:
+            self.values.append(value)
+
+    def parts(self) -> Dict[str, Any]:
+        """Buffers to store, by the name the header refers to them with."""
+        parts = {"values": self.values}
+        if self.kind in ("str", "optional str"):
+            parts["heap"] = self.heap
+        if self.kind == "optional str":
+            parts["nulls"] = self.nulls
+        return parts
+
+
+def write_mapped(path: str, tables: Dict[str, Iterable[BaseModel]], counters: Optional[Dict[str, Any]] = None):
+    """Atomically write tables, each given in ascending id order, as a mapped snapshot.
+
+    `counters` are stored in the header as they are.
+    """
+    header: Dict[str, Any] = {"byteorder": sys.byteorder, "counters": counters or {}, "tables": {}}
+    buffers = []
+    size = 0
+    for table, rows in tables.items():
+        columns = {field: _ColumnWriter(kind) for field, kind in SCHEMAS[table].items()}
+        count = last_id = 0
+        for row in rows:
+            if row.id <= last_id:
+                raise ValueError(f"Rows of {table} are not in ascending id order at id {row.id}")
+            last_id = row.id
+            count += 1
+            for field, column in columns.items():
+                column.append(getattr(row, field))
+        described = {}
+        for field, column in columns.items():
+            described[field] = {"kind": column.kind}
+            for name, buffer in column.parts().items():
+                described[field][name] = [size, len(buffer) * getattr(buffer, "itemsize", 1)]
+                buffers.append(buffer)
+                size = _aligned(size + described[field][name][1])
+            if column.kind == "enum":
+                described[field]["enum"] = list(column.codes)
+        header["tables"][table] = {"rows": count, "columns": described}
+
+    header_json = json.dumps(header, separators=(",", ":")).encode()
+    data_start = _aligned(_PREAMBLE.size + len(header_json))
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, len(header_json)) + header_json)
+        f.write(bytes(data_start - f.tell()))
+        for buffer in buffers:
+            f.write(buffer)
+            f.write(bytes(_aligned(f.tell()) - f.tell()))
+        f.flush()
+        os.fsync(f.fileno())
+    replace_durably(tmp_path, path)
+
+
+def _view(data: memoryview, location: List[int], typecode: str = "B") -> memoryview:
+    """Typed view of a stored buffer, given as [offset, length] within the data section."""
+    start, length = location
+    return data[start:start + length].cast(typecode)
+
+
+def _column_reader(column: Dict[str, Any], data: memoryview) -> Callable[[int], Any]:
+    """Function decoding a column's value at a row position, reading the mapped pages in place."""
+    kind = column["kind"]
+    values = _view(data, column["values"], _TYPECODES[kind])
+    if kind == "bool":
+        return lambda i: bool(values[i])
+    if kind == "datetime":
+        return lambda i: from_epoch_micros(values[i])
+    if kind == "enum":
+        decoded = column["enum"]
+        if any(isinstance(value, list) for value in decoded):
+            # Tag lists are shared by many rows, so each read gets its own list
+            return lambda i: list(decoded[values[i]])
+        return lambda i: decoded[values[i]]
+    if kind in ("str", "optional str"):
+        heap = _view(data, column["heap"])
+        read = lambda i: str(heap[values[i - 1] if i else 0:values[i]], "utf-8")
+        if kind == "optional str":
+            nulls = _view(data, column["nulls"], "b")
+            return lambda i: None if nulls[i] else read(i)
+        return read
+    return values.__getitem__
+
+
+class MappedTable(Mapping):
+    """One table of a mapped snapshot, behaving as a read-only dict of id -> model.
+
+    A row is found by its position in the sorted id column and built from
+    the columns when it is read; models are not kept.
+    """
+
+    def __init__(self, model: type, info: Dict[str, Any], data: memoryview):
+        self.model = model
+        self.ids = _view(data, info["columns"]["id"]["values"], "q")
+        self._readers: List[Tuple[str, Callable[[int], Any]]] = [
+            (field, _column_reader(column, data)) for field, column in info["columns"].items()
+        ]
+        self._fields = frozenset(model.model_fields)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.ids)
+
+    def position(self, row_id: Any) -> int:
+        """Index of a row in the columns, or -1 if there is no row with that id."""
+        ids = self.ids
+        if not ids or not isinstance(row_id, int):
+            return -1
+        # Ids are usually dense, so try where they would be before searching
+        i = row_id - ids[0]
+        if 0 <= i < len(ids) and ids[i] == row_id:
+            return i
+        i = bisect_left(ids, row_id)
+        return i if i < len(ids) and ids[i] == row_id else -1
+
+    def __contains__(self, row_id: Any) -> bool:
+        return self.position(row_id) >= 0
+
+    def row(self, i: int) -> BaseModel:
+        """Build the model of the row at position i."""
+        # What model_construct does, without its per-field default handling
+        row = object.__new__(self.model)
+        object.__setattr__(row, "__dict__", {field: read(i) for field, read in self._readers})
+        object.__setattr__(row, "__pydantic_fields_set__", set(self._fields))
+        object.__setattr__(row, "__pydantic_extra__", None)
+        object.__setattr__(row, "__pydantic_private__", None)
+        return row
+
+    def get(self, row_id: Any, default=None):
+        i = self.position(row_id)
+        return default if i < 0 else self.row(i)
+
+    def __getitem__(self, row_id: Any) -> BaseModel:
+        i = self.position(row_id)
+        if i < 0:
+            raise KeyError(row_id)
+        return self.row(i)
+
+    def values(self) -> Iterator[BaseModel]:
+        """Build every row in id order."""
+        return (self.row(i) for i in range(len(self.ids)))
+
+
+class MappedSnapshot:
+    """A mapped snapshot file opened read-only.
+
+    Raises ValueError if the file is not a mapped snapshot or was written
+    on a machine of the other byte order.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _PREAMBLE.size or self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a mapped snapshot")
+        _, header_size = _PREAMBLE.unpack_from(self._map)
+        header = json.loads(self._map[_PREAMBLE.size:_PREAMBLE.size + header_size])
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was written with {header['byteorder']}-endian byte order")
+        self.counters: Dict[str, Any] = header["counters"]
+        data = memoryview(self._map)[_aligned(_PREAMBLE.size + header_size):]
+        self.tables = {
+            table: MappedTable(MODELS[table], info, data) for table, info in header["tables"].items()
+        }
+
+
+class OverlayTable(MutableMapping):
+    """A mapped table with writes kept in memory over it.
+
+    Created and updated rows are stored in `overlay`, which may be any
+    dict-like table, and deletes of mapped rows are remembered in
+    `deleted`; the file itself is never written. Rows written this way are
+    not persisted. Like a dict, iteration is in insertion order: mapped
+    rows by id, then rows created since.
+
+    A single-row read needs no lock: a delete marks the id deleted before
+    dropping any overlay row, and every other write replaces one entry.
+    """
+
+    def __init__(self, base: MappedTable, overlay: Optional[MutableMapping] = None):
+        self.base = base
+        self.overlay: MutableMapping = {} if overlay is None else overlay
+        self.deleted: Set[int] = set()
+        self._len = len(base) + len(self.overlay)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def get(self, row_id: Any, default=None):
+        row = self.overlay.get(row_id)
+        if row is not None:
+            return row
+        if row_id in self.deleted:
+            return default
+        return self.base.get(row_id, default)
+
+    def __getitem__(self, row_id: Any):
+        row = self.get(row_id)
+        if row is None:
+            raise KeyError(row_id)
+        return row
+
+    def __contains__(self, row_id: Any) -> bool:
+        return row_id in self.overlay or (row_id not in self.deleted and row_id in self.base)
+
+    def __setitem__(self, row_id: int, row: BaseModel):
+        if row_id not in self:
+            self._len += 1
+        self.overlay[row_id] = row
+        self.deleted.discard(row_id)
+
+    def __delitem__(self, row_id: int):
+        if row_id not in self:
+            raise KeyError(row_id)
+        if row_id in self.base:
+            self.deleted.add(row_id)
+        self.overlay.pop(row_id, None)
+        self._len -= 1
+
+    def __iter__(self) -> Iterator[int]:
+        overlay, deleted, base = self.overlay, self.deleted, self.base
+        for row_id in base:
+            if row_id in overlay or row_id not in deleted:
+                yield row_id
+        for row_id in overlay:
+            if row_id not in base:
+                yield row_id
+
+    def values(self) -> Iterator[BaseModel]:
+        overlay, deleted, base = self.overlay, self.deleted, self.base
+        for i, row_id in enumerate(base.ids):
+            row = overlay.get(row_id)
+            if row is None:
+                if row_id in deleted:
+                    continue
+                row = base.row(i)
+            yield row
+        for row_id in overlay:
+            if row_id not in base:
+                row = overlay.get(row_id)
+                if row is not None:
+                    yield row
@@ -0,0 +1,199 @@
+"""Request and storage metrics, exposed in the Prometheus text exposition format.
+
+Latencies go into histograms with fixed buckets, so recording one is a
+bisect and two additions, and memory is bounded by the number of label
+combinations: routes are labelled by their path template, never the raw
+path. Everything is recorded on the event loop thread, so no locking is
+needed. Values that are kept elsewhere anyway, such as row counts and the
+response cache's counters, are read when the metrics are scraped rather
+than tracked here.
+"""
+from bisect import bisect_left
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Route label of requests that matched no route, such as 404s for unknown paths
+UNMATCHED_ROUTE = "<unmatched>"
+# Media type of the text exposition format; responses add the charset
+# Requests held before being folded into the histograms together
+PENDING_REQUESTS = 256
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+class Histogram:
+    """Count of observations in each fixed bucket, plus their sum."""
+
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        # One count per bucket, plus one for values above the last bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+
+def _labels(names: Iterable[str], values: Iterable[Any]) -> str:
+    """Render a label set, escaping values as the exposition format requires."""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return ",".join(pairs)
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """Request latencies by route and status, in-flight requests and storage call latencies."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # (method, route template, status) -> latency histogram
+        self.requests: Dict[Tuple[str, str, int], Histogram] = {}
+        self.in_flight = 0
+        # (method, route template, status, seconds) of requests not yet in `requests`
+        self.pending: List[Tuple[str, str, int, float]] = []
+        # Storage backend method name -> latency histogram
+        self.db_calls: Dict[str, Histogram] = {}
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        key = (method, route, status)
+        histogram = self.requests.get(key)
+        if histogram is None:
+            histogram = self.requests[key] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def record_request(self, method: str, route: str, status: int, seconds: float):
+        """Queue a request for `observe_request`, folding the queue in once it is full.
+
+        Histograms are cold in the cache by the time a request finishes, so
+        updating them in batches costs less than once per request.
+        """
+        pending = self.pending
+        pending.append((method, route, status, seconds))
+        if len(pending) >= PENDING_REQUESTS:
+            self.flush()
+
+    def flush(self):
+        """Fold queued requests into their histograms."""
+        for request in self.pending:
+            self.observe_request(*request)
+        self.pending.clear()
+
+    def observe_db_call(self, operation: str, seconds: float):
+        histogram = self.db_calls.get(operation)
+        if histogram is None:
+            histogram = self.db_calls[operation] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def _histogram_lines(self, name: str, label_names: Tuple[str, ...],
+                         histograms: Dict[Any, Histogram]) -> List[str]:
+        lines = []
+        for key, histogram in sorted(histograms.items()):
+            labels = _labels(label_names, key if isinstance(key, tuple) else (key,))
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += histogram.counts[-1]
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {_number(histogram.sum)}")
+            lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return lines
+
+    def render(self, scraped: Optional[Dict[str, Tuple[str, str, str, Dict[Any, float]]]] = None) -> str:
+        """All metrics in the text exposition format.
+
+        `scraped` adds values read at scrape time, mapping a metric name to
+        (type, help, label name, {label value: value}); an empty label name
+        means one unlabelled value, keyed by anything.
+        """
+        self.flush()
+        lines = [
+            "# HELP http_requests_total HTTP requests by method, route and status.",
+            "# TYPE http_requests_total counter",
+        ]
+        for key, histogram in sorted(self.requests.items()):
+            lines.append(f"http_requests_total{{{_labels(('method', 'route', 'status'), key)}}} {histogram.count}")
+        lines += [
+            "# HELP http_request_duration_seconds HTTP request latency by method, route and status.",
+            "# TYPE http_request_duration_seconds histogram",
+            *self._histogram_lines("http_request_duration_seconds", ("method", "route", "status"), self.requests),
+            "# HELP http_requests_in_flight HTTP requests being served.",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {self.in_flight}",
+            "# HELP db_operation_duration_seconds Storage backend call latency by operation.",
+            "# TYPE db_operation_duration_seconds histogram",
+            *self._histogram_lines("db_operation_duration_seconds", ("operation",), self.db_calls),
+        ]
+        for name, (metric_type, help_text, label_name, values) in (scraped or {}).items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+            for label_value, value in values.items():
+                labels = f"{{{_labels((label_name,), (label_value,))}}}" if label_name else ""
+                lines.append(f"{name}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class _StatusRecorder:
+    """ASGI send callable passing messages on and keeping the response status.
+
+    A slotted object rather than a closure allocated per request, and a
+    plain method returning the downstream send's awaitable rather than a
+    coroutine awaiting it, so no coroutine is created per message sent.
+    """
+
+    __slots__ = ("send", "status")
+
+    def __init__(self, send: Callable):
+        self.send = send
+        # Kept if the app fails before starting a response
+        self.status = 500
+
+    def __call__(self, message: dict) -> Awaitable:
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+        return self.send(message)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the latency, route and status of every HTTP request.
+
+    Latency runs from receiving the request until the app has sent the
+    whole response, so streamed responses count in full. Written as raw
+    ASGI rather than BaseHTTPMiddleware, which would add a task and a
+    stream per request.
+    """
+
+    def __init__(self, app: Callable, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        metrics = self.metrics
+        recorder = _StatusRecorder(send)
+        metrics.in_flight += 1
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, recorder)
+        finally:
+            elapsed = perf_counter() - start
+            metrics.in_flight -= 1
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            metrics.record_request(scope["method"], UNMATCHED_ROUTE if route is None else route.path,
+                                   recorder.status, elapsed)
@@ -1,5 +1,5 @@
 """Pydantic models for product data structures."""
-from typing import Optional, List
+from typing import Optional, List, Union
 from datetime import datetime
 
 from pydantic import BaseModel
@@ -15,6 +15,29 @@ class Product(BaseModel):
     tags: List[str] = []
     in_stock: bool = True
     created_at: datetime = datetime.now()
+    # Incremented on every update; exposed to clients as the ETag
+    version: int = 1
+    # Modification sequence of the products collection at this row's last
+    # create or update; 0 until the database assigns one
+    seq: int = 0
+
+
+class ProductTombstone(BaseModel):
+    """Marker left by a deleted product, kept for delta sync clients."""
+    id: int
+    seq: int
+    deleted_at: datetime
+
+
+class ProductChanges(BaseModel):
+    """Products created, updated or deleted after a sync watermark."""
+    # Watermark to pass as `since` on the next request
+    seq: int
+    # Current rows of created and updated products, in sequence order
+    products: List[Product]
+    deleted: List[ProductTombstone]
+    # Whether more changes follow `seq`
+    more: bool
 
 
 class ProductCreate(BaseModel):
@@ -37,6 +60,11 @@ class ProductUpdate(BaseModel):
     in_stock: Optional[bool] = None
 
 
+class ProductBatchUpdate(ProductUpdate):
+    """Model for one entry of a bulk product update."""
+    id: int
+
+
 class User(BaseModel):
     """User model with all fields."""
     id: int
@@ -44,6 +72,7 @@ class User(BaseModel):
     email: str
     password: str
     created_at: datetime = datetime.now()
+    version: int = 1
 
 class UserCreate(BaseModel):
     """Model for creating a new user."""
@@ -59,6 +88,11 @@ class UserUpdate(BaseModel):
     password: Optional[str] = None
 
 
+class UserBatchUpdate(UserUpdate):
+    """Model for one entry of a bulk user update."""
+    id: int
+
+
 class Setting(BaseModel):
     """Setting model with all fields."""
     id: int
@@ -66,6 +100,7 @@ class Setting(BaseModel):
     value: str
     description: Optional[str] = None
     created_at: datetime = datetime.now()
+    version: int = 1
 
 
 class SettingCreate(BaseModel):
@@ -78,4 +113,27 @@ class SettingCreate(BaseModel):
 class SettingUpdate(BaseModel):
     """Model for updating an existing setting."""
     value: Optional[str] = None
-    description: Optional[str] = None
\ No newline at end of file
+    description: Optional[str] = None
+
+
+class SettingBatchUpdate(SettingUpdate):
+    """Model for one entry of a bulk setting update."""
+    id: int
+
+
+class PriceStats(BaseModel):
+    """Price aggregates over one group of products."""
+    # Category, tag or stock flag shared by the group; None when ungrouped
+    group: Union[bool, str, None] = None
+    count: int
+    sum: float
+    min: float
+    max: float
+    avg: float
+
+
+class GroupTotals(BaseModel):
+    """Product count and price sum of one group in a materialized view."""
+    group: Union[bool, str, None] = None
+    count: int
+    sum: float
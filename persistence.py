@@ -0,0 +1,188 @@
+"""Write-ahead log and snapshot files for durable in-memory storage.
+
+Every change to a row is appended to the write-ahead log (WAL) as one JSON
+line, and the changes of a multi-row write as one line holding all their
+records, so recovery never applies part of a batch. A snapshot is a compact copy of every table; once it is safely on
+disk the log is truncated, so recovery only replays the log tail written
+after the last snapshot.
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+# fsync policies: "always" syncs every record before returning, "batch"
+# groups records into one fsync per batch (group commit), "never" leaves
+# flushing to the operating system.
+FSYNC_POLICIES = ("always", "batch", "never")
+
+WAL_FILE = "wal.log"
+SNAPSHOT_FILE = "snapshot.ndjson"
+
+
+class WriteAheadLog:
+    """Append-only log of row changes with configurable fsync batching.
+
+    With the "batch" policy a record is synced once `batch_size` records are
+    pending or `batch_interval` seconds after it was written, whichever comes
+    first, so a crash can lose at most that window of acknowledged writes.
+    """
+
+    def __init__(self, path: str, fsync: str = "batch", batch_size: int = 256, batch_interval: float = 0.01,
+                 lsn: int = 0):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy {fsync!r}, expected one of {FSYNC_POLICIES}")
+        self.path = path
+        self.fsync = fsync
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.lsn = lsn
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._closed = False
+        self._syncer = None
+        if fsync == "batch":
+            self._wakeup = threading.Event()
+            self._syncer = threading.Thread(target=self._sync_loop, name="wal-sync", daemon=True)
+            self._syncer.start()
+
+    def append(self, op: str, table: str, row_id: int, row: Optional[BaseModel] = None) -> int:
+        """Log one change and return its log sequence number (LSN)."""
+        return self.append_batch([(op, table, row_id, row)])
+
+    def append_batch(self, changes: List[Tuple[str, str, int, Optional[BaseModel]]]) -> int:
+        """Log changes that are recovered all together or not at all, returning the last LSN.
+
+        Each change gets its own LSN, but several are written as a single
+        line, so a crash while writing them leaves a torn line that
+        recovery drops as a whole.
+        """
+        with self._lock:
+            records = []
+            for op, table, row_id, row in changes:
+                self.lsn += 1
+                record = {"lsn": self.lsn, "op": op, "table": table, "id": row_id}
+                if row is not None:
+                    record["row"] = row.model_dump(mode="json")
+                records.append(record)
+            line = records[0] if len(records) == 1 else {"records": records}
+            self._file.write(json.dumps(line, separators=(",", ":")) + "\n")
+            if self.fsync == "always":
+                self._sync_locked()
+            elif self.fsync == "batch":
+                self._pending += len(records)
+                if self._pending >= self.batch_size:
+                    self._sync_locked()
+                elif self._pending == len(records):
+                    self._wakeup.set()
+            else:
+                self._file.flush()
+            return self.lsn
+
+    def _sync_locked(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def _sync_loop(self):
+        """Background group commit: sync pending records after batch_interval."""
+        while not self._closed:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            time.sleep(self.batch_interval)
+            with self._lock:
+                if self._pending and not self._closed:
+                    self._sync_locked()
+
+    def sync(self):
+        """Flush and fsync everything written so far."""
+        with self._lock:
+            self._sync_locked()
+
+    def truncate(self):
+        """Discard every record, keeping the LSN counter."""
+        with self._lock:
+            self._file.close()
+            self._file = open(self.path, "w", encoding="utf-8")
+            self._sync_locked()
+
+    def close(self):
+        """Sync and close the log."""
+        with self._lock:
+            if self._closed:
+                return
+            self._sync_locked()
+            self._closed = True
+            self._file.close()
+        if self._syncer is not None:
+            self._wakeup.set()
+            self._syncer.join()
+
+
+def read_wal(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the records of a log file, stopping at a torn final line."""
+    if not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash mid-write can leave a partial last line
+                return
+            if "records" in record:
+                yield from record["records"]
+            else:
+                yield record
+
+
+def write_snapshot(path: str, lsn: int, next_ids: Dict[str, int], tables: Dict[str, Iterable[BaseModel]],
+                   counters: Optional[Dict[str, int]] = None):
+    """Atomically write a snapshot of every table as of `lsn`.
+
+    The first line is a header, holding `next_ids` and any other
+    `counters`; every other line is `<table>\\t<row json>`.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"lsn": lsn, "next_ids": next_ids, **(counters or {})}) + "\n")
+        for table, rows in tables.items():
+            prefix = table + "\t"
+            for row in rows:
+                f.write(prefix + row.model_dump_json() + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    replace_durably(tmp_path, path)
+
+
+def replace_durably(tmp_path: str, path: str):
+    """Rename a fully synced file over `path` and sync the directory entry."""
+    os.replace(tmp_path, path)
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def read_snapshot(path: str) -> Tuple[Optional[Dict[str, Any]], Iterator[Tuple[str, str]]]:
+    """Return a snapshot's header and an iterator of (table, row json) pairs.
+
+    The header is None when there is no snapshot yet.
+    """
+    if not os.path.exists(path):
+        return None, iter(())
+    f = open(path, encoding="utf-8")
+    header = json.loads(f.readline())
+
+    def rows():
+        with f:
+            for line in f:
+                table, row_json = line.rstrip("\n").split("\t", 1)
+                yield table, row_json
+
+    return header, rows()
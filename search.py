@@ -0,0 +1,184 @@
+"""In-process full-text search over products with BM25 ranking."""
+from collections import Counter
+import heapq
+import math
+import re
+from typing import Dict, List, Tuple
+
+from indexes import SortedIndex
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase word tokens."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+class SearchIndex:
+    """Inverted index with BM25 scoring and prefix matching on the last query term.
+
+    Documents are added and removed one at a time, so the index is kept up
+    to date incrementally instead of being rebuilt.
+
+    Each query term contributes the score of its best matching index term,
+    so a prefix counts once however many words it expands to. Queries are
+    evaluated term at a time, rarest first, using per-term score upper
+    bounds (MaxScore) to stop scanning posting lists that can no longer
+    change the top results.
+    """
+
+    K1 = 1.2
+    B = 0.75
+    # Upper bound on how many vocabulary terms a prefix may expand to
+    MAX_PREFIX_EXPANSIONS = 32
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.doc_terms: Dict[int, Counter] = {}
+        self.doc_lengths: Dict[int, int] = {}
+        self.total_length = 0
+        self.vocabulary = SortedIndex()
+        # term -> [highest frequency, shortest document length] seen for the
+        # term. Only tightened when the term is dropped, so it may overestimate
+        # but never underestimate the best score a term can give.
+        self.term_bounds: Dict[str, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, doc_id: int, text: str):
+        """Index a document, replacing any previous version of it."""
+        if doc_id in self.doc_lengths:
+            self.remove(doc_id)
+        tokens = tokenize(text)
+        terms = Counter(tokens)
+        for term, freq in terms.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+                self.term_bounds[term] = [freq, len(tokens)]
+                self.vocabulary.add(term)
+            else:
+                bounds = self.term_bounds[term]
+                bounds[0] = max(bounds[0], freq)
+                bounds[1] = min(bounds[1], len(tokens))
+            postings[doc_id] = freq
+        self.doc_terms[doc_id] = terms
+        self.doc_lengths[doc_id] = len(tokens)
+        self.total_length += len(tokens)
+
+    def remove(self, doc_id: int):
+        """Remove a document from the index, if present."""
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self.postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self.postings[term]
+                del self.term_bounds[term]
+                self.vocabulary.remove(term)
+        self.total_length -= self.doc_lengths.pop(doc_id)
+
+    def expand_prefix(self, prefix: str) -> List[str]:
+        """Return vocabulary terms starting with `prefix`."""
+        terms = []
+        for term in self.vocabulary.irange(prefix):
+            if not term.startswith(prefix) or len(terms) == self.MAX_PREFIX_EXPANSIONS:
+                break
+            terms.append(term)
+        return terms
+
+    def search(self, query: str, limit: int = 10, prefix: bool = True) -> List[Tuple[int, float]]:
+        """Return up to `limit` (doc_id, score) pairs, best match first.
+
+        With `prefix`, the last query term also matches any indexed term it
+        is a prefix of, so partially typed words still find results.
+        """
+        query_terms = tokenize(query)
+        if not query_terms or not self.doc_lengths:
+            return []
+
+        n_docs = len(self.doc_lengths)
+        avg_length = self.total_length / n_docs or 1.0
+        k1, b = self.K1, self.B
+
+        # Each group holds the (upper bound, idf, term) entries one query term
+        # matches, best bound first.
+        groups: List[List[Tuple[float, float, str]]] = []
+        for position, query_term in enumerate(query_terms):
+            if prefix and position == len(query_terms) - 1:
+                terms = self.expand_prefix(query_term)
+            else:
+                terms = [query_term] if query_term in self.postings else []
+            entries = []
+            for term in terms:
+                df = len(self.postings[term])
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                max_freq, min_length = self.term_bounds[term]
+                bound = idf * max_freq * (k1 + 1) / (max_freq + k1 * (1 - b + b * min_length / avg_length))
+                entries.append((bound, idf, term))
+            if entries:
+                groups.append(sorted(entries, reverse=True))
+        if not groups:
+            return []
+
+        order = sorted(
+            ((entry, group) for group, entries in enumerate(groups) for entry in entries),
+            key=lambda item: item[0][0],
+            reverse=True,
+        )
+        next_entry = [0] * len(groups)
+        group_best: List[Dict[int, float]] = [{} for _ in groups]
+        scores: Dict[int, float] = {}
+        threshold = 0.0
+        candidates = None
+        # BM25 length normalisation is norm_base + norm_scale * doc_length
+        lengths = self.doc_lengths
+        norm_base = k1 * (1 - b)
+        norm_scale = k1 * b / avg_length
+
+        for (bound, idf, term), group in order:
+            # Best score a document not seen yet could still reach
+            remaining = sum(
+                entries[next_entry[g]][0] if next_entry[g] < len(entries) else 0.0
+                for g, entries in enumerate(groups)
+            )
+            next_entry[group] += 1
+            postings = self.postings[term]
+            best = group_best[group]
+            idf_k1 = idf * (k1 + 1)
+
+            if candidates is None and len(scores) >= limit and threshold > remaining:
+                # No new document can reach the top results any more
+                candidates = [doc_id for doc_id, score in scores.items() if score + remaining >= threshold]
+            if candidates is not None:
+                candidates = [doc_id for doc_id in candidates if scores[doc_id] + remaining >= threshold]
+                if not candidates:
+                    break
+                matches = [(doc_id, postings[doc_id]) for doc_id in candidates if doc_id in postings]
+            else:
+                matches = postings.items()
+
+            touched = []
+            if len(groups[group]) == 1:
+                # A single-term group is scored once per document
+                for doc_id, freq in matches:
+                    score = scores.get(doc_id, 0.0) + idf_k1 * freq / (freq + norm_base + norm_scale * lengths[doc_id])
+                    scores[doc_id] = score
+                    touched.append(score)
+            else:
+                for doc_id, freq in matches:
+                    score = idf_k1 * freq / (freq + norm_base + norm_scale * lengths[doc_id])
+                    previous = best.get(doc_id, 0.0)
+                    if score > previous:
+                        best[doc_id] = score
+                        total = scores.get(doc_id, 0.0) + score - previous
+                        scores[doc_id] = total
+                        touched.append(total)
+            if len(touched) >= limit:
+                threshold = max(threshold, heapq.nlargest(limit, touched)[-1])
+
+        return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
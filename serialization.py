@@ -0,0 +1,101 @@
+"""JSON encoders that turn stored models into response bytes.
+
+Routes hand their rows to the configured encoder rather than to FastAPI.
+The default, response_model, validates every response against its model
+first. Rows handed out by the storage backends are already validated
+models, so the pydantic and orjson encoders are opt-in fast paths that
+serialize them directly. All of them produce the same bytes as FastAPI
+would for the models in this API, except that floats in exponent
+notation are written as 1e-7 rather than 1e-07.
+"""
+from typing import Any, Callable, Dict, List
+
+from fastapi.exceptions import ResponseValidationError
+from fastapi.utils import create_response_field
+from pydantic import BaseModel
+from pydantic_core import to_json
+
+JsonEncoder = Callable[[Any], bytes]
+
+
+def response_model_encoder() -> JsonEncoder:
+    """Validate each response against its model before encoding it.
+
+    The response model of every route is the model of the rows it
+    returns, or a list of them. Models are dumped and the dump validated
+    through a FastAPI response field, so a row that breaks its model
+    raises ResponseValidationError, served as a 500, instead of being
+    sent. FastAPI itself passes model instances through unchecked under
+    pydantic 2. About three times slower than the pydantic encoder on
+    large lists.
+    """
+    fields: Dict[Any, Any] = {}
+
+    def encode(value: Any) -> bytes:
+        if isinstance(value, list):
+            # Rows have no nested models, so their field values are validated as they are
+            content = [row.__dict__ if isinstance(row, BaseModel) else row for row in value]
+            response_type = List[type(value[0])] if value and isinstance(value[0], BaseModel) else list
+        elif isinstance(value, BaseModel):
+            content, response_type = value.model_dump(warnings=False), type(value)
+        else:
+            content, response_type = value, Any
+        field = fields.get(response_type)
+        if field is None:
+            field = fields[response_type] = create_response_field(name="response", type_=response_type)
+        validated, errors = field.validate(content, {}, loc=("response",))
+        if errors:
+            raise ResponseValidationError(errors=errors, body=content)
+        return to_json(validated)
+
+    return encode
+
+
+def pydantic_encoder() -> JsonEncoder:
+    """Encode with pydantic-core's serializer, the one model_dump_json uses.
+
+    Wrapped in a Python function so that a sampling profiler, which sees
+    no C calls, counts the encoding as serialization.
+    """
+
+    def encode(value: Any) -> bytes:
+        return to_json(value)
+
+    return encode
+
+
+def orjson_encoder() -> JsonEncoder:
+    """Encode with orjson, reading model fields straight from each instance.
+
+    About four times faster than pydantic-core on lists of rows. Requires
+    the optional `orjson` package.
+    """
+    try:
+        import orjson
+    except ImportError:
+        raise ValueError("The orjson JSON encoder needs the orjson package: pip install orjson")
+
+    def model_fields(obj: Any) -> Dict[str, Any]:
+        if isinstance(obj, BaseModel):
+            return obj.__dict__
+        raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+    def encode(value: Any) -> bytes:
+        return orjson.dumps(value, default=model_fields, option=orjson.OPT_UTC_Z)
+
+    return encode
+
+
+# Encoder factories by name; add an entry to plug in another library
+JSON_ENCODERS: Dict[str, Callable[[], JsonEncoder]] = {
+    "response_model": response_model_encoder,
+    "pydantic": pydantic_encoder,
+    "orjson": orjson_encoder,
+}
+
+
+def create_encoder(name: str) -> JsonEncoder:
+    """Build the JSON encoder registered under `name`."""
+    if name not in JSON_ENCODERS:
+        raise ValueError(f"Unknown JSON encoder {name!r}, expected one of {tuple(JSON_ENCODERS)}")
+    return JSON_ENCODERS[name]()
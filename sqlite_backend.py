@@ -0,0 +1,990 @@
+"""SQLite storage engine for datasets that do not fit in memory.
+
+The database runs in WAL mode, so readers never block the single writer.
+Connections come from a fixed-size pool shared by all threads, and every
+statement is a module constant so each connection's prepared-statement
+cache can reuse it. Writes, including whole batches, run in one
+transaction.
+
+Committed changes are also written to a change table, in the same
+transaction, which every process serving the file mirrors into its change
+feed, so a subscriber sees every process's writes in one order.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import fcntl
+import json
+import mmap
+import os
+import queue
+import sqlite3
+import struct
+import threading
+from typing import Any, Container, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pydantic_core import to_json
+
+from changes import ChangeLog
+from models import (
+    GroupTotals, PriceStats, Product, ProductChanges, ProductCreate, ProductTombstone, ProductUpdate,
+    ProductBatchUpdate, User, UserCreate, UserUpdate, UserBatchUpdate,
+    Setting, SettingCreate, SettingUpdate, SettingBatchUpdate,
+)
+from persistence import FSYNC_POLICIES
+from search import tokenize
+from storage import (
+    DuplicateKeyError, InvalidCursorError, NotFoundError, SequenceExpiredError, VersionConflictError, sample_products,
+    setting_changes,
+)
+
+# Prepared statements kept per connection
+STATEMENT_CACHE_SIZE = 256
+# Seconds to wait for a lock held by another process before failing
+BUSY_TIMEOUT = 5.0
+# PRAGMA synchronous level for each fsync policy
+SYNCHRONOUS = {"always": "FULL", "batch": "NORMAL", "never": "OFF"}
+# Seconds between checks for changes committed by other processes
+CHANGE_POLL_INTERVAL = 0.05
+
+SCHEMA = """
+CREATE TABLE products (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT,
+    description TEXT,
+    price REAL,
+    category TEXT,
+    tags TEXT,
+    in_stock INTEGER,
+    created_at TEXT,
+    version INTEGER NOT NULL DEFAULT 1,
+    seq INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX products_category ON products (category, id);
+CREATE INDEX products_price ON products (price, id);
+CREATE INDEX products_in_stock ON products (in_stock, id);
+CREATE INDEX products_seq ON products (seq);
+CREATE TABLE product_tags (
+    tag TEXT,
+    product_id INTEGER REFERENCES products (id) ON DELETE CASCADE,
+    PRIMARY KEY (tag, product_id)
+) WITHOUT ROWID;
+CREATE INDEX product_tags_product ON product_tags (product_id);
+CREATE VIRTUAL TABLE products_fts USING fts5(text, tokenize="unicode61 remove_diacritics 0 tokenchars '_'");
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT,
+    email TEXT UNIQUE,
+    password TEXT,
+    created_at TEXT,
+    version INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE settings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT UNIQUE,
+    value TEXT,
+    description TEXT,
+    created_at TEXT,
+    version INTEGER NOT NULL DEFAULT 1
+);
+"""
+
+# Delta sync state, added to new and existing database files alike
+SYNC_SCHEMA = """
+CREATE TABLE IF NOT EXISTS product_tombstones (
+    id INTEGER PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    deleted_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS product_tombstones_seq ON product_tombstones (seq);
+CREATE INDEX IF NOT EXISTS product_tombstones_deleted_at ON product_tombstones (deleted_at);
+CREATE TABLE IF NOT EXISTS sync_counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO sync_counters (name, value) SELECT 'product_seq', COALESCE(MAX(seq), 0) FROM products;
+INSERT OR IGNORE INTO sync_counters (name, value) VALUES ('tombstone_horizon', 0);
+CREATE TABLE IF NOT EXISTS change_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    collection TEXT NOT NULL,
+    op TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    row TEXT
+);
+INSERT OR IGNORE INTO sync_counters (name, value) VALUES ('change_epoch', abs(random() % 4294967296))
+"""
+
+PRODUCT_COLUMNS = "id, name, description, price, category, tags, in_stock, created_at, version, seq"
+USER_COLUMNS = "id, name, email, password, created_at, version"
+SETTING_COLUMNS = "id, key, value, description, created_at, version"
+
+NEXT_ID = "SELECT seq FROM sqlite_sequence WHERE name = ?"
+
+SELECT_PRODUCT = f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id = ?"
+SELECT_ALL_PRODUCTS = f"SELECT {PRODUCT_COLUMNS} FROM products ORDER BY id"
+SELECT_PRODUCTS_PAGE = f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id > ? ORDER BY id LIMIT ?"
+SEARCH_PRODUCTS = (
+    f"SELECT {PRODUCT_COLUMNS} FROM products_fts JOIN products ON products.id = products_fts.rowid"
+    " WHERE products_fts MATCH ? ORDER BY rank, products.id LIMIT ?"
+)
+# Aggregates for product_stats, by group_by
+PRICE_AGGREGATES = "COUNT(*), SUM(price), MIN(price), MAX(price)"
+PRODUCT_STATS = {
+    None: f"SELECT NULL, {PRICE_AGGREGATES} FROM products HAVING COUNT(*) > 0",
+    "category": f"SELECT category, {PRICE_AGGREGATES} FROM products GROUP BY category ORDER BY category",
+    "in_stock": f"SELECT in_stock, {PRICE_AGGREGATES} FROM products GROUP BY in_stock ORDER BY in_stock",
+    "tag": (
+        f"SELECT tag, {PRICE_AGGREGATES} FROM product_tags JOIN products ON products.id = product_tags.product_id"
+        " GROUP BY tag ORDER BY tag"
+    ),
+}
+# Queries computing the in-memory engine's materialized views, by name
+PRODUCT_VIEWS = {
+    "category_totals": "SELECT category, COUNT(*), SUM(price) FROM products GROUP BY category ORDER BY category",
+    "stock_totals": "SELECT in_stock, COUNT(*), SUM(price) FROM products GROUP BY in_stock ORDER BY in_stock",
+    "tag_totals": (
+        "SELECT tag, COUNT(*), SUM(price) FROM product_tags JOIN products ON products.id = product_tags.product_id"
+        " GROUP BY tag ORDER BY tag"
+    ),
+}
+INSERT_PRODUCT = f"INSERT INTO products ({PRODUCT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+UPDATE_PRODUCT = (
+    "UPDATE products SET name = ?, description = ?, price = ?, category = ?, tags = ?, in_stock = ?,"
+    " version = ?, seq = ? WHERE id = ?"
+)
+SELECT_PRODUCT_VERSION = "SELECT version FROM products WHERE id = ?"
+DELETE_PRODUCT = "DELETE FROM products WHERE id = ?"
+INSERT_PRODUCT_TAG = "INSERT OR IGNORE INTO product_tags (tag, product_id) VALUES (?, ?)"
+DELETE_PRODUCT_TAGS = "DELETE FROM product_tags WHERE product_id = ?"
+INSERT_PRODUCT_TEXT = "INSERT INTO products_fts (rowid, text) VALUES (?, ?)"
+UPDATE_PRODUCT_TEXT = "UPDATE products_fts SET text = ? WHERE rowid = ?"
+DELETE_PRODUCT_TEXT = "DELETE FROM products_fts WHERE rowid = ?"
+# Reserve the next n product modification sequence numbers, returning the last
+ADVANCE_PRODUCT_SEQ = "UPDATE sync_counters SET value = value + ? WHERE name = 'product_seq' RETURNING value"
+SELECT_SYNC_COUNTERS = "SELECT name, value FROM sync_counters"
+SELECT_CHANGE_EPOCH = "SELECT value FROM sync_counters WHERE name = 'change_epoch'"
+INSERT_CHANGE = "INSERT INTO change_log (seq, collection, op, row_id, row) VALUES (?, ?, ?, ?, ?)"
+TRIM_CHANGES = "DELETE FROM change_log WHERE seq <= ?"
+SELECT_CHANGES = "SELECT seq, collection, op, row_id, row FROM change_log WHERE seq > ? AND seq < ? ORDER BY seq"
+INSERT_PRODUCT_TOMBSTONE = "INSERT OR REPLACE INTO product_tombstones (id, seq, deleted_at) VALUES (?, ?, ?)"
+PURGE_PRODUCT_TOMBSTONES = "DELETE FROM product_tombstones WHERE deleted_at < ? RETURNING seq"
+RAISE_TOMBSTONE_HORIZON = "UPDATE sync_counters SET value = MAX(value, ?) WHERE name = 'tombstone_horizon'"
+# Live products and tombstones after a sequence number, in sequence order;
+# tombstone rows carry only id, seq and deletion time
+SELECT_PRODUCT_CHANGES = (
+    f"SELECT {PRODUCT_COLUMNS}, NULL FROM products WHERE seq > ?"
+    " UNION ALL SELECT id, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, seq, deleted_at"
+    " FROM product_tombstones WHERE seq > ? ORDER BY seq LIMIT ?"
+)
+
+SELECT_USER = f"SELECT {USER_COLUMNS} FROM users WHERE id = ?"
+SELECT_USER_BY_EMAIL = f"SELECT {USER_COLUMNS} FROM users WHERE email = ?"
+SELECT_ALL_USERS = f"SELECT {USER_COLUMNS} FROM users ORDER BY id"
+SELECT_USERS_PAGE = f"SELECT {USER_COLUMNS} FROM users WHERE id > ? ORDER BY id LIMIT ?"
+INSERT_USER = f"INSERT INTO users ({USER_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)"
+UPDATE_USER = "UPDATE users SET name = ?, email = ?, password = ?, version = ? WHERE id = ?"
+RELEASE_USER_EMAIL = "UPDATE users SET email = NULL WHERE id = ?"
+SELECT_USER_VERSION = "SELECT version FROM users WHERE id = ?"
+DELETE_USER = "DELETE FROM users WHERE id = ?"
+
+SELECT_SETTING = f"SELECT {SETTING_COLUMNS} FROM settings WHERE id = ?"
+SELECT_SETTING_BY_KEY = f"SELECT {SETTING_COLUMNS} FROM settings WHERE key = ?"
+SELECT_ALL_SETTINGS = f"SELECT {SETTING_COLUMNS} FROM settings ORDER BY id"
+SELECT_SETTINGS_PAGE = f"SELECT {SETTING_COLUMNS} FROM settings WHERE id > ? ORDER BY id LIMIT ?"
+INSERT_SETTING = f"INSERT INTO settings ({SETTING_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)"
+UPDATE_SETTING = "UPDATE settings SET value = ?, description = ?, version = ? WHERE id = ?"
+SELECT_SETTING_VERSION = "SELECT version FROM settings WHERE id = ?"
+DELETE_SETTING = "DELETE FROM settings WHERE id = ?"
+
+
+def _product_from_row(row: tuple) -> Product:
+    """Build a Product from a row of PRODUCT_COLUMNS."""
+    # Rows were validated before they were written, so skip re-validation
+    return Product.model_construct(
+        id=row[0], name=row[1], description=row[2], price=row[3], category=row[4],
+        tags=json.loads(row[5]), in_stock=bool(row[6]), created_at=datetime.fromisoformat(row[7]), version=row[8],
+        seq=row[9],
+    )
+
+
+def _user_from_row(row: tuple) -> User:
+    """Build a User from a row of USER_COLUMNS."""
+    return User.model_construct(
+        id=row[0], name=row[1], email=row[2], password=row[3], created_at=datetime.fromisoformat(row[4]),
+        version=row[5],
+    )
+
+
+def _setting_from_row(row: tuple) -> Setting:
+    """Build a Setting from a row of SETTING_COLUMNS."""
+    return Setting.model_construct(
+        id=row[0], key=row[1], value=row[2], description=row[3], created_at=datetime.fromisoformat(row[4]),
+        version=row[5],
+    )
+
+
+def _product_text(product: Product) -> str:
+    """Text indexed for full-text search."""
+    return " ".join([product.name, product.description, *(product.tags or [])])
+
+
+def _page_limit(limit: Optional[int]) -> int:
+    """SQL LIMIT that fetches one extra row to detect a next page (-1 means no limit)."""
+    return -1 if limit is None else limit + 1
+
+
+def _split_page(rows: list, limit: Optional[int]) -> Tuple[list, Optional[int]]:
+    """Trim the extra row fetched by _page_limit and return the next cursor."""
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1].id
+    return rows, None
+
+
+class ConnectionPool:
+    """Fixed-size pool of SQLite connections shared across threads."""
+
+    def __init__(self, path: str, size: int = 8, synchronous: str = "NORMAL"):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self._connections: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._all = []
+        for _ in range(size):
+            # isolation_level=None leaves transactions to explicit BEGIN/COMMIT
+            conn = sqlite3.connect(
+                path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE,
+            )
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute(f"PRAGMA synchronous = {synchronous}")
+            conn.execute("PRAGMA foreign_keys = ON")
+            self._all.append(conn)
+            self._connections.put(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection, waiting for one to be returned if all are in use."""
+        conn = self._connections.get()
+        try:
+            yield conn
+        finally:
+            self._connections.put(conn)
+
+    def close(self):
+        """Close every connection."""
+        for conn in self._all:
+            conn.close()
+        self._all = []
+
+
+class SharedCounters:
+    """Named 64-bit counters in a memory-mapped file, shared by every process that maps it.
+
+    Increments hold an exclusive lock on the file so concurrent processes
+    do not lose any; reads take no lock, since an aligned 8-byte value is
+    written in one store.
+    """
+
+    def __init__(self, path: str, names: Iterable[str]):
+        self.offsets = {name: 8 * i for i, name in enumerate(names)}
+        size = 8 * len(self.offsets)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    def __getitem__(self, name: str) -> int:
+        return struct.unpack_from("q", self._map, self.offsets[name])[0]
+
+    def increment(self, name: str):
+        """Add one to a counter."""
+        offset = self.offsets[name]
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            struct.pack_into("q", self._map, offset, struct.unpack_from("q", self._map, offset)[0] + 1)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        if self._fd >= 0:
+            self._map.close()
+            os.close(self._fd)
+            self._fd = -1
+
+
+class SQLiteDatabase:
+    """SQLite-backed database with the same interface as InMemoryDatabase.
+
+    A new database file starts with the sample products, unless
+    `sample_data` is false; an existing one is opened as is. Several
+    processes can serve one file: SQLite keeps their reads consistent, and
+    the collection change counters live in a shared memory-mapped file next
+    to it, so each process's response cache sees every other process's
+    writes.
+
+    The change feed is kept in the file too, numbered under an epoch that
+    belongs to the file, so subscribers of any process see every write and
+    can resume on another process or after a restart. Each process mirrors
+    the retained changes into `changes`: its own as it commits them, and
+    other processes' when a shared counter says there are new ones.
+    """
+
+    def __init__(self, path: str, pool_size: int = 8, fsync: str = "batch", change_log_capacity: int = 10_000,
+                 tombstone_retention: float = 7 * 24 * 3600, sample_data: bool = True):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy {fsync!r}, expected one of {FSYNC_POLICIES}")
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.pool = ConnectionPool(path, pool_size, SYNCHRONOUS[fsync])
+        # One thread per pooled connection; more would only wait for one
+        self.executor_workers = pool_size
+        # SQLite allows one writer at a time; queue writers here rather than
+        # have them spin on the database lock
+        self._write_lock = threading.Lock()
+        # Shared with every process that opens the same file; "changes" counts
+        # commits to the change table
+        self.collection_versions = SharedCounters(path + "-versions", ("products", "users", "settings", "changes"))
+        # Seconds a deleted product's tombstone is kept for delta sync
+        self.tombstone_retention = tombstone_retention
+        # Set once the sample data is in, so seeding is not reported as changes
+        self.changes: Optional[ChangeLog] = None
+        # Changes made by the open write transaction, published when it commits
+        self._pending_changes: List[tuple] = []
+        # Held while mirroring the change table, so changes are appended in order
+        self._mirror_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._poller: Optional[threading.Thread] = None
+        with self._transaction() as conn:
+            is_new = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'products'").fetchone() is None
+            if is_new:
+                for statement in SCHEMA.split(";"):
+                    if statement.strip():
+                        conn.execute(statement)
+            else:
+                self._migrate(conn)
+            for statement in SYNC_SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+        if is_new and sample_data:
+            self._init_sample_data()
+        with self.pool.connection() as conn:
+            epoch = conn.execute(SELECT_CHANGE_EPOCH).fetchone()[0]
+        self.changes = ChangeLog(change_log_capacity, epoch=f"{epoch:08x}")
+        self._mirror_changes()
+        self._poller = threading.Thread(target=self._poll_changes, name="change-poller", daemon=True)
+        self._poller.start()
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        """Bring a database file created by an older version up to SCHEMA."""
+        for table in ("products", "users", "settings"):
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if "version" not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(products)")}
+        if "seq" not in columns:
+            conn.execute("ALTER TABLE products ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+            # Existing rows get sequence numbers in id order
+            conn.execute("UPDATE products SET seq = id")
+            conn.execute("CREATE INDEX products_seq ON products (seq)")
+
+    def _init_sample_data(self):
+        """Initialize the database with sample product data."""
+        self.create_products(sample_products())
+
+    @contextmanager
+    def _transaction(self, table: Optional[str] = None) -> Iterator[sqlite3.Connection]:
+        """Run the block as one write transaction, rolling back if it raises.
+
+        A commit bumps the change counter of `table`, after the data is
+        visible, so nothing built from the old data can carry the new count,
+        and then publishes the changes recorded with _changed.
+        """
+        with self._write_lock, self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            first_seq = None
+            try:
+                yield conn
+                if self.changes is not None and self._pending_changes:
+                    first_seq = self._log_changes(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                self._pending_changes.clear()
+                raise
+            if first_seq is None:
+                conn.execute("COMMIT")
+                if table is not None:
+                    self.collection_versions.increment(table)
+                self._pending_changes.clear()
+                return
+            # Committed under the mirror lock, so no poll can mirror these
+            # changes before they are appended here
+            with self._mirror_lock:
+                conn.execute("COMMIT")
+                if table is not None:
+                    self.collection_versions.increment(table)
+                # Other processes' changes before these are already committed,
+                # since the transaction held the database's write lock
+                self._read_changes(conn, first_seq)
+                for seq, change in enumerate(self._pending_changes, first_seq):
+                    self.changes.append(*change, seq=seq)
+            self._pending_changes.clear()
+            self.collection_versions.increment("changes")
+
+    def _log_changes(self, conn: sqlite3.Connection) -> int:
+        """Write the open transaction's changes to the change table; return the first one's sequence number.
+
+        Changes further back than the feed's capacity are dropped from it
+        each time another tenth of the capacity has been written, rather
+        than on every write.
+        """
+        first_seq = self._next_id(conn, "change_log")
+        last_seq = first_seq + len(self._pending_changes) - 1
+        conn.executemany(INSERT_CHANGE, [
+            (seq, table, op, row_id, None if row is None else to_json(row).decode())
+            for seq, (op, table, row_id, row) in enumerate(self._pending_changes, first_seq)
+        ])
+        trim_every = max(1, self.changes.capacity // 10)
+        if last_seq // trim_every != (first_seq - 1) // trim_every:
+            conn.execute(TRIM_CHANGES, (last_seq - self.changes.capacity,))
+        return first_seq
+
+    def _read_changes(self, conn: sqlite3.Connection, before: Optional[int] = None):
+        """Append the change table's rows after the feed's last change, and before `before`, to the feed.
+
+        The caller holds the mirror lock.
+        """
+        if before == self.changes.last_seq + 1:
+            return
+        for seq, table, op, row_id, row in conn.execute(SELECT_CHANGES, (self.changes.last_seq, before or 2**63 - 1)):
+            self.changes.append(op, table, row_id, None if row is None else json.loads(row), seq=seq)
+
+    def _mirror_changes(self):
+        """Bring the change feed up to date with the change table."""
+        with self.pool.connection() as conn, self._mirror_lock:
+            self._read_changes(conn)
+
+    def _poll_changes(self):
+        """Mirror the changes other processes commit until the database is closed."""
+        seen = self.collection_versions["changes"]
+        while not self._closed.wait(CHANGE_POLL_INTERVAL):
+            count = self.collection_versions["changes"]
+            if count != seen:
+                seen = count
+                self._mirror_changes()
+
+    def _changed(self, op: str, table: str, row_id: int, row: Optional[Any] = None):
+        """Record a change made by the open write transaction."""
+        self._pending_changes.append((op, table, row_id, row))
+
+    def collection_version(self, table: str) -> int:
+        """Change counter of a collection, bumped by every write to it from any process."""
+        return self.collection_versions[table]
+
+    def row_counts(self) -> Dict[str, int]:
+        """Number of rows in each collection."""
+        with self.pool.connection() as conn:
+            return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                    for table in ("products", "users", "settings")}
+
+    def close(self):
+        """Stop mirroring changes, then close every pooled connection and the shared counters."""
+        self._closed.set()
+        if self._poller is not None:
+            self._poller.join()
+        self.pool.close()
+        self.collection_versions.close()
+
+    @staticmethod
+    def _next_id(conn: sqlite3.Connection, table: str) -> int:
+        """Next id AUTOINCREMENT would assign, so batches get a contiguous block."""
+        row = conn.execute(NEXT_ID, (table,)).fetchone()
+        return 1 if row is None else row[0] + 1
+
+    @staticmethod
+    def _get_batch(conn: sqlite3.Connection, select: str, convert, ids: List[int]) -> list:
+        """Look up every id, raising NotFoundError if any is missing.
+
+        A repeated id maps to the same object, so changes made for each
+        occurrence build on one another.
+        """
+        found, missing = {}, []
+        for row_id in ids:
+            if row_id in found:
+                continue
+            row = conn.execute(select, (row_id,)).fetchone()
+            if row is None:
+                missing.append(row_id)
+            else:
+                found[row_id] = convert(row)
+        if missing:
+            raise NotFoundError(missing)
+        return [found[row_id] for row_id in ids]
+
+    @staticmethod
+    def _check_version(row_id: int, version: int, expected_versions: Optional[Container[int]]):
+        """Raise VersionConflictError unless the row has one of the expected versions."""
+        if expected_versions is not None and version not in expected_versions:
+            raise VersionConflictError(f"Row {row_id} is at version {version}")
+
+    @staticmethod
+    def _advance_product_seq(conn: sqlite3.Connection, count: int) -> int:
+        """Reserve the next `count` product modification sequence numbers and return the first."""
+        last = conn.execute(ADVANCE_PRODUCT_SEQ, (count,)).fetchone()[0]
+        return last - count + 1
+
+    def _insert_products(self, conn: sqlite3.Connection, products: List[Product]):
+        """Store new products with their tags and search text."""
+        first_seq = self._advance_product_seq(conn, len(products))
+        for i, p in enumerate(products):
+            p.seq = first_seq + i
+        conn.executemany(INSERT_PRODUCT, [
+            (p.id, p.name, p.description, p.price, p.category, json.dumps(p.tags), p.in_stock,
+             p.created_at.isoformat(), p.version, p.seq)
+            for p in products
+        ])
+        conn.executemany(INSERT_PRODUCT_TAG, [(tag, p.id) for p in products for tag in p.tags or []])
+        conn.executemany(INSERT_PRODUCT_TEXT, [(p.id, _product_text(p)) for p in products])
+        for p in products:
+            self._changed("insert", "products", p.id, p)
+
+    def _apply_product_update(self, conn: sqlite3.Connection, product: Product, update_dict: dict):
+        """Apply validated field changes to a stored product, its tags and search text."""
+        for field, value in update_dict.items():
+            setattr(product, field, value)
+        product.version += 1
+        product.seq = self._advance_product_seq(conn, 1)
+        conn.execute(UPDATE_PRODUCT, (
+            product.name, product.description, product.price, product.category,
+            json.dumps(product.tags), product.in_stock, product.version, product.seq, product.id,
+        ))
+        if "tags" in update_dict:
+            conn.execute(DELETE_PRODUCT_TAGS, (product.id,))
+            conn.executemany(INSERT_PRODUCT_TAG, [(tag, product.id) for tag in product.tags or []])
+        if {"name", "description", "tags"}.intersection(update_dict):
+            conn.execute(UPDATE_PRODUCT_TEXT, (_product_text(product), product.id))
+        self._changed("update", "products", product.id, product.model_copy())
+
+    def create_product(self, product_data: ProductCreate) -> Product:
+        """Create a new product in the database."""
+        return self.create_products([product_data])[0]
+
+    def create_products(self, products_data: List[ProductCreate]) -> List[Product]:
+        """Create a batch of products with a contiguous block of ids."""
+        created_at = datetime.now()
+        with self._transaction("products") as conn:
+            first_id = self._next_id(conn, "products")
+            products = [
+                Product.model_construct(id=first_id + i, **product_data.model_dump(), created_at=created_at)
+                for i, product_data in enumerate(products_data)
+            ]
+            self._insert_products(conn, products)
+        return products
+
+    def get_all_products(self) -> List[Product]:
+        """Get all products from the database."""
+        with self.pool.connection() as conn:
+            return [_product_from_row(row) for row in conn.execute(SELECT_ALL_PRODUCTS)]
+
+    def get_products_page(self, after_id: Optional[int] = None, limit: Optional[int] = None) -> Tuple[List[Product], Optional[int]]:
+        """Get products with id greater than after_id, plus the cursor for the next page."""
+        with self.pool.connection() as conn:
+            rows = conn.execute(SELECT_PRODUCTS_PAGE, (after_id or 0, _page_limit(limit))).fetchall()
+        return _split_page([_product_from_row(row) for row in rows], limit)
+
+    def find_products(
+        self,
+        category: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        in_stock: Optional[bool] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        sort: str = "id",
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> Tuple[List[Product], Optional[int]]:
+        """Get products matching every given filter, plus the cursor for the next page.
+
+        Results are ordered by id, or by price when sort is "price" (cheapest
+        first) or "-price" (most expensive first).
+        """
+        clauses: List[str] = []
+        params: list = []
+        if category is not None:
+            clauses.append("category = ?")
+            params.append(category)
+        for tag in tags or []:
+            clauses.append("id IN (SELECT product_id FROM product_tags WHERE tag = ?)")
+            params.append(tag)
+        if in_stock is not None:
+            clauses.append("in_stock = ?")
+            params.append(in_stock)
+        if min_price is not None:
+            clauses.append("price >= ?")
+            params.append(min_price)
+        if max_price is not None:
+            clauses.append("price <= ?")
+            params.append(max_price)
+
+        with self.pool.connection() as conn:
+            if sort in ("price", "-price"):
+                descending = sort == "-price"
+                order = "price DESC, id DESC" if descending else "price, id"
+                if after_id is not None:
+                    row = conn.execute("SELECT price FROM products WHERE id = ?", (after_id,)).fetchone()
+                    if row is None:
+                        raise InvalidCursorError(f"Product {after_id} no longer exists")
+                    clauses.append("(price, id) < (?, ?)" if descending else "(price, id) > (?, ?)")
+                    params.extend([row[0], after_id])
+            else:
+                order = "id"
+                if after_id is not None:
+                    clauses.append("id > ?")
+                    params.append(after_id)
+            where = " AND ".join(clauses) or "1"
+            sql = f"SELECT {PRODUCT_COLUMNS} FROM products WHERE {where} ORDER BY {order} LIMIT ?"
+            rows = conn.execute(sql, (*params, _page_limit(limit))).fetchall()
+        return _split_page([_product_from_row(row) for row in rows], limit)
+
+    def search_products(self, query: str, limit: int = 10) -> List[Product]:
+        """Full-text search over product name, description and tags, best match first.
+
+        Uses SQLite's FTS5 BM25 ranking; the last query word matches as a prefix.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        # Tokens are word characters only, so quoting them is always safe
+        match = " OR ".join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+        with self.pool.connection() as conn:
+            return [_product_from_row(row) for row in conn.execute(SEARCH_PRODUCTS, (match, limit))]
+
+    def product_stats(self, group_by: Optional[str] = None) -> List[PriceStats]:
+        """Count, sum, min, max and average price of all products, or of each group."""
+        with self.pool.connection() as conn:
+            rows = conn.execute(PRODUCT_STATS[group_by]).fetchall()
+        return [
+            PriceStats.model_construct(group=bool(group) if group_by == "in_stock" else group,
+                                       count=count, sum=total, min=low, max=high, avg=total / count)
+            for group, count, total, low, high in rows
+        ]
+
+    def product_view(self, name: str) -> Optional[List[GroupTotals]]:
+        """Compute the rows of a view by query; SQLite does not materialize them."""
+        sql = PRODUCT_VIEWS.get(name)
+        if sql is None:
+            return None
+        with self.pool.connection() as conn:
+            rows = conn.execute(sql).fetchall()
+        return [
+            GroupTotals.model_construct(group=bool(group) if name == "stock_totals" else group, count=count, sum=total)
+            for group, count, total in rows
+        ]
+
+    def product_changes(self, since: int, limit: Optional[int] = None) -> ProductChanges:
+        """Products created, updated or deleted after modification sequence number `since`.
+
+        Both tables are read through their index on seq, in one read
+        transaction so the counters match the rows.
+        """
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN")
+            try:
+                counters = dict(conn.execute(SELECT_SYNC_COUNTERS).fetchall())
+                if since > counters["product_seq"] or 0 < since < counters["tombstone_horizon"]:
+                    raise SequenceExpiredError(since)
+                rows = conn.execute(SELECT_PRODUCT_CHANGES, (since, since, _page_limit(limit))).fetchall()
+            finally:
+                conn.execute("COMMIT")
+        more = limit is not None and len(rows) > limit
+        if more:
+            rows = rows[:limit]
+        products, deleted = [], []
+        for row in rows:
+            if row[10] is None:
+                products.append(_product_from_row(row))
+            else:
+                deleted.append(ProductTombstone.model_construct(
+                    id=row[0], seq=row[9], deleted_at=datetime.fromisoformat(row[10]),
+                ))
+        seq = rows[-1][9] if more else counters["product_seq"]
+        return ProductChanges.model_construct(seq=seq, products=products, deleted=deleted, more=more)
+
+    def get_product(self, product_id: int) -> Optional[Product]:
+        """Get a specific product by ID."""
+        with self.pool.connection() as conn:
+            row = conn.execute(SELECT_PRODUCT, (product_id,)).fetchone()
+        return None if row is None else _product_from_row(row)
+
+    def update_product(self, product_id: int, update_data: ProductUpdate,
+                      expected_versions: Optional[Container[int]] = None) -> Optional[Product]:
+        """Update an existing product in the database."""
+        with self._transaction("products") as conn:
+            row = conn.execute(SELECT_PRODUCT, (product_id,)).fetchone()
+            if row is None:
+                return None
+            product = _product_from_row(row)
+            self._check_version(product_id, product.version, expected_versions)
+            # No product field is nullable, so an explicit null leaves the field as it is
+            self._apply_product_update(conn, product, update_data.model_dump(exclude_unset=True, exclude_none=True))
+        return product
+
+    def update_products(self, updates: List[ProductBatchUpdate]) -> List[Product]:
+        """Update a batch of products, applying nothing if any id is missing."""
+        with self._transaction("products") as conn:
+            products = self._get_batch(conn, SELECT_PRODUCT, _product_from_row, [update.id for update in updates])
+            for product, update in zip(products, updates):
+                update_dict = update.model_dump(exclude_unset=True, exclude_none=True, exclude={"id"})
+                self._apply_product_update(conn, product, update_dict)
+        return products
+
+    def delete_product(self, product_id: int, expected_versions: Optional[Container[int]] = None) -> bool:
+        """Delete a product from the database."""
+        with self._transaction("products") as conn:
+            row = conn.execute(SELECT_PRODUCT_VERSION, (product_id,)).fetchone()
+            if row is None:
+                return False
+            self._check_version(product_id, row[0], expected_versions)
+            conn.execute(DELETE_PRODUCT, (product_id,))
+            conn.execute(DELETE_PRODUCT_TEXT, (product_id,))
+            self._add_tombstones(conn, [product_id])
+            self._changed("delete", "products", product_id)
+        return True
+
+    def delete_products(self, product_ids: List[int]):
+        """Delete a batch of products, deleting nothing if any id is missing."""
+        ids = list(dict.fromkeys(product_ids))
+        with self._transaction("products") as conn:
+            self._get_batch(conn, "SELECT id FROM products WHERE id = ?", tuple, ids)
+            conn.executemany(DELETE_PRODUCT, [(product_id,) for product_id in ids])
+            conn.executemany(DELETE_PRODUCT_TEXT, [(product_id,) for product_id in ids])
+            self._add_tombstones(conn, ids)
+            for product_id in ids:
+                self._changed("delete", "products", product_id)
+
+    def _add_tombstones(self, conn: sqlite3.Connection, product_ids: List[int]):
+        """Leave tombstones for deleted products, purging those past the retention window."""
+        deleted_at = datetime.now()
+        cutoff = (deleted_at - timedelta(seconds=self.tombstone_retention)).isoformat()
+        purged = [row[0] for row in conn.execute(PURGE_PRODUCT_TOMBSTONES, (cutoff,))]
+        if purged:
+            conn.execute(RAISE_TOMBSTONE_HORIZON, (max(purged),))
+        first_seq = self._advance_product_seq(conn, len(product_ids))
+        conn.executemany(INSERT_PRODUCT_TOMBSTONE, [
+            (product_id, first_seq + i, deleted_at.isoformat()) for i, product_id in enumerate(product_ids)
+        ])
+
+    @staticmethod
+    def _check_emails(conn: sqlite3.Connection, emails: Dict[int, str]):
+        """Raise DuplicateKeyError unless the final emails of these users are unique.
+
+        `emails` maps user ids (or placeholders for new users) to the email
+        each will have; users outside the mapping keep their current email.
+        """
+        seen = set()
+        for email in emails.values():
+            owner = conn.execute("SELECT id FROM users WHERE email = ?", (email,)).fetchone()
+            if email in seen or (owner is not None and owner[0] not in emails):
+                raise DuplicateKeyError(f"Email {email!r} is already registered")
+            seen.add(email)
+
+    def create_user(self, user_data: UserCreate) -> User:
+        """Create a new user in the database."""
+        return self.create_users([user_data])[0]
+
+    def create_users(self, users_data: List[UserCreate]) -> List[User]:
+        """Create a batch of users, creating none if any email is taken."""
+        created_at = datetime.now()
+        with self._transaction("users") as conn:
+            first_id = self._next_id(conn, "users")
+            self._check_emails(conn, {first_id + i: user_data.email for i, user_data in enumerate(users_data)})
+            users = [
+                User.model_construct(id=first_id + i, **user_data.model_dump(), created_at=created_at)
+                for i, user_data in enumerate(users_data)
+            ]
+            conn.executemany(INSERT_USER, [
+                (u.id, u.name, u.email, u.password, u.created_at.isoformat(), u.version) for u in users
+            ])
+            for u in users:
+                self._changed("insert", "users", u.id, u)
+        return users
+
+    def get_all_users(self) -> List[User]:
+        """Get all users from the database."""
+        with self.pool.connection() as conn:
+            return [_user_from_row(row) for row in conn.execute(SELECT_ALL_USERS)]
+
+    def get_users_page(self, after_id: Optional[int] = None, limit: Optional[int] = None) -> Tuple[List[User], Optional[int]]:
+        """Get users with id greater than after_id, plus the cursor for the next page."""
+        with self.pool.connection() as conn:
+            rows = conn.execute(SELECT_USERS_PAGE, (after_id or 0, _page_limit(limit))).fetchall()
+        return _split_page([_user_from_row(row) for row in rows], limit)
+
+    def get_user(self, user_id: int) -> Optional[User]:
+        """Get a specific user by ID."""
+        with self.pool.connection() as conn:
+            row = conn.execute(SELECT_USER, (user_id,)).fetchone()
+        return None if row is None else _user_from_row(row)
+
+    def get_user_by_email(self, email: str) -> Optional[User]:
+        """Get a specific user by email."""
+        with self.pool.connection() as conn:
+            row = conn.execute(SELECT_USER_BY_EMAIL, (email,)).fetchone()
+        return None if row is None else _user_from_row(row)
+
+    def update_user(self, user_id: int, update_data: UserUpdate,
+                   expected_versions: Optional[Container[int]] = None) -> Optional[User]:
+        """Update an existing user in the database."""
+        with self._transaction("users") as conn:
+            row = conn.execute(SELECT_USER, (user_id,)).fetchone()
+            if row is None:
+                return None
+            user = _user_from_row(row)
+            self._check_version(user_id, user.version, expected_versions)
+            update_dict = update_data.model_dump(exclude_unset=True, exclude_none=True)
+            self._check_emails(conn, {user.id: update_dict.get("email", user.email)})
+            for field, value in update_dict.items():
+                setattr(user, field, value)
+            user.version += 1
+            conn.execute(UPDATE_USER, (user.name, user.email, user.password, user.version, user.id))
+            self._changed("update", "users", user.id, user)
+        return user
+
+    def update_users(self, updates: List[UserBatchUpdate]) -> List[User]:
+        """Update a batch of users, applying nothing if any id is missing or an email clashes."""
+        with self._transaction("users") as conn:
+            users = self._get_batch(conn, SELECT_USER, _user_from_row, [update.id for update in updates])
+            update_dicts = [update.model_dump(exclude_unset=True, exclude_none=True, exclude={"id"}) for update in updates]
+            emails = {user.id: user.email for user in users}
+            for user, update_dict in zip(users, update_dicts):
+                emails[user.id] = update_dict.get("email", emails[user.id])
+            self._check_emails(conn, emails)
+
+            for user, update_dict in zip(users, update_dicts):
+                for field, value in update_dict.items():
+                    setattr(user, field, value)
+                user.version += 1
+                self._changed("update", "users", user.id, user.model_copy())
+            # Release every old email first so users can swap emails in one batch
+            conn.executemany(RELEASE_USER_EMAIL, [(user.id,) for user in users])
+            conn.executemany(UPDATE_USER, [
+                (user.name, user.email, user.password, user.version, user.id) for user in users
+            ])
+        return users
+
+    def delete_user(self, user_id: int, expected_versions: Optional[Container[int]] = None) -> bool:
+        """Delete a user from the database."""
+        with self._transaction("users") as conn:
+            row = conn.execute(SELECT_USER_VERSION, (user_id,)).fetchone()
+            if row is None:
+                return False
+            self._check_version(user_id, row[0], expected_versions)
+            conn.execute(DELETE_USER, (user_id,))
+            self._changed("delete", "users", user_id)
+        return True
+
+    def delete_users(self, user_ids: List[int]):
+        """Delete a batch of users, deleting nothing if any id is missing."""
+        ids = list(dict.fromkeys(user_ids))
+        with self._transaction("users") as conn:
+            self._get_batch(conn, "SELECT id FROM users WHERE id = ?", tuple, ids)
+            conn.executemany(DELETE_USER, [(user_id,) for user_id in ids])
+            for user_id in ids:
+                self._changed("delete", "users", user_id)
+
+    def create_setting(self, setting_data: SettingCreate) -> Setting:
+        """Create a new setting in the database."""
+        return self.create_settings([setting_data])[0]
+
+    def create_settings(self, settings_data: List[SettingCreate]) -> List[Setting]:
+        """Create a batch of settings, creating none if any key already exists."""
+        created_at = datetime.now()
+        with self._transaction("settings") as conn:
+            keys = set()
+            for setting_data in settings_data:
+                taken = conn.execute("SELECT 1 FROM settings WHERE key = ?", (setting_data.key,)).fetchone()
+                if setting_data.key in keys or taken is not None:
+                    raise DuplicateKeyError(f"Setting key {setting_data.key!r} already exists")
+                keys.add(setting_data.key)
+            first_id = self._next_id(conn, "settings")
+            settings = [
+                Setting.model_construct(id=first_id + i, **setting_data.model_dump(), created_at=created_at)
+                for i, setting_data in enumerate(settings_data)
+            ]
+            conn.executemany(INSERT_SETTING, [
+                (s.id, s.key, s.value, s.description, s.created_at.isoformat(), s.version) for s in settings
+            ])
+            for s in settings:
+                self._changed("insert", "settings", s.id, s)
+        return settings
+
+    def get_all_settings(self) -> List[Setting]:
+        """Get all settings from the database."""
+        with self.pool.connection() as conn:
+            return [_setting_from_row(row) for row in conn.execute(SELECT_ALL_SETTINGS)]
+
+    def get_settings_page(self, after_id: Optional[int] = None, limit: Optional[int] = None) -> Tuple[List[Setting], Optional[int]]:
+        """Get settings with id greater than after_id, plus the cursor for the next page."""
+        with self.pool.connection() as conn:
+            rows = conn.execute(SELECT_SETTINGS_PAGE, (after_id or 0, _page_limit(limit))).fetchall()
+        return _split_page([_setting_from_row(row) for row in rows], limit)
+
+    def get_setting(self, setting_id: int) -> Optional[Setting]:
+        """Get a specific setting by ID."""
+        with self.pool.connection() as conn:
+            row = conn.execute(SELECT_SETTING, (setting_id,)).fetchone()
+        return None if row is None else _setting_from_row(row)
+
+    def get_setting_by_key(self, key: str) -> Optional[Setting]:
+        """Get a specific setting by key."""
+        with self.pool.connection() as conn:
+            row = conn.execute(SELECT_SETTING_BY_KEY, (key,)).fetchone()
+        return None if row is None else _setting_from_row(row)
+
+    def _apply_setting_update(self, conn: sqlite3.Connection, setting: Setting, update_dict: dict):
+        """Apply validated field changes to a stored setting."""
+        for field, value in update_dict.items():
+            setattr(setting, field, value)
+        setting.version += 1
+        conn.execute(UPDATE_SETTING, (setting.value, setting.description, setting.version, setting.id))
+        self._changed("update", "settings", setting.id, setting.model_copy())
+
+    def update_setting(self, setting_id: int, update_data: SettingUpdate,
+                      expected_versions: Optional[Container[int]] = None) -> Optional[Setting]:
+        """Update an existing setting in the database."""
+        with self._transaction("settings") as conn:
+            row = conn.execute(SELECT_SETTING, (setting_id,)).fetchone()
+            if row is None:
+                return None
+            setting = _setting_from_row(row)
+            self._check_version(setting_id, setting.version, expected_versions)
+            self._apply_setting_update(conn, setting, setting_changes(update_data))
+        return setting
+
+    def update_settings(self, updates: List[SettingBatchUpdate]) -> List[Setting]:
+        """Update a batch of settings, applying nothing if any id is missing."""
+        with self._transaction("settings") as conn:
+            settings = self._get_batch(conn, SELECT_SETTING, _setting_from_row, [update.id for update in updates])
+            for setting, update in zip(settings, updates):
+                self._apply_setting_update(conn, setting, setting_changes(update))
+        return settings
+
+    def delete_setting(self, setting_id: int, expected_versions: Optional[Container[int]] = None) -> bool:
+        """Delete a setting from the database."""
+        with self._transaction("settings") as conn:
+            row = conn.execute(SELECT_SETTING_VERSION, (setting_id,)).fetchone()
+            if row is None:
+                return False
+            self._check_version(setting_id, row[0], expected_versions)
+            conn.execute(DELETE_SETTING, (setting_id,))
+            self._changed("delete", "settings", setting_id)
+        return True
+
+    def delete_settings(self, setting_ids: List[int]):
+        """Delete a batch of settings, deleting nothing if any id is missing."""
+        ids = list(dict.fromkeys(setting_ids))
+        with self._transaction("settings") as conn:
+            self._get_batch(conn, "SELECT id FROM settings WHERE id = ?", tuple, ids)
+            conn.executemany(DELETE_SETTING, [(setting_id,) for setting_id in ids])
+            for setting_id in ids:
+                self._changed("delete", "settings", setting_id)
@@ -0,0 +1,190 @@
+"""Storage backend interface shared by every database engine."""
+from typing import TYPE_CHECKING, Any, Container, Dict, List, Optional, Protocol, Tuple
+
+from models import (
+    GroupTotals, PriceStats, Product, ProductChanges, ProductCreate, ProductUpdate, ProductBatchUpdate,
+    User, UserCreate, UserUpdate, UserBatchUpdate,
+    Setting, SettingCreate, SettingUpdate, SettingBatchUpdate,
+)
+
+if TYPE_CHECKING:
+    from changes import ChangeLog
+
+# Names accepted by the DB_BACKEND setting
+BACKENDS = ("memory", "sqlite")
+
+
+def sample_products() -> List[ProductCreate]:
+    """Products a new, empty database starts with."""
+    return [
+        ProductCreate(
+            name="Wireless Headphones",
+            description="High-quality wireless headphones with noise cancellation",
+            price=199.99,
+            category="Electronics",
+            tags=["audio", "wireless", "premium"]
+        ),
+        ProductCreate(
+            name="Coffee Maker",
+            description="Programmable coffee maker with built-in grinder",
+            price=89.99,
+            category="Appliances",
+            tags=["kitchen", "coffee", "automatic"]
+        ),
+        ProductCreate(
+            name="Laptop Stand",
+            description="Adjustable aluminum laptop stand for ergonomic work",
+            price=45.99,
+            category="Accessories",
+            tags=["ergonomic", "aluminum", "adjustable"]
+        )
+    ]
+
+
+def setting_changes(update: SettingUpdate) -> Dict[str, Any]:
+    """Fields a setting update changes, without its id.
+
+    A null description clears it, but a setting always has a value, so an
+    explicit null value leaves it as it is, as nulls do for product and user
+    fields.
+    """
+    changes = update.model_dump(exclude_unset=True, exclude={"id"})
+    if changes.get("value", "") is None:
+        del changes["value"]
+    return changes
+
+
+class DuplicateKeyError(ValueError):
+    """Raised when a write would break a unique index."""
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be resolved."""
+
+
+class VersionConflictError(ValueError):
+    """Raised when a conditional write expects a version the row no longer has."""
+
+
+class SequenceExpiredError(ValueError):
+    """Raised when changes after a sequence number are no longer retained."""
+
+    def __init__(self, seq: int):
+        super().__init__(f"Changes after sequence {seq} are not available")
+        self.seq = seq
+
+
+class NotFoundError(LookupError):
+    """Raised when a batch operation names ids that do not exist."""
+
+    def __init__(self, ids: List[int]):
+        super().__init__(f"Ids not found: {ids}")
+        self.ids = ids
+
+
+class StorageBackend(Protocol):
+    """Operations the API needs from a database engine.
+
+    Batch operations are all-or-nothing: they raise NotFoundError or
+    DuplicateKeyError without changing anything. Batch updates apply
+    repeated ids in order and return one row per entry, each as the whole
+    batch left it, so a repeated id is returned once per occurrence at its
+    final version. Every update increments
+    the row's version; single-row updates and deletes given
+    `expected_versions` raise VersionConflictError unless the row's
+    current version is one of them.
+    """
+
+    # Threads async callers should run calls in, or None if calls never
+    # block and can run on the event loop; may drop to None once calls
+    # stop blocking, but is never set later on
+    executor_workers: Optional[int]
+    # Committed creates, updates and deletes of every collection, in order
+    changes: "ChangeLog"
+
+    def create_product(self, product_data: ProductCreate) -> Product: ...
+
+    def create_products(self, products_data: List[ProductCreate]) -> List[Product]: ...
+
+    def get_all_products(self) -> List[Product]: ...
+
+    def get_products_page(self, after_id: Optional[int] = None, limit: Optional[int] = None) -> Tuple[List[Product], Optional[int]]: ...
+
+    def find_products(
+        self,
+        category: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        in_stock: Optional[bool] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        sort: str = "id",
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> Tuple[List[Product], Optional[int]]: ...
+
+    def search_products(self, query: str, limit: int = 10) -> List[Product]: ...
+
+    def product_stats(self, group_by: Optional[str] = None) -> List[PriceStats]: ...
+
+    def product_view(self, name: str) -> Optional[List[GroupTotals]]: ...
+
+    def product_changes(self, since: int, limit: Optional[int] = None) -> ProductChanges: ...
+
+    def get_product(self, product_id: int) -> Optional[Product]: ...
+
+    def update_product(self, product_id: int, update_data: ProductUpdate,
+                       expected_versions: Optional[Container[int]] = None) -> Optional[Product]: ...
+
+    def update_products(self, updates: List[ProductBatchUpdate]) -> List[Product]: ...
+
+    def delete_product(self, product_id: int, expected_versions: Optional[Container[int]] = None) -> bool: ...
+
+    def delete_products(self, product_ids: List[int]): ...
+
+    def create_user(self, user_data: UserCreate) -> User: ...
+
+    def create_users(self, users_data: List[UserCreate]) -> List[User]: ...
+
+    def get_all_users(self) -> List[User]: ...
+
+    def get_users_page(self, after_id: Optional[int] = None, limit: Optional[int] = None) -> Tuple[List[User], Optional[int]]: ...
+
+    def get_user(self, user_id: int) -> Optional[User]: ...
+
+    def get_user_by_email(self, email: str) -> Optional[User]: ...
+
+    def update_user(self, user_id: int, update_data: UserUpdate,
+                    expected_versions: Optional[Container[int]] = None) -> Optional[User]: ...
+
+    def update_users(self, updates: List[UserBatchUpdate]) -> List[User]: ...
+
+    def delete_user(self, user_id: int, expected_versions: Optional[Container[int]] = None) -> bool: ...
+
+    def delete_users(self, user_ids: List[int]): ...
+
+    def create_setting(self, setting_data: SettingCreate) -> Setting: ...
+
+    def create_settings(self, settings_data: List[SettingCreate]) -> List[Setting]: ...
+
+    def get_all_settings(self) -> List[Setting]: ...
+
+    def get_settings_page(self, after_id: Optional[int] = None, limit: Optional[int] = None) -> Tuple[List[Setting], Optional[int]]: ...
+
+    def get_setting(self, setting_id: int) -> Optional[Setting]: ...
+
+    def get_setting_by_key(self, key: str) -> Optional[Setting]: ...
+
+    def update_setting(self, setting_id: int, update_data: SettingUpdate,
+                       expected_versions: Optional[Container[int]] = None) -> Optional[Setting]: ...
+
+    def update_settings(self, updates: List[SettingBatchUpdate]) -> List[Setting]: ...
+
+    def delete_setting(self, setting_id: int, expected_versions: Optional[Container[int]] = None) -> bool: ...
+
+    def delete_settings(self, setting_ids: List[int]): ...
+
+    def collection_version(self, table: str) -> int: ...
+
+    def row_counts(self) -> Dict[str, int]: ...
+
+    def close(self): ...
@@ -3,24 +3,33 @@ import pytest
 from fastapi.testclient import TestClient
 
 from database import InMemoryDatabase
-from main import app
+from sqlite_backend import SQLiteDatabase
 
 
-@pytest.fixture
-def db():
-    """Provide a fresh database instance for each test."""
-    return InMemoryDatabase()
+@pytest.fixture(params=["memory", "columnar", "mapped", "sqlite"])
+def db(request, tmp_path):
+    """Provide a fresh database instance of each storage backend for each test."""
+    if request.param == "sqlite":
+        database = SQLiteDatabase(str(tmp_path / "test.sqlite3"), pool_size=2)
+    elif request.param == "columnar":
+        database = InMemoryDatabase(product_store="columnar")
+    elif request.param == "mapped":
+        # The sample data, served from a mapped snapshot
+        path = str(tmp_path / "snapshot.map")
+        InMemoryDatabase().write_mapped_snapshot(path)
+        database = InMemoryDatabase(mapped_snapshot=path)
+    else:
+        database = InMemoryDatabase()
+    yield database
+    database.close()
 
 
 @pytest.fixture
-def client(db, monkeypatch):
-    """Provide a TestClient with a fresh database instance."""
-    import database
-    monkeypatch.setattr(database, "db", db)
-    
-    # Re-import main to use the patched database
-    import importlib
+def client(db):
+    """Provide a TestClient for an app serving a fresh database instance."""
     import main
-    importlib.reload(main)
-    
-    return TestClient(main.app)
+
+    # Entering the client runs startup and shutdown, which closes the
+    # database's executor
+    with TestClient(main.create_app(db)) as client:
+        yield client
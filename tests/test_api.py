@@ -1,6 +1,10 @@
 """Unit tests for FastAPI endpoints."""
+import asyncio
+from datetime import datetime, timezone
+import json
+
 import pytest
-from models import ProductCreate, UserCreate
+from models import Product, ProductChanges, ProductCreate, UserCreate
 
 
 class TestHealthAndRoot:
@@ -145,6 +149,338 @@ class TestProductEndpoints:
         new_count = len(response.json())
         assert new_count == initial_count - 1
 
+    def test_get_all_products_keeps_insertion_order(self, client):
+        """Test GET /products lists products in creation order after a delete."""
+        client.delete("/products/2")
+        created = client.post("/products", json={
+            "name": "Late Product",
+            "description": "Created after a delete",
+            "price": 5.0,
+            "category": "Test"
+        }).json()
+
+        response = client.get("/products")
+        ids = [product["id"] for product in response.json()]
+        assert ids == [1, 3, created["id"]]
+
+
+class TestPagination:
+    """Tests for keyset pagination on list endpoints."""
+
+    def test_first_page_returns_next_cursor(self, client):
+        """Test GET /products?limit= returns one page and a cursor."""
+        response = client.get("/products?limit=2")
+        assert response.status_code == 200
+        assert [p["id"] for p in response.json()] == [1, 2]
+        assert response.headers["X-Next-Cursor"] == "2"
+
+    def test_follow_cursor_to_last_page(self, client):
+        """Test following the cursor returns the remaining rows and no cursor."""
+        response = client.get("/products?limit=2&after_id=2")
+        assert response.status_code == 200
+        assert [p["id"] for p in response.json()] == [3]
+        assert "X-Next-Cursor" not in response.headers
+
+    def test_exact_last_page_has_no_cursor(self, client):
+        """Test a page that ends on the last row does not advertise a cursor."""
+        response = client.get("/products?limit=3")
+        assert len(response.json()) == 3
+        assert "X-Next-Cursor" not in response.headers
+
+    def test_pagination_skips_deleted_rows(self, client):
+        """Test deleted rows are skipped when paging."""
+        client.delete("/products/2")
+        response = client.get("/products?limit=1&after_id=1")
+        assert [p["id"] for p in response.json()] == [3]
+
+    def test_after_deleted_cursor(self, client):
+        """Test a cursor naming a deleted row still resumes after it."""
+        client.delete("/products/1")
+        response = client.get("/products?limit=5&after_id=1")
+        assert [p["id"] for p in response.json()] == [2, 3]
+
+    def test_invalid_limit(self, client):
+        """Test GET /products rejects a non-positive limit."""
+        response = client.get("/products?limit=0")
+        assert response.status_code == 422
+
+    def test_paginate_users(self, client):
+        """Test GET /users supports keyset pagination."""
+        for i in range(3):
+            client.post("/users", json={"name": f"User {i}", "email": f"user{i}@example.com", "password": "pass"})
+        response = client.get("/users?limit=2")
+        first_page = response.json()
+        assert len(first_page) == 2
+        cursor = response.headers["X-Next-Cursor"]
+
+        response = client.get(f"/users?limit=2&after_id={cursor}")
+        assert len(response.json()) == 1
+        assert response.json()[0]["id"] > first_page[-1]["id"]
+
+    def test_paginate_settings(self, client):
+        """Test GET /settings supports keyset pagination."""
+        for i in range(3):
+            client.post("/settings", json={"key": f"key_{i}", "value": str(i)})
+        response = client.get("/settings?limit=2")
+        assert len(response.json()) == 2
+        assert "X-Next-Cursor" in response.headers
+
+
+class TestProductFilters:
+    """Tests for filtering GET /products by the secondary indexes."""
+
+    def test_filter_by_category(self, client):
+        """Test GET /products?category= returns only that category."""
+        response = client.get("/products?category=Electronics")
+        assert response.status_code == 200
+        assert [p["id"] for p in response.json()] == [1]
+
+    def test_filter_by_tag(self, client):
+        """Test GET /products?tag= returns products carrying the tag."""
+        response = client.get("/products?tag=coffee")
+        assert [p["name"] for p in response.json()] == ["Coffee Maker"]
+
+    def test_filter_by_multiple_tags(self, client):
+        """Test repeated tag parameters must all match."""
+        client.post("/products", json={
+            "name": "Wireless Speaker",
+            "description": "Portable speaker",
+            "price": 59.99,
+            "category": "Electronics",
+            "tags": ["audio", "wireless"]
+        })
+        response = client.get("/products?tag=audio&tag=wireless")
+        assert len(response.json()) == 2
+        response = client.get("/products?tag=audio&tag=premium")
+        assert [p["id"] for p in response.json()] == [1]
+
+    def test_filter_by_in_stock(self, client):
+        """Test GET /products?in_stock= filters on stock status."""
+        client.put("/products/2", json={"in_stock": False})
+        response = client.get("/products?in_stock=false")
+        assert [p["id"] for p in response.json()] == [2]
+        response = client.get("/products?in_stock=true")
+        assert [p["id"] for p in response.json()] == [1, 3]
+
+    def test_combined_filters(self, client):
+        """Test category, tag and stock filters are intersected."""
+        response = client.get("/products?category=Electronics&tag=audio&in_stock=true")
+        assert [p["id"] for p in response.json()] == [1]
+        response = client.get("/products?category=Appliances&tag=audio")
+        assert response.json() == []
+
+    def test_filter_unknown_category(self, client):
+        """Test an unknown category returns an empty list."""
+        response = client.get("/products?category=Nope")
+        assert response.status_code == 200
+        assert response.json() == []
+
+    def test_filters_follow_updates(self, client):
+        """Test the indexes track category and tag changes made with PUT."""
+        client.put("/products/3", json={"category": "Electronics", "tags": ["desk"]})
+        response = client.get("/products?category=Electronics")
+        assert [p["id"] for p in response.json()] == [1, 3]
+        assert client.get("/products?category=Accessories").json() == []
+        assert client.get("/products?tag=ergonomic").json() == []
+        assert [p["id"] for p in client.get("/products?tag=desk").json()] == [3]
+
+    def test_filters_follow_deletes(self, client):
+        """Test deleted products disappear from filtered results."""
+        client.delete("/products/1")
+        assert client.get("/products?category=Electronics").json() == []
+        assert client.get("/products?tag=audio").json() == []
+
+    def test_filtered_pagination(self, client):
+        """Test filtered results can be paged with limit and after_id."""
+        for i in range(3):
+            client.post("/products", json={
+                "name": f"Gadget {i}",
+                "description": "Gadget",
+                "price": 10.0 + i,
+                "category": "Electronics"
+            })
+        response = client.get("/products?category=Electronics&limit=2")
+        first_page = [p["id"] for p in response.json()]
+        assert first_page == [1, 4]
+        cursor = response.headers["X-Next-Cursor"]
+
+        response = client.get(f"/products?category=Electronics&limit=2&after_id={cursor}")
+        assert [p["id"] for p in response.json()] == [5, 6]
+        assert "X-Next-Cursor" not in response.headers
+
+
+class TestProductPriceQueries:
+    """Tests for price range queries and price sorting on GET /products."""
+
+    def test_price_range(self, client):
+        """Test min_price and max_price bound the results, ordered by id."""
+        response = client.get("/products?min_price=40&max_price=100")
+        assert response.status_code == 200
+        assert [p["id"] for p in response.json()] == [2, 3]
+
+    def test_price_range_is_inclusive(self, client):
+        """Test the price bounds include products priced exactly at them."""
+        response = client.get("/products?min_price=89.99&max_price=199.99")
+        assert [p["id"] for p in response.json()] == [1, 2]
+
+    def test_sort_by_price(self, client):
+        """Test sort=price returns the cheapest products first."""
+        response = client.get("/products?sort=price")
+        assert [p["price"] for p in response.json()] == [45.99, 89.99, 199.99]
+
+    def test_top_n_most_expensive(self, client):
+        """Test sort=-price with limit returns the N most expensive products."""
+        response = client.get("/products?sort=-price&limit=2")
+        assert [p["id"] for p in response.json()] == [1, 2]
+        assert response.headers["X-Next-Cursor"] == "2"
+
+    def test_sort_by_price_pagination(self, client):
+        """Test after_id resumes a price-sorted listing after that product."""
+        response = client.get("/products?sort=price&limit=1")
+        cursor = response.headers["X-Next-Cursor"]
+        response = client.get(f"/products?sort=price&limit=5&after_id={cursor}")
+        assert [p["price"] for p in response.json()] == [89.99, 199.99]
+
+    def test_sort_by_price_equal_prices(self, client):
+        """Test products with equal prices are paged by id without repeats."""
+        for i in range(3):
+            client.post("/products", json={"name": f"Same {i}", "description": "Same", "price": 45.99, "category": "Test"})
+        seen = []
+        after = ""
+        while True:
+            response = client.get(f"/products?sort=price&max_price=50&limit=2{after}")
+            seen.extend(p["id"] for p in response.json())
+            if "X-Next-Cursor" not in response.headers:
+                break
+            after = f"&after_id={response.headers['X-Next-Cursor']}"
+        assert seen == [3, 4, 5, 6]
+
+    def test_price_with_category_filter(self, client):
+        """Test price range and category filters combine."""
+        response = client.get("/products?category=Appliances&max_price=100&sort=price")
+        assert [p["id"] for p in response.json()] == [2]
+        response = client.get("/products?category=Electronics&max_price=100")
+        assert response.json() == []
+
+    def test_price_index_follows_updates(self, client):
+        """Test price changes made with PUT move the product in the index."""
+        client.put("/products/1", json={"price": 10.0})
+        response = client.get("/products?sort=price&limit=1")
+        assert response.json()[0]["id"] == 1
+        assert client.get("/products?min_price=150").json() == []
+
+    def test_null_price_update_leaves_price(self, client):
+        """Test an explicit null price is ignored rather than breaking the price index."""
+        response = client.put("/products/1", json={"price": None, "in_stock": False})
+        assert response.status_code == 200
+        assert response.json()["price"] == 199.99
+        assert response.json()["in_stock"] is False
+        response = client.patch("/products/bulk", json=[{"id": 2, "price": None}])
+        assert response.status_code == 200
+        assert response.json()[0]["price"] == 89.99
+        assert [p["id"] for p in client.get("/products?sort=price").json()] == [3, 2, 1]
+        assert client.delete("/products/1").status_code == 204
+        assert [p["id"] for p in client.get("/products?sort=price").json()] == [3, 2]
+
+    def test_price_index_follows_deletes(self, client):
+        """Test deleted products disappear from price queries."""
+        client.delete("/products/3")
+        response = client.get("/products?sort=price")
+        assert [p["id"] for p in response.json()] == [2, 1]
+
+    def test_sort_by_price_deleted_cursor(self, client):
+        """Test a price-sorted cursor naming a deleted product returns 400."""
+        client.delete("/products/2")
+        response = client.get("/products?sort=price&after_id=2")
+        assert response.status_code == 400
+        assert response.json() == {"detail": "Invalid cursor"}
+
+    def test_invalid_sort(self, client):
+        """Test an unknown sort order is rejected."""
+        response = client.get("/products?sort=name")
+        assert response.status_code == 422
+
+
+class TestProductSearch:
+    """Tests for GET /products/search."""
+
+    def test_search_by_name(self, client):
+        """Test searching for a word in a product name."""
+        response = client.get("/products/search?q=coffee")
+        assert response.status_code == 200
+        assert [p["name"] for p in response.json()] == ["Coffee Maker"]
+
+    def test_search_description_and_tags(self, client):
+        """Test description words and tags are searchable."""
+        assert [p["id"] for p in client.get("/products/search?q=noise").json()] == [1]
+        assert [p["id"] for p in client.get("/products/search?q=ergonomic").json()] == [3]
+
+    def test_search_is_case_insensitive(self, client):
+        """Test query terms match regardless of case."""
+        response = client.get("/products/search?q=LAPTOP")
+        assert [p["id"] for p in response.json()] == [3]
+
+    def test_search_prefix(self, client):
+        """Test the last query term matches as a prefix."""
+        response = client.get("/products/search?q=headph")
+        assert [p["id"] for p in response.json()] == [1]
+
+    def test_search_ranks_better_matches_first(self, client):
+        """Test products matching more query terms rank higher."""
+        client.post("/products", json={
+            "name": "Wireless Mouse",
+            "description": "Compact mouse",
+            "price": 19.99,
+            "category": "Electronics"
+        })
+        response = client.get("/products/search?q=wireless headphones")
+        ids = [p["id"] for p in response.json()]
+        assert ids[0] == 1
+        assert 4 in ids
+
+    def test_search_limit(self, client):
+        """Test limit caps the number of results."""
+        response = client.get("/products/search?q=with&limit=1")
+        assert len(response.json()) == 1
+
+    def test_search_no_match(self, client):
+        """Test a query with no matches returns an empty list."""
+        response = client.get("/products/search?q=zzzz")
+        assert response.status_code == 200
+        assert response.json() == []
+
+    def test_search_requires_query(self, client):
+        """Test q is required."""
+        response = client.get("/products/search")
+        assert response.status_code == 422
+
+    def test_search_follows_updates(self, client):
+        """Test the search index is updated when a product changes."""
+        client.put("/products/2", json={"name": "Espresso Machine", "tags": ["barista"]})
+        assert [p["id"] for p in client.get("/products/search?q=espresso").json()] == [2]
+        assert [p["id"] for p in client.get("/products/search?q=barista").json()] == [2]
+        assert client.get("/products/search?q=automatic").json() == []
+
+    def test_null_text_update_leaves_fields(self, client):
+        """Test explicit nulls for searchable fields are ignored rather than breaking the search index."""
+        response = client.put("/products/2", json={"name": None, "description": None, "tags": None, "price": 79.99})
+        assert response.status_code == 200
+        product = response.json()
+        assert (product["name"], product["price"]) == ("Coffee Maker", 79.99)
+        assert product["tags"] == ["kitchen", "coffee", "automatic"]
+        response = client.patch("/products/bulk", json=[{"id": 3, "name": None, "tags": ["desk"]}])
+        assert response.status_code == 200
+        assert response.json()[0]["name"] == "Laptop Stand"
+        assert [p["id"] for p in client.get("/products/search?q=grinder").json()] == [2]
+        assert [p["id"] for p in client.get("/products/search?q=laptop desk").json()] == [3]
+        assert client.delete("/products/2").status_code == 204
+        assert client.get("/products/search?q=coffee").json() == []
+
+    def test_search_follows_deletes(self, client):
+        """Test deleted products are no longer found."""
+        client.delete("/products/1")
+        assert client.get("/products/search?q=headphones").json() == []
+
 
 class TestUserEndpoints:
     """Tests for user CRUD endpoints."""
@@ -262,6 +598,48 @@ class TestUserEndpoints:
         assert response.status_code == 404
         assert response.json() == {"detail": "User not found"}
 
+    def test_create_user_duplicate_email(self, client):
+        """Test POST /users returns 409 for an email that is already registered."""
+        user_data = {"name": "First", "email": "dup@example.com", "password": "pass123"}
+        assert client.post("/users", json=user_data).status_code == 200
+
+        user_data["name"] = "Second"
+        response = client.post("/users", json=user_data)
+        assert response.status_code == 409
+        assert response.json() == {"detail": "Email already registered"}
+        assert len(client.get("/users").json()) == 1
+
+    def test_update_user_duplicate_email(self, client):
+        """Test PUT /users/{id} returns 409 when taking another user's email."""
+        client.post("/users", json={"name": "A", "email": "a@example.com", "password": "pass"})
+        user_id = client.post("/users", json={"name": "B", "email": "b@example.com", "password": "pass"}).json()["id"]
+
+        response = client.put(f"/users/{user_id}", json={"email": "a@example.com"})
+        assert response.status_code == 409
+        assert client.get(f"/users/{user_id}").json()["email"] == "b@example.com"
+
+    def test_null_email_update_keeps_email(self, client):
+        """Test an explicit null email leaves the user's email, and its claim on it, as they were."""
+        first = client.post("/users", json={"name": "A", "email": "a@example.com", "password": "pass"}).json()
+        second = client.post("/users", json={"name": "B", "email": "b@example.com", "password": "pass"}).json()
+        response = client.put(f"/users/{first['id']}", json={"email": None, "name": "Ann"})
+        assert response.status_code == 200
+        assert (response.json()["name"], response.json()["email"]) == ("Ann", "a@example.com")
+        response = client.patch("/users/bulk", json=[{"id": second["id"], "email": None}])
+        assert response.status_code == 200
+        assert response.json()[0]["email"] == "b@example.com"
+        for email in ("a@example.com", "b@example.com"):
+            user = {"name": "C", "email": email, "password": "pass"}
+            assert client.post("/users", json=user).status_code == 409
+        assert client.get("/users").status_code == 200
+
+    def test_deleted_user_email_can_be_reused(self, client):
+        """Test an email becomes available again after its user is deleted."""
+        user_data = {"name": "Reuse", "email": "reuse@example.com", "password": "pass"}
+        user_id = client.post("/users", json=user_data).json()["id"]
+        client.delete(f"/users/{user_id}")
+        assert client.post("/users", json=user_data).status_code == 200
+
     def test_delete_user_reduces_count(self, client):
         """Test that deleting a user reduces the total count."""
         # Create a user
@@ -354,6 +732,36 @@ class TestSettingEndpoints:
         assert setting["key"] == "max_users"
         assert setting["value"] == "100"
 
+    def test_get_setting_by_key(self, client):
+        """Test GET /settings/by-key/{key} returns the setting with that key."""
+        created = client.post("/settings", json={"key": "feature_flag", "value": "on"}).json()
+        response = client.get("/settings/by-key/feature_flag")
+        assert response.status_code == 200
+        assert response.json()["id"] == created["id"]
+        assert response.json()["value"] == "on"
+
+    def test_get_setting_by_key_not_found(self, client):
+        """Test GET /settings/by-key/{key} returns 404 for an unknown key."""
+        response = client.get("/settings/by-key/missing")
+        assert response.status_code == 404
+        assert response.json() == {"detail": "Setting not found"}
+
+    def test_get_setting_by_key_after_delete(self, client):
+        """Test a deleted setting is no longer found by key."""
+        setting_id = client.post("/settings", json={"key": "gone", "value": "x"}).json()["id"]
+        client.delete(f"/settings/{setting_id}")
+        assert client.get("/settings/by-key/gone").status_code == 404
+
+    def test_create_setting_duplicate_key(self, client):
+        """Test POST /settings returns 409 for a key that already exists."""
+        setting_data = {"key": "unique_key", "value": "1"}
+        assert client.post("/settings", json=setting_data).status_code == 200
+
+        response = client.post("/settings", json={"key": "unique_key", "value": "2"})
+        assert response.status_code == 409
+        assert response.json() == {"detail": "Setting key already exists"}
+        assert client.get("/settings/by-key/unique_key").json()["value"] == "1"
+
     def test_get_setting_not_found(self, client):
         """Test GET /settings/{id} returns 404 for non-existent setting."""
         response = client.get("/settings/999")
@@ -385,6 +793,20 @@ class TestSettingEndpoints:
         # Key should remain unchanged
         assert setting["key"] == "api_timeout"
 
+    def test_null_value_update_keeps_value(self, client):
+        """Test an explicit null value is ignored, a null description clears it, and the list still serves."""
+        first = client.post("/settings", json={"key": "a", "value": "1", "description": "First"}).json()
+        second = client.post("/settings", json={"key": "b", "value": "2", "description": "Second"}).json()
+        response = client.put(f"/settings/{first['id']}", json={"value": None, "description": None})
+        assert response.status_code == 200
+        assert (response.json()["value"], response.json()["description"]) == ("1", None)
+        response = client.patch("/settings/bulk", json=[{"id": second["id"], "value": None}])
+        assert response.status_code == 200
+        assert response.json()[0]["value"] == "2"
+        response = client.get("/settings")
+        assert response.status_code == 200
+        assert {s["key"]: s["value"] for s in response.json()} == {"a": "1", "b": "2"}
+
     def test_update_setting_not_found(self, client):
         """Test PUT /settings/{id} returns 404 for non-existent setting."""
         update_data = {"value": "new_value"}
@@ -437,3 +859,908 @@ class TestSettingEndpoints:
         response = client.get("/settings")
         new_count = len(response.json())
         assert new_count == initial_count - 1
+
+
+class TestBulkEndpoints:
+    """Tests for bulk create, update and delete endpoints."""
+
+    def test_bulk_create_products(self, client):
+        """Test POST /products/bulk creates every product with consecutive ids."""
+        products = [
+            {"name": f"Bulk {i}", "description": "Bulk", "price": 1.0 + i, "category": "Bulk", "tags": ["bulk"]}
+            for i in range(5)
+        ]
+        response = client.post("/products/bulk", json=products)
+        assert response.status_code == 200
+        created = response.json()
+        assert [p["id"] for p in created] == [4, 5, 6, 7, 8]
+        assert [p["name"] for p in created] == [f"Bulk {i}" for i in range(5)]
+        assert len(client.get("/products").json()) == 8
+        assert len(client.get("/products?category=Bulk").json()) == 5
+
+    def test_bulk_create_products_invalid_item(self, client):
+        """Test one invalid product rejects the whole batch."""
+        products = [
+            {"name": "Good", "description": "Good", "price": 1.0, "category": "Bulk"},
+            {"name": "Bad", "description": "Bad", "price": "free", "category": "Bulk"},
+        ]
+        response = client.post("/products/bulk", json=products)
+        assert response.status_code == 422
+        assert len(client.get("/products").json()) == 3
+
+    def test_bulk_update_products(self, client):
+        """Test PATCH /products/bulk updates every listed product."""
+        updates = [{"id": 1, "price": 150.0}, {"id": 3, "in_stock": False}]
+        response = client.patch("/products/bulk", json=updates)
+        assert response.status_code == 200
+        assert [p["id"] for p in response.json()] == [1, 3]
+        assert client.get("/products/1").json()["price"] == 150.0
+        assert client.get("/products/3").json()["in_stock"] is False
+        assert [p["id"] for p in client.get("/products?in_stock=false").json()] == [3]
+
+    def test_bulk_update_products_missing_id(self, client):
+        """Test a missing id rejects the whole update batch."""
+        updates = [{"id": 1, "price": 150.0}, {"id": 999, "price": 1.0}]
+        response = client.patch("/products/bulk", json=updates)
+        assert response.status_code == 404
+        assert response.json() == {"detail": "Products not found: 999"}
+        assert client.get("/products/1").json()["price"] == 199.99
+
+    def test_bulk_delete_products(self, client):
+        """Test DELETE /products/bulk removes every listed product."""
+        response = client.request("DELETE", "/products/bulk", json=[1, 3])
+        assert response.status_code == 204
+        assert [p["id"] for p in client.get("/products").json()] == [2]
+
+    def test_bulk_delete_products_missing_id(self, client):
+        """Test a missing id rejects the whole delete batch."""
+        response = client.request("DELETE", "/products/bulk", json=[1, 999])
+        assert response.status_code == 404
+        assert len(client.get("/products").json()) == 3
+
+    def test_bulk_create_users(self, client):
+        """Test POST /users/bulk creates every user."""
+        users = [{"name": f"User {i}", "email": f"bulk{i}@example.com", "password": "pass"} for i in range(3)]
+        response = client.post("/users/bulk", json=users)
+        assert response.status_code == 200
+        assert len(response.json()) == 3
+        assert len(client.get("/users").json()) == 3
+
+    def test_bulk_create_users_duplicate_email(self, client):
+        """Test a duplicate email within the batch rejects it entirely."""
+        users = [
+            {"name": "A", "email": "same@example.com", "password": "pass"},
+            {"name": "B", "email": "same@example.com", "password": "pass"},
+        ]
+        response = client.post("/users/bulk", json=users)
+        assert response.status_code == 409
+        assert client.get("/users").json() == []
+
+    def test_bulk_update_users_swap_emails(self, client):
+        """Test two users can swap emails in one batch."""
+        created = client.post("/users/bulk", json=[
+            {"name": "A", "email": "a@example.com", "password": "pass"},
+            {"name": "B", "email": "b@example.com", "password": "pass"},
+        ]).json()
+        updates = [
+            {"id": created[0]["id"], "email": "b@example.com"},
+            {"id": created[1]["id"], "email": "a@example.com"},
+        ]
+        response = client.patch("/users/bulk", json=updates)
+        assert response.status_code == 200
+        assert client.get(f"/users/{created[0]['id']}").json()["email"] == "b@example.com"
+
+    def test_bulk_update_users_email_taken(self, client):
+        """Test taking an email owned by a user outside the batch returns 409."""
+        created = client.post("/users/bulk", json=[
+            {"name": "A", "email": "a@example.com", "password": "pass"},
+            {"name": "B", "email": "b@example.com", "password": "pass"},
+        ]).json()
+        response = client.patch("/users/bulk", json=[{"id": created[1]["id"], "email": "a@example.com"}])
+        assert response.status_code == 409
+        assert client.get(f"/users/{created[1]['id']}").json()["email"] == "b@example.com"
+
+    def test_bulk_delete_users(self, client):
+        """Test DELETE /users/bulk removes every listed user."""
+        created = client.post("/users/bulk", json=[
+            {"name": "A", "email": "a@example.com", "password": "pass"},
+            {"name": "B", "email": "b@example.com", "password": "pass"},
+        ]).json()
+        response = client.request("DELETE", "/users/bulk", json=[u["id"] for u in created])
+        assert response.status_code == 204
+        assert client.get("/users").json() == []
+
+    def test_bulk_create_settings(self, client):
+        """Test POST /settings/bulk creates every setting."""
+        settings = [{"key": f"bulk_{i}", "value": str(i)} for i in range(3)]
+        response = client.post("/settings/bulk", json=settings)
+        assert response.status_code == 200
+        assert client.get("/settings/by-key/bulk_2").json()["value"] == "2"
+
+    def test_bulk_create_settings_existing_key(self, client):
+        """Test a key that already exists rejects the whole batch."""
+        client.post("/settings", json={"key": "taken", "value": "1"})
+        response = client.post("/settings/bulk", json=[{"key": "fresh", "value": "1"}, {"key": "taken", "value": "2"}])
+        assert response.status_code == 409
+        assert client.get("/settings/by-key/fresh").status_code == 404
+
+    def test_bulk_update_and_delete_settings(self, client):
+        """Test PATCH and DELETE /settings/bulk."""
+        created = client.post("/settings/bulk", json=[{"key": "a", "value": "1"}, {"key": "b", "value": "2"}]).json()
+        response = client.patch("/settings/bulk", json=[{"id": created[0]["id"], "value": "10"}])
+        assert response.status_code == 200
+        assert client.get("/settings/by-key/a").json()["value"] == "10"
+
+        response = client.request("DELETE", "/settings/bulk", json=[s["id"] for s in created])
+        assert response.status_code == 204
+        assert client.get("/settings").json() == []
+
+
+class TestNdjsonImportExport:
+    """Tests for streaming NDJSON export and import of products."""
+
+    def test_export_products(self, client):
+        """Test GET /products/export streams one JSON product per line."""
+        response = client.get("/products/export")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = response.text.splitlines()
+        assert len(lines) == 3
+        assert json.loads(lines[0])["name"] == "Wireless Headphones"
+
+    def test_export_spans_multiple_chunks(self, client, monkeypatch):
+        """Test the export covers every row when it is streamed in several chunks."""
+        import main
+        monkeypatch.setattr(main, "NDJSON_BATCH_SIZE", 2)
+        client.delete("/products/2")
+        lines = client.get("/products/export").text.splitlines()
+        assert [json.loads(line)["id"] for line in lines] == [1, 3]
+
+    def test_import_products(self, client):
+        """Test POST /products/import creates a product per line."""
+        body = "\n".join(json.dumps({
+            "name": f"Imported {i}", "description": "Imported", "price": 5.0, "category": "Import"
+        }) for i in range(5)) + "\n"
+        response = client.post("/products/import", content=body, headers={"Content-Type": "application/x-ndjson"})
+        assert response.status_code == 200
+        assert response.json() == {"imported": 5}
+        assert len(client.get("/products?category=Import").json()) == 5
+
+    def test_import_in_batches_without_trailing_newline(self, client, monkeypatch):
+        """Test import handles several batches and a final line with no newline."""
+        import main
+        monkeypatch.setattr(main, "NDJSON_BATCH_SIZE", 2)
+        body = "\n".join(json.dumps({
+            "name": f"Imported {i}", "description": "Imported", "price": 5.0, "category": "Import"
+        }) for i in range(5))
+        response = client.post("/products/import", content=body)
+        assert response.json() == {"imported": 5}
+
+    def test_export_import_round_trip(self, client):
+        """Test an export can be imported back, creating new ids."""
+        exported = client.get("/products/export").content
+        response = client.post("/products/import", content=exported)
+        assert response.json() == {"imported": 3}
+        names = [p["name"] for p in client.get("/products").json()]
+        assert names[3:] == names[:3]
+
+    def test_import_invalid_line(self, client):
+        """Test an invalid line returns 422 naming the line."""
+        body = json.dumps({"name": "Ok", "description": "Ok", "price": 1.0, "category": "Import"}) + "\n{not json}\n"
+        response = client.post("/products/import", content=body)
+        assert response.status_code == 422
+        assert response.json()["detail"]["line"] == 2
+
+
+class TestConditionalRequests:
+    """Tests for ETags, If-None-Match and If-Match."""
+
+    def test_get_returns_version_etag(self, client):
+        """Test a row starts at version 1 and its ETag names it."""
+        response = client.get("/products/1")
+        assert response.headers["ETag"] == '"1"'
+        assert response.json()["version"] == 1
+
+    def test_update_increments_version(self, client):
+        """Test every update bumps the version and returns the new ETag."""
+        response = client.put("/products/1", json={"price": 1.0})
+        assert response.headers["ETag"] == '"2"'
+        assert client.get("/products/1").headers["ETag"] == '"2"'
+
+    def test_bulk_update_increments_version(self, client):
+        """Test bulk updates bump the version too."""
+        client.patch("/products/bulk", json=[{"id": 1, "price": 1.0}])
+        assert client.get("/products/1").json()["version"] == 2
+
+    def test_bulk_update_repeated_id_returns_final_row(self, client):
+        """Test a repeated id is returned once per entry, as the whole batch left it."""
+        response = client.patch("/products/bulk", json=[{"id": 1, "price": 1.0}, {"id": 2, "price": 2.0},
+                                                        {"id": 1, "in_stock": False}])
+        assert [(p["id"], p["version"]) for p in response.json()] == [(1, 3), (2, 2), (1, 3)]
+        assert response.json()[0] == response.json()[2] == client.get("/products/1").json()
+        assert response.json()[0]["price"] == 1.0 and response.json()[0]["in_stock"] is False
+        rows = {
+            "users": {"name": "Ann", "email": "ann@example.com", "password": "pass"},
+            "settings": {"key": "theme", "value": "dark"},
+        }
+        for collection, field in (("users", "name"), ("settings", "value")):
+            row_id = client.post(f"/{collection}", json=rows[collection]).json()["id"]
+            updates = [{"id": row_id, field: "a"}, {"id": row_id, field: "b"}]
+            response = client.patch(f"/{collection}/bulk", json=updates)
+            assert [(row["version"], row[field]) for row in response.json()] == [(3, "b"), (3, "b")]
+
+    def test_if_none_match_current_returns_304(self, client):
+        """Test a matching If-None-Match gets an empty 304."""
+        etag = client.get("/products/1").headers["ETag"]
+        response = client.get("/products/1", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+
+    def test_if_none_match_accepts_weak_and_lists(self, client):
+        """Test weak tags and tag lists are compared by version."""
+        response = client.get("/products/1", headers={"If-None-Match": '"7", W/"1"'})
+        assert response.status_code == 304
+
+    def test_if_none_match_stale_returns_body(self, client):
+        """Test a stale If-None-Match gets the new version."""
+        client.put("/products/1", json={"price": 1.0})
+        response = client.get("/products/1", headers={"If-None-Match": '"1"'})
+        assert response.status_code == 200
+        assert response.json()["price"] == 1.0
+
+    def test_put_if_match_current(self, client):
+        """Test a PUT naming the current version is applied."""
+        response = client.put("/products/1", json={"price": 1.0}, headers={"If-Match": '"1"'})
+        assert response.status_code == 200
+
+    def test_put_if_match_stale_returns_412(self, client):
+        """Test the second of two editors holding the same version is rejected."""
+        client.put("/products/1", json={"price": 1.0}, headers={"If-Match": '"1"'})
+        response = client.put("/products/1", json={"price": 2.0}, headers={"If-Match": '"1"'})
+        assert response.status_code == 412
+        assert client.get("/products/1").json()["price"] == 1.0
+
+    def test_if_match_rejects_weak_tags(self, client):
+        """Test If-Match uses strong comparison."""
+        response = client.put("/products/1", json={"price": 1.0}, headers={"If-Match": 'W/"1"'})
+        assert response.status_code == 412
+
+    def test_if_match_star(self, client):
+        """Test If-Match: * applies to any existing row."""
+        client.put("/products/1", json={"price": 1.0})
+        response = client.put("/products/1", json={"price": 2.0}, headers={"If-Match": "*"})
+        assert response.status_code == 200
+
+    def test_delete_if_match(self, client):
+        """Test a conditional DELETE checks the version first."""
+        assert client.delete("/products/1", headers={"If-Match": '"5"'}).status_code == 412
+        assert client.get("/products/1").status_code == 200
+        assert client.delete("/products/1", headers={"If-Match": '"1"'}).status_code == 204
+
+    def test_if_match_missing_row_returns_404(self, client):
+        """Test a conditional write to a missing row is still a 404."""
+        assert client.put("/products/999", json={"price": 1.0}, headers={"If-Match": '"1"'}).status_code == 404
+
+    def test_users_and_settings(self, client):
+        """Test users and settings support the same conditional requests."""
+        user = client.post("/users", json={"name": "Ann", "email": "ann@example.com", "password": "pw"}).json()
+        assert client.get(f"/users/{user['id']}", headers={"If-None-Match": '"1"'}).status_code == 304
+        assert client.put(f"/users/{user['id']}", json={"name": "B"}, headers={"If-Match": '"2"'}).status_code == 412
+        assert client.delete(f"/users/{user['id']}", headers={"If-Match": '"1"'}).status_code == 204
+
+        setting = client.post("/settings", json={"key": "theme", "value": "dark"}).json()
+        assert client.get("/settings/by-key/theme", headers={"If-None-Match": '"1"'}).status_code == 304
+        response = client.put(f"/settings/{setting['id']}", json={"value": "light"}, headers={"If-Match": '"1"'})
+        assert response.headers["ETag"] == '"2"'
+        assert client.get(f"/settings/{setting['id']}", headers={"If-None-Match": '"1"'}).status_code == 200
+
+
+class TestResponseCache:
+    """Test GET responses are served from the cache until a write invalidates them."""
+
+    def stats(self, client):
+        return client.get("/cache/stats").json()
+
+    def test_repeated_list_is_a_hit(self, client):
+        """Test the second identical GET is served from the cache with the same body."""
+        first = client.get("/products")
+        second = client.get("/products")
+        assert second.content == first.content
+        assert second.headers["content-type"] == "application/json"
+        assert self.stats(client)["hits"] == 1
+
+    def test_query_parameter_order_does_not_matter(self, client):
+        """Test requests differing only in parameter order share an entry."""
+        client.get("/products?category=Electronics&in_stock=true")
+        client.get("/products?in_stock=true&category=Electronics")
+        assert self.stats(client)["hits"] == 1
+
+    def test_writes_invalidate_lists(self, client):
+        """Test create, update and delete are visible on the next GET."""
+        client.get("/products")
+        created = client.post("/products", json={"name": "New", "description": "D", "price": 1.0, "category": "C"})
+        assert len(client.get("/products").json()) == 4
+        client.put(f"/products/{created.json()['id']}", json={"name": "Renamed"})
+        assert client.get("/products").json()[-1]["name"] == "Renamed"
+        client.delete("/products/1")
+        assert [p["id"] for p in client.get("/products").json()] == [2, 3, created.json()["id"]]
+        assert self.stats(client)["hits"] == 0
+
+    def test_write_to_other_collection_keeps_entry(self, client):
+        """Test a user write does not invalidate cached product lists."""
+        client.get("/products")
+        client.post("/users", json={"name": "Ann", "email": "ann@example.com", "password": "pw"})
+        client.get("/products")
+        assert self.stats(client)["hits"] == 1
+
+    def test_cursor_header_is_cached(self, client):
+        """Test a cached page still advertises its next cursor."""
+        first = client.get("/products?limit=2")
+        second = client.get("/products?limit=2")
+        assert second.headers["X-Next-Cursor"] == first.headers["X-Next-Cursor"] == "2"
+        assert self.stats(client)["hits"] == 1
+
+    def test_detail_invalidated_by_row_version(self, client):
+        """Test a row's cached body and ETag change when the row is updated."""
+        client.get("/products/1")
+        assert client.get("/products/1").headers["ETag"] == '"1"'
+        client.put("/products/1", json={"price": 1.5})
+        response = client.get("/products/1")
+        assert response.json()["price"] == 1.5
+        assert response.headers["ETag"] == '"2"'
+        assert self.stats(client)["hits"] == 1
+
+    def test_recreated_setting_key_is_not_served_stale(self, client):
+        """Test a key deleted and created again returns the new row."""
+        setting = client.post("/settings", json={"key": "theme", "value": "dark"}).json()
+        client.get("/settings/by-key/theme")
+        client.delete(f"/settings/{setting['id']}")
+        client.post("/settings", json={"key": "theme", "value": "light"})
+        assert client.get("/settings/by-key/theme").json()["value"] == "light"
+
+
+class TestSerialization:
+    """Test the pluggable JSON encoders."""
+
+    @pytest.mark.parametrize("name", ["response_model", "pydantic", "orjson"])
+    def test_encoders_match_response_model(self, name):
+        """Test each encoder produces the bytes FastAPI would for the response model."""
+        from fastapi.encoders import jsonable_encoder
+        from serialization import create_encoder
+        from starlette.responses import JSONResponse
+
+        products = [
+            Product(id=1, name="Ünïcode", description="d", price=9.99, category="C", tags=["a"]),
+            Product(id=2, name="B", description="d", price=0.5, category="C", in_stock=False,
+                    created_at=datetime(2024, 1, 2, 3, 4, 5, 6, tzinfo=timezone.utc)),
+        ]
+        expected = JSONResponse(jsonable_encoder(products)).body
+        assert create_encoder(name)(products) == expected
+        assert create_encoder(name)(products[1]) == JSONResponse(jsonable_encoder(products[1])).body
+        # Floats in exponent notation are the one difference: 1e-7 rather than 1e-07
+        assert json.loads(create_encoder(name)([1e-7, 1e22])) == [1e-7, 1e22]
+
+    def test_response_model_encoder_rejects_invalid_rows(self):
+        """Test the default encoder fails a response whose rows break their model."""
+        import config
+        from fastapi.exceptions import ResponseValidationError
+        from serialization import create_encoder
+
+        product = Product(id=1, name="A", description="d", price=1.0, category="C")
+        broken = product.model_copy(update={"name": None})
+        encode = create_encoder(config.JSON_ENCODER)
+        assert encode([product]) == create_encoder("pydantic")([product])
+        for value in ([product, broken], broken, ProductChanges(seq=1, products=[broken], deleted=[], more=False)):
+            with pytest.raises(ResponseValidationError):
+                encode(value)
+
+    def test_unknown_encoder(self):
+        """Test an unknown encoder name is rejected."""
+        from serialization import create_encoder
+        with pytest.raises(ValueError):
+            create_encoder("ujson")
+
+    def test_openapi_keeps_response_models(self, client):
+        """Test routes that send pre-serialized bytes still document their models."""
+        paths = client.get("/openapi.json").json()["paths"]
+        schema = paths["/products"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+        assert schema["items"]["$ref"] == "#/components/schemas/Product"
+        schema = paths["/users/bulk"]["post"]["responses"]["200"]["content"]["application/json"]["schema"]
+        assert schema["items"]["$ref"] == "#/components/schemas/User"
+
+    def test_orjson_responses(self, client):
+        """Test the API serves identical bodies with the orjson encoder."""
+        from serialization import create_encoder
+        expected = client.get("/products").content
+        client.app.state.response_cache.clear()
+        client.app.state.encode_json = create_encoder("orjson")
+        assert client.get("/products").content == expected
+        assert client.get("/products/export").content.splitlines()[0] == client.get("/products/1").content
+
+
+class TestProductStats:
+    """Test server-side price aggregates."""
+
+    def expected(self, products, key):
+        groups = {}
+        for product in products:
+            for group in key(product):
+                groups.setdefault(group, []).append(product["price"])
+        return {group: (len(prices), sum(prices), min(prices), max(prices)) for group, prices in groups.items()}
+
+    def actual(self, client, group_by=None):
+        params = {} if group_by is None else {"group_by": group_by}
+        response = client.get("/products/stats", params=params)
+        assert response.status_code == 200
+        rows = response.json()
+        for row in rows:
+            assert row["avg"] == pytest.approx(row["sum"] / row["count"])
+        return {row["group"]: (row["count"], pytest.approx(row["sum"]), row["min"], row["max"]) for row in rows}
+
+    @pytest.mark.parametrize("group_by, key", [
+        (None, lambda p: [None]),
+        ("category", lambda p: [p["category"]]),
+        ("in_stock", lambda p: [p["in_stock"]]),
+        ("tag", lambda p: set(p["tags"])),
+    ])
+    def test_matches_products(self, client, group_by, key):
+        """Test each grouping agrees with aggregating the product list."""
+        client.post("/products/bulk", json=[
+            {"name": "A", "description": "d", "price": 5.0, "category": "Electronics", "tags": ["sale", "new"]},
+            {"name": "B", "description": "d", "price": 2.5, "category": "Garden", "tags": ["sale"], "in_stock": False},
+        ])
+        client.put("/products/1", json={"price": 10.0, "category": "Garden"})
+        client.delete("/products/2")
+        products = client.get("/products").json()
+        assert self.actual(client, group_by) == self.expected(products, key)
+
+    def test_groups_are_ordered(self, client):
+        """Test groups come back sorted by their value."""
+        groups = [row["group"] for row in client.get("/products/stats?group_by=category").json()]
+        assert groups == sorted(groups)
+
+    def test_empty_catalog(self, client):
+        """Test no rows are returned when there are no products."""
+        client.request("DELETE", "/products/bulk", json=[1, 2, 3])
+        assert client.get("/products/stats").json() == []
+        assert client.get("/products/stats?group_by=tag").json() == []
+
+    def test_invalid_group_by(self, client):
+        """Test an unknown grouping is rejected."""
+        assert client.get("/products/stats?group_by=name").status_code == 422
+
+    def test_materialized_view(self, client):
+        """Test a view endpoint returns per-group counts and price sums."""
+        client.put("/products/1", json={"category": "Appliances"})
+        rows = client.get("/products/stats/views/category_totals").json()
+        stats = client.get("/products/stats?group_by=category").json()
+        assert [(r["group"], r["count"]) for r in rows] == [(s["group"], s["count"]) for s in stats]
+        assert [r["sum"] for r in rows] == pytest.approx([s["sum"] for s in stats])
+        assert client.get("/products/stats/views/tag_totals").status_code == 200
+        assert client.get("/products/stats/views/missing").status_code == 404
+
+
+class TestChangeFeed:
+    """Test the change stream over server-sent events and WebSocket."""
+
+    def test_websocket_receives_changes(self, client):
+        """Test a subscriber gets each committed write as a JSON message."""
+        with client.websocket_connect("/changes/ws") as websocket:
+            created = client.post("/products", json={
+                "name": "Lamp", "description": "Desk lamp", "price": 20.0, "category": "Home",
+            }).json()
+            client.put(f"/products/{created['id']}", json={"price": 25.0})
+            client.delete(f"/products/{created['id']}")
+            messages = [websocket.receive_json() for _ in range(3)]
+        assert [(m["op"], m["table"], m["id"]) for m in messages] == [
+            ("insert", "products", created["id"]),
+            ("update", "products", created["id"]),
+            ("delete", "products", created["id"]),
+        ]
+        assert messages[0]["row"]["name"] == "Lamp"
+        assert messages[1]["row"]["price"] == 25.0
+        assert messages[2]["row"] is None
+        assert [m["seq"] for m in messages] == [1, 2, 3]
+
+    def test_websocket_resumes_and_filters(self, client):
+        """Test `since` replays retained changes and `table` limits them to one collection."""
+        client.post("/users", json={"name": "Ann", "email": "ann@example.com", "password": "pass"})
+        client.delete("/products/1")
+        client.post("/settings", json={"key": "theme", "value": "dark"})
+        with client.websocket_connect("/changes/ws?since=0&table=products") as websocket:
+            message = websocket.receive_json()
+        assert (message["seq"], message["op"], message["id"]) == (2, "delete", 1)
+
+    def test_websocket_expired_since_closes(self, client):
+        """Test a subscription from a sequence number the server does not have is closed with 4000."""
+        from starlette.websockets import WebSocketDisconnect
+        with client.websocket_connect("/changes/ws?since=5") as websocket:
+            with pytest.raises(WebSocketDisconnect) as info:
+                websocket.receive_json()
+        assert info.value.code == 4000
+
+    def test_sse_expired_since_is_gone(self, client):
+        """Test the event stream answers 410 when asked to resume from an unknown sequence number."""
+        assert client.get("/changes", params={"since": 5}).status_code == 410
+        assert client.get("/changes", headers={"Last-Event-ID": "5"}).status_code == 410
+
+    def test_resume_needs_the_same_epoch(self, client):
+        """Test a position numbered by another worker or run is gone rather than resumed at unrelated changes."""
+        from starlette.websockets import WebSocketDisconnect
+        import main
+        client.delete("/products/1")
+        client.delete("/products/2")
+        log = client.app.state.async_db.changes
+        epoch = log.epoch
+        assert client.get("/changes", headers={"Last-Event-ID": "0123abcd-1"}).status_code == 410
+        assert client.get("/changes", params={"since": 1, "epoch": "0123abcd"}).status_code == 410
+        with client.websocket_connect("/changes/ws?since=1&epoch=0123abcd") as websocket:
+            with pytest.raises(WebSocketDisconnect) as info:
+                websocket.receive_json()
+        assert info.value.code == 4000
+        with client.websocket_connect(f"/changes/ws?since=1&epoch={epoch}") as websocket:
+            message = websocket.receive_json()
+        assert (message["epoch"], message["seq"], message["id"]) == (epoch, 2, 2)
+        assert main.change_start(log, None, None, f"{epoch}-1") == 1
+
+    def test_resume_on_another_sqlite_worker(self, tmp_path):
+        """Test workers serving one SQLite file share one feed, so a client can resume on any of them."""
+        from fastapi.testclient import TestClient
+        import main
+        from sqlite_backend import SQLiteDatabase
+        path = str(tmp_path / "workers.sqlite3")
+        with TestClient(main.create_app(SQLiteDatabase(path))) as first, \
+                TestClient(main.create_app(SQLiteDatabase(path))) as second:
+            first.delete("/products/1")
+            second.delete("/products/2")
+            epoch = first.app.state.async_db.changes.epoch
+            with second.websocket_connect(f"/changes/ws?since=0&epoch={epoch}") as websocket:
+                messages = [websocket.receive_json(), websocket.receive_json()]
+        assert [(m["epoch"], m["seq"], m["id"]) for m in messages] == [(epoch, 1, 1), (epoch, 2, 2)]
+
+    def test_sse_frames(self, client):
+        """Test changes are framed as server-sent events whose ids resume the stream."""
+        import main
+        client.delete("/products/1")
+        client.delete("/products/2")
+        log = client.app.state.async_db.changes
+
+        async def first_chunk():
+            feed = main.ChangeNotifier(log, asyncio.get_running_loop())
+            stream = main.sse_changes(feed, 0, {"products"})
+            chunk = await stream.__anext__()
+            await stream.aclose()
+            feed.close()
+            return chunk
+
+        frames = asyncio.run(first_chunk()).decode().split("\n\n")
+        assert frames[0].splitlines()[:2] == [f"id: {log.epoch}-1", "event: change"]
+        assert json.loads(frames[1].splitlines()[2][len("data: "):])["id"] == 2
+
+    def test_sse_slow_subscriber_is_reset(self):
+        """Test a subscriber that falls behind the retained changes gets a reset event."""
+        from changes import ChangeLog
+        import main
+        log = ChangeLog(capacity=2)
+        for row_id in range(5):
+            log.append("delete", "products", row_id)
+
+        async def chunks():
+            feed = main.ChangeNotifier(log, asyncio.get_running_loop())
+            return [chunk async for chunk in main.sse_changes(feed, 0, None)]
+
+        assert asyncio.run(chunks()) == [b"event: reset\ndata: 0\n\n"]
+
+
+class TestDeltaSync:
+    """Test incremental product sync from a watermark."""
+
+    def test_sync_round_trip(self, client):
+        """Test a client that applies each batch ends with the same catalog as a full reload."""
+        initial = client.get("/products/changes").json()
+        catalog = {p["id"]: p for p in initial["products"]}
+        assert initial["more"] is False and initial["deleted"] == []
+
+        client.post("/products", json={"name": "Lamp", "description": "d", "price": 20.0, "category": "Home"})
+        client.put("/products/1", json={"price": 5.0})
+        client.delete("/products/2")
+        response = client.get("/products/changes", params={"since": initial["seq"]})
+        assert response.status_code == 200
+        changes = response.json()
+        assert len(changes["products"]) == 2 and [t["id"] for t in changes["deleted"]] == [2]
+        catalog.update({p["id"]: p for p in changes["products"]})
+        for tombstone in changes["deleted"]:
+            catalog.pop(tombstone["id"])
+        assert sorted(catalog.values(), key=lambda p: p["id"]) == client.get("/products").json()
+        assert client.get("/products/changes", params={"since": changes["seq"]}).json()["products"] == []
+
+    def test_products_carry_sequence(self, client):
+        """Test each write moves a product's seq past every earlier change."""
+        before = client.get("/products/1").json()["seq"]
+        updated = client.put("/products/1", json={"price": 5.0}).json()
+        assert updated["seq"] > before
+        assert client.get("/products/changes", params={"since": updated["seq"] - 1}).json()["products"] == [updated]
+
+    def test_limit(self, client):
+        """Test `more` is set while changes remain after the returned watermark."""
+        first = client.get("/products/changes", params={"limit": 2}).json()
+        assert (len(first["products"]), first["more"]) == (2, True)
+        second = client.get("/products/changes", params={"since": first["seq"], "limit": 2}).json()
+        assert (len(second["products"]), second["more"]) == (1, False)
+
+    def test_unknown_watermark_is_gone(self, client):
+        """Test a watermark the server never issued gets 410."""
+        assert client.get("/products/changes", params={"since": 1000}).status_code == 410
+        assert client.get("/products/changes", params={"since": -1}).status_code == 422
+
+
+class TestAppFactory:
+    """Test building the app with create_app."""
+
+    def test_import_is_light(self):
+        """Test importing main creates no database and loads neither uvicorn nor numpy."""
+        import os
+        import subprocess
+        import sys
+        check = ("import sys, database, main; "
+                 "assert database._db is None; "
+                 "assert 'uvicorn' not in sys.modules and 'numpy' not in sys.modules")
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.run([sys.executable, "-c", check], cwd=root, check=True)
+
+    def test_configured_database_created_at_startup(self, monkeypatch):
+        """Test an app built without a database creates the configured one, unseeded, when it starts."""
+        from fastapi.testclient import TestClient
+        import config
+        import database
+        import main
+        monkeypatch.setattr(database, "_db", None)
+        monkeypatch.setattr(config, "SAMPLE_DATA", False)
+        app = main.create_app()
+        assert database._db is None
+        with TestClient(app) as client:
+            assert client.get("/products").json() == []
+            assert client.post("/products", json={
+                "name": "First", "description": "First", "price": 1.0, "category": "New"
+            }).json()["id"] == 1
+        assert isinstance(database._db, database.InMemoryDatabase)
+
+    def test_apps_share_routes(self, db):
+        """Test each app reuses the routes built on import."""
+        import main
+        first, second = main.create_app(db), main.create_app(db)
+        product_route = next(route for route in main.router.routes if route.path == "/products/{product_id}")
+        assert product_route in first.routes and product_route in second.routes
+
+    def test_apps_keep_their_own_state(self, db, monkeypatch):
+        """Test building a second app leaves the first serving its own database, cache and metrics."""
+        from fastapi.testclient import TestClient
+        import config
+        from database import InMemoryDatabase
+        import main
+        monkeypatch.setattr(config, "METRICS", True)
+        first = TestClient(main.create_app(db))
+        assert first.get("/products/1").status_code == 200
+        second = TestClient(main.create_app(InMemoryDatabase()))
+        assert second.delete("/products/1").status_code == 204
+        assert first.get("/products/1").status_code == 200
+        assert first.app.state.response_cache.stats()["hits"] == 1
+        assert second.app.state.response_cache.stats()["hits"] == 0
+        assert first.app.state.async_db.metrics is first.app.state.metrics
+        assert first.app.state.metrics is not second.app.state.metrics
+
+
+class TestMetrics:
+    """Tests for request and storage metrics and GET /metrics."""
+
+    @pytest.fixture
+    def client(self, db, monkeypatch):
+        """A client for an app with metrics turned on."""
+        from fastapi.testclient import TestClient
+        import config
+        import main
+        monkeypatch.setattr(config, "METRICS", True)
+        with TestClient(main.create_app(db)) as client:
+            yield client
+
+    @staticmethod
+    def samples(client) -> dict:
+        """Metric samples by their name and labels, ignoring HELP and TYPE lines."""
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        return dict(line.rsplit(" ", 1) for line in response.text.splitlines() if not line.startswith("#"))
+
+    def test_requests_by_route_template_and_status(self, client):
+        """Test requests are counted under their route template, method and status."""
+        client.get("/products/1")
+        client.get("/products/2")
+        client.get("/products/999")
+        client.get("/no/such/path")
+        samples = self.samples(client)
+        route = 'method="GET",route="/products/{product_id}"'
+        assert samples[f'http_requests_total{{{route},status="200"}}'] == "2"
+        assert samples[f'http_requests_total{{{route},status="404"}}'] == "1"
+        assert samples['http_requests_total{method="GET",route="<unmatched>",status="404"}'] == "1"
+        assert samples[f'http_request_duration_seconds_count{{{route},status="200"}}'] == "2"
+        assert samples[f'http_request_duration_seconds_bucket{{{route},status="200",le="+Inf"}}'] == "2"
+        assert float(samples[f'http_request_duration_seconds_sum{{{route},status="200"}}']) > 0
+        # The scrape itself is in flight
+        assert samples["http_requests_in_flight"] == "1"
+
+    def test_storage_and_cache_metrics(self, client):
+        """Test storage call latencies, row counts and response cache counters are exposed."""
+        client.post("/users", json={"name": "Ann", "email": "ann@example.com", "password": "secret123"})
+        client.get("/products")
+        client.get("/products")
+        samples = self.samples(client)
+        # Only calls run in the executor are timed; in-memory ones run inline
+        timed = client.app.state.async_db.executor is not None
+        assert samples.get('db_operation_duration_seconds_count{operation="create_user"}') == ("1" if timed else None)
+        assert samples['db_rows{table="products"}'] == "3"
+        assert samples['db_rows{table="users"}'] == "1"
+        assert samples['db_rows{table="settings"}'] == "0"
+        assert samples['response_cache_requests_total{result="hit"}'] == "1"
+        assert samples['response_cache_requests_total{result="miss"}'] == "1"
+
+    def test_histogram_buckets(self):
+        """Test buckets are cumulative and each bound includes values equal to it."""
+        from metrics import Metrics
+        metrics = Metrics(buckets=(0.1, 1.0))
+        for seconds in (0.05, 0.1, 0.5, 2.0):
+            metrics.observe_request("GET", "/", 200, seconds)
+        lines = metrics.render().splitlines()
+        labels = 'method="GET",route="/",status="200"'
+        assert f'http_request_duration_seconds_bucket{{{labels},le="0.1"}} 2' in lines
+        assert f'http_request_duration_seconds_bucket{{{labels},le="1.0"}} 3' in lines
+        assert f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 4' in lines
+        assert f"http_request_duration_seconds_sum{{{labels}}} 2.65" in lines
+
+    def test_recorded_requests_are_folded_in_batches(self):
+        """Test queued requests reach the histograms once the queue is full, and on every render."""
+        from metrics import PENDING_REQUESTS, Metrics
+        metrics = Metrics()
+        for _ in range(PENDING_REQUESTS - 1):
+            metrics.record_request("GET", "/", 200, 0.001)
+        assert metrics.requests == {}
+        metrics.record_request("GET", "/", 200, 0.001)
+        assert metrics.requests[("GET", "/", 200)].count == PENDING_REQUESTS and metrics.pending == []
+        metrics.record_request("GET", "/", 404, 0.001)
+        assert 'http_requests_total{method="GET",route="/",status="404"} 1' in metrics.render()
+        assert metrics.pending == []
+
+    def test_label_values_are_escaped(self):
+        """Test quotes, backslashes and newlines in label values are escaped."""
+        from metrics import Metrics
+        metrics = Metrics()
+        metrics.observe_db_call('a"b\\c\nd', 0.001)
+        assert 'operation="a\\"b\\\\c\\nd"' in metrics.render()
+
+    def test_disabled(self, db, monkeypatch):
+        """Test API_METRICS=0 adds no middleware, times no storage calls and hides /metrics."""
+        from fastapi.testclient import TestClient
+        import config
+        import main
+        monkeypatch.setattr(config, "METRICS", False)
+        with TestClient(main.create_app(db)) as client:
+            assert client.get("/products/1").status_code == 200
+            assert client.get("/metrics").status_code == 404
+            assert client.app.state.metrics is None and client.app.state.async_db.metrics is None
+
+
+class TestProfiling:
+    """Tests for the admin profiling endpoints and request traces."""
+
+    TOKEN = "admin-secret"
+
+    @pytest.fixture
+    def admin_client(self, db, monkeypatch):
+        """A client for an app with an admin token configured."""
+        from fastapi.testclient import TestClient
+        import config
+        import main
+        monkeypatch.setattr(config, "ADMIN_TOKEN", self.TOKEN)
+        with TestClient(main.create_app(db)) as client:
+            yield client
+
+    @staticmethod
+    def parse_collapsed(text: str) -> dict:
+        """Weight of each stack, checking each starts with a phase."""
+        from profiling import PHASES
+        stacks = {}
+        for line in text.splitlines():
+            stack, weight = line.rsplit(" ", 1)
+            assert stack.split(";")[0] in PHASES
+            stacks[stack] = int(weight)
+        return stacks
+
+    @staticmethod
+    def phase_ms(server_timing: str) -> dict:
+        return {part.split(";dur=")[0]: float(part.split(";dur=")[1]) for part in server_timing.split(", ")}
+
+    def test_disabled_without_admin_token(self, client):
+        """Test there are no admin endpoints or traces unless an admin token is configured."""
+        assert client.post("/admin/profile", params={"seconds": 0.01}).status_code == 404
+        assert client.get("/admin/profile/traces/1").status_code == 404
+        response = client.get("/products", headers={"X-Profile": "trace", "X-Admin-Token": self.TOKEN})
+        assert response.status_code == 200
+        assert "server-timing" not in response.headers
+
+    def test_admin_token_required(self, admin_client):
+        """Test admin endpoints reject a missing or wrong token, and untrusted trace requests are not traced."""
+        assert admin_client.post("/admin/profile", params={"seconds": 0.01}).status_code == 403
+        response = admin_client.get("/admin/profile/traces/1", headers={"X-Admin-Token": "wrong"})
+        assert response.status_code == 403
+        response = admin_client.get("/products", headers={"X-Profile": "trace", "X-Admin-Token": "wrong"})
+        assert response.status_code == 200
+        assert "x-profile-trace" not in response.headers
+
+    def test_trace_request(self, admin_client):
+        """Test a traced request reports time per phase and leaves a flamegraph-ready trace."""
+        admin_client.app.state.response_cache.max_entries = 0
+        response = admin_client.get("/products", params={"limit": 2},
+                                    headers={"X-Profile": "trace", "X-Admin-Token": self.TOKEN})
+        assert response.status_code == 200
+        assert len(response.json()) == 2
+        phases = self.phase_ms(response.headers["server-timing"])
+        assert {"handler", "db", "validation", "serialization"} <= set(phases)
+        assert phases["db"] > 0 and phases["validation"] > 0 and phases["serialization"] > 0
+
+        trace = admin_client.get(f"/admin/profile/traces/{response.headers['x-profile-trace']}",
+                                 headers={"X-Admin-Token": self.TOKEN})
+        assert trace.status_code == 200
+        stacks = self.parse_collapsed(trace.text)
+        db_stacks = [stack for stack in stacks if stack.startswith("db;")]
+        assert db_stacks and all("main:get_products" in stack for stack in db_stacks)
+        assert any(stack.startswith("serialization;") and "serialization:" in stack for stack in stacks)
+        assert any(stack.startswith("validation;") and "solve_dependencies" in stack for stack in stacks)
+
+    def test_unknown_trace(self, admin_client):
+        """Test fetching a trace that was never taken."""
+        response = admin_client.get("/admin/profile/traces/99", headers={"X-Admin-Token": self.TOKEN})
+        assert response.status_code == 404
+
+    def test_sampling_session(self, admin_client):
+        """Test a sampling session returns collapsed stacks, one session at a time."""
+        profiler = admin_client.app.state.profiler
+        headers = {"X-Admin-Token": self.TOKEN}
+        response = admin_client.post("/admin/profile", params={"seconds": 0.2, "interval_ms": 5}, headers=headers)
+        assert response.status_code == 200
+        assert sum(self.parse_collapsed(response.text).values()) > 0
+        assert "server-timing" in response.headers
+        profiler.sampling = True
+        assert admin_client.post("/admin/profile", params={"seconds": 0.01}, headers=headers).status_code == 409
+        profiler.sampling = False
+        assert admin_client.post("/admin/profile", params={"seconds": 120}, headers=headers).status_code == 422
+
+    def test_signal_sampler_on_main_thread(self):
+        """Test the main thread is sampled on SIGPROF where it is using CPU."""
+        import signal
+        import time
+        from profiling import Sampler
+
+        def busy_loop(seconds):
+            end = time.process_time() + seconds
+            while time.process_time() < end:
+                pass
+
+        previous = signal.getsignal(signal.SIGPROF)
+        sampler = Sampler(0.005)
+        sampler.start()
+        busy_loop(0.2)
+        profile = sampler.stop()
+        assert signal.getsignal(signal.SIGPROF) == previous
+        assert sampler.samples > 0
+        assert any("test_signal_sampler_on_main_thread.<locals>.busy_loop" in stack[-1]
+                   for stack in profile.stacks)
+
+    def test_classify(self):
+        """Test phase rules match modules, qualified names and class prefixes."""
+        from profiling import classify
+        assert classify("database", "InMemoryDatabase.find_products") == "db"
+        assert classify("fastapi._compat", "ModelField.validate") == "validation"
+        assert classify("pydantic_core._pydantic_core", "SchemaSerializer.to_json") == "serialization"
+        assert classify("main", "get_products") == "handler"
+        assert classify("databases", "anything") is None
+        assert classify("starlette.routing", "Router.__call__") is None
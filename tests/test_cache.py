@@ -0,0 +1,54 @@
+"""Tests for the serialized response cache."""
+from cache import CachedResponse, ResponseCache
+
+
+def entry(body: bytes) -> CachedResponse:
+    return CachedResponse(body, {})
+
+
+class TestResponseCache:
+    """Test lookups, version checks and eviction."""
+
+    def test_hit_and_miss_are_counted(self):
+        """Test a stored entry is returned and both outcomes are counted."""
+        cache = ResponseCache()
+        assert cache.get("/a", 1) is None
+        cache.put("/a", 1, entry(b"[]"))
+        assert cache.get("/a", 1).body == b"[]"
+        assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0, "entries": 1, "bytes": 2}
+
+    def test_other_version_is_a_miss(self):
+        """Test an entry built from another version is never returned."""
+        cache = ResponseCache()
+        cache.put("/a", 1, entry(b"old"))
+        assert cache.get("/a", 2) is None
+        cache.put("/a", 2, entry(b"new!"))
+        assert cache.get("/a", 2).body == b"new!"
+        assert cache.stats()["bytes"] == 4
+
+    def test_evicts_least_recently_used(self):
+        """Test the entry count bound evicts the entry read longest ago."""
+        cache = ResponseCache(max_entries=2)
+        cache.put("/a", 1, entry(b"a"))
+        cache.put("/b", 1, entry(b"b"))
+        cache.get("/a", 1)
+        cache.put("/c", 1, entry(b"c"))
+        assert cache.get("/b", 1) is None
+        assert cache.get("/a", 1) is not None
+        assert cache.stats()["evictions"] == 1
+
+    def test_byte_bound(self):
+        """Test total body size stays within max_bytes and oversized bodies are not stored."""
+        cache = ResponseCache(max_bytes=10)
+        cache.put("/a", 1, entry(b"x" * 6))
+        cache.put("/b", 1, entry(b"x" * 6))
+        assert cache.get("/a", 1) is None
+        cache.put("/big", 1, entry(b"x" * 11))
+        assert cache.get("/big", 1) is None
+        assert cache.stats()["bytes"] == 6
+
+    def test_zero_entries_disables_cache(self):
+        """Test max_entries=0 stores nothing."""
+        cache = ResponseCache(max_entries=0)
+        cache.put("/a", 1, entry(b"a"))
+        assert cache.get("/a", 1) is None
@@ -0,0 +1,147 @@
+"""Tests for the change log and its async subscribers."""
+import asyncio
+import json
+import threading
+
+import pytest
+
+from changes import ChangeLog, ChangeNotifier
+from storage import SequenceExpiredError
+
+
+class TestChangeLog:
+    """Test sequence numbers, retention and resuming."""
+
+    def test_numbers_changes_in_order(self):
+        """Test appends get consecutive sequence numbers from 1."""
+        log = ChangeLog()
+        assert log.append("insert", "products", 7, {"id": 7}) == 1
+        assert log.append("delete", "products", 7) == 2
+        events = log.since(0)
+        assert [(e.seq, e.op, e.id) for e in events] == [(1, "insert", 7), (2, "delete", 7)]
+        assert json.loads(events[1].json()) == {
+            "epoch": log.epoch, "seq": 2, "table": "products", "op": "delete", "id": 7, "row": None,
+        }
+        assert ChangeLog().epoch != log.epoch
+
+    def test_since_and_limit(self):
+        """Test reading resumes after a sequence number and stops at the limit."""
+        log = ChangeLog()
+        for row_id in range(5):
+            log.append("insert", "users", row_id)
+        assert [e.seq for e in log.since(2)] == [3, 4, 5]
+        assert [e.seq for e in log.since(2, limit=2)] == [3, 4]
+        assert log.since(5) == []
+
+    def test_wraps_around(self):
+        """Test the log keeps its last `capacity` changes."""
+        log = ChangeLog(capacity=4)
+        for row_id in range(10):
+            log.append("insert", "users", row_id)
+        assert [e.seq for e in log.since(6)] == [7, 8, 9, 10]
+        with pytest.raises(SequenceExpiredError) as info:
+            log.since(5)
+        assert info.value.seq == 5
+
+    def test_sequence_ahead_of_log_expired(self):
+        """Test a sequence number the log never issued, as after a restart, is expired."""
+        log = ChangeLog()
+        log.append("insert", "users", 1)
+        with pytest.raises(SequenceExpiredError):
+            log.since(2)
+
+    def test_mirror_takes_given_sequence_numbers(self):
+        """Test a mirror keeps its shared feed's epoch and numbers, and a skipped range has expired."""
+        log = ChangeLog(epoch="0000beef")
+        assert log.append("insert", "users", 1, seq=5) == 5
+        assert log.append("insert", "users", 2, seq=6) == 6
+        assert [(e.epoch, e.seq) for e in log.since(4)] == [("0000beef", 5), ("0000beef", 6)]
+        with pytest.raises(SequenceExpiredError):
+            log.since(3)
+        log.append("delete", "users", 1, seq=9)
+        assert [e.seq for e in log.since(8)] == [9]
+        with pytest.raises(SequenceExpiredError):
+            log.since(6)
+
+    def test_listeners_called_after_append(self):
+        """Test listeners see the new change already readable."""
+        log = ChangeLog()
+        seen = []
+        listener = lambda: seen.append(log.last_seq)
+        log.add_listener(listener)
+        log.append("insert", "users", 1)
+        log.remove_listener(listener)
+        log.append("insert", "users", 2)
+        assert seen == [1]
+
+
+class TestChangeNotifier:
+    """Test subscribers follow the log across threads."""
+
+    def test_follow_from_writer_thread(self):
+        """Test changes appended on another thread reach every subscriber, filtered by table."""
+        log = ChangeLog()
+
+        async def run():
+            notifier = ChangeNotifier(log, asyncio.get_running_loop())
+
+            async def collect(tables, count):
+                seqs = []
+                async for events in notifier.follow(0, tables):
+                    seqs.extend(event.seq for event in events)
+                    if len(seqs) >= count:
+                        return seqs
+
+            subscribers = [collect(None, 4), collect({"users"}, 2)]
+            tasks = [asyncio.ensure_future(subscriber) for subscriber in subscribers]
+            await asyncio.sleep(0)
+
+            def write():
+                for table in ("users", "products", "users", "products"):
+                    log.append("insert", table, 1)
+
+            writer = threading.Thread(target=write)
+            writer.start()
+            results = await asyncio.wait_for(asyncio.gather(*tasks), 5)
+            writer.join()
+            notifier.close()
+            return results
+
+        assert asyncio.run(run()) == [[1, 2, 3, 4], [1, 3]]
+
+    def test_idle_timeout_yields_empty_batch(self):
+        """Test an idle subscriber gets an empty batch for keep-alives."""
+        log = ChangeLog()
+
+        async def run():
+            notifier = ChangeNotifier(log, asyncio.get_running_loop())
+            follow = notifier.follow(0, idle_timeout=0.01)
+            first = await follow.__anext__()
+            log.append("insert", "users", 1)
+            second = await follow.__anext__()
+            await follow.aclose()
+            return first, [event.seq for event in second]
+
+        assert asyncio.run(run()) == ([], [1])
+
+    def test_slow_subscriber_expires(self):
+        """Test a subscriber that falls behind the log's capacity is told to resynchronize."""
+        log = ChangeLog(capacity=4)
+
+        async def run():
+            notifier = ChangeNotifier(log, asyncio.get_running_loop())
+            for row_id in range(10):
+                log.append("insert", "users", row_id)
+            with pytest.raises(SequenceExpiredError):
+                async for _ in notifier.follow(0):
+                    pass
+
+        asyncio.run(run())
+
+    def test_append_after_loop_closed(self):
+        """Test writers are unaffected by a notifier whose loop has closed."""
+        log = ChangeLog()
+        loop = asyncio.new_event_loop()
+        ChangeNotifier(log, loop)
+        loop.close()
+        assert log.append("insert", "users", 1) == 1
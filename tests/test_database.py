@@ -0,0 +1,987 @@
+"""Unit tests for storage engine behaviour."""
+import asyncio
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import config
+from async_database import AsyncDatabase
+import database
+from columnar import ColumnarProductTable
+from database import InMemoryDatabase
+from indexes import OrderedIdIndex
+from mapped import MappedSnapshot, OverlayTable, write_mapped
+from metrics import Metrics
+from models import (
+    ProductBatchUpdate, ProductCreate, ProductUpdate, SettingCreate, SettingUpdate, UserBatchUpdate, UserCreate,
+    UserUpdate,
+)
+from persistence import SNAPSHOT_FILE, WAL_FILE
+from sqlite_backend import SQLiteDatabase
+from storage import DuplicateKeyError, NotFoundError, SequenceExpiredError, VersionConflictError
+
+
+def make_product(name: str, **fields) -> ProductCreate:
+    """Build a ProductCreate with defaults for the required fields."""
+    data = {"name": name, "description": f"{name} description", "price": 10.0, "category": "Test"}
+    data.update(fields)
+    return ProductCreate(**data)
+
+
+class TestDurability:
+    """Tests for the write-ahead log and snapshot recovery."""
+
+    def test_fresh_directory_seeds_sample_data(self, tmp_path):
+        """Test a new data directory starts with the sample products, logged."""
+        db = InMemoryDatabase(data_dir=str(tmp_path))
+        db.close()
+        assert len(db.products) == 3
+        assert os.path.getsize(tmp_path / WAL_FILE) > 0
+
+    def test_recover_from_log(self, tmp_path):
+        """Test creates, updates and deletes survive a restart."""
+        db = InMemoryDatabase(data_dir=str(tmp_path), fsync="always")
+        created = db.create_product(make_product("Durable", tags=["keep"]))
+        db.update_product(1, ProductUpdate(price=1.0, tags=["cheap"]))
+        db.delete_product(2)
+        db.create_user(UserCreate(name="Ann", email="ann@example.com", password="pass"))
+        db.create_setting(SettingCreate(key="theme", value="dark"))
+        db.close()
+
+        recovered = InMemoryDatabase(data_dir=str(tmp_path))
+        assert sorted(recovered.products) == [1, 3, created.id]
+        assert recovered.get_product(1).price == 1.0
+        assert recovered.get_product(1).version == 2
+        assert recovered.get_product(created.id).created_at == created.created_at
+        assert recovered.get_user_by_email("ann@example.com").name == "Ann"
+        assert recovered.get_setting_by_key("theme").value == "dark"
+        # Indexes are rebuilt too
+        assert [p.id for p in recovered.find_products(tags=["cheap"])[0]] == [1]
+        assert [p.id for p in recovered.search_products("durable")] == [created.id]
+        recovered.close()
+
+    def test_ids_are_not_reused_after_restart(self, tmp_path):
+        """Test the next id continues after the largest id ever logged."""
+        db = InMemoryDatabase(data_dir=str(tmp_path))
+        last = db.create_product(make_product("Last"))
+        db.delete_product(last.id)
+        db.close()
+
+        recovered = InMemoryDatabase(data_dir=str(tmp_path))
+        assert recovered.create_product(make_product("Next")).id == last.id + 1
+        recovered.close()
+
+    def test_snapshot_truncates_log(self, tmp_path):
+        """Test a snapshot is written every snapshot_every records and the log is truncated."""
+        db = InMemoryDatabase(data_dir=str(tmp_path), snapshot_every=5)
+        for i in range(6):
+            db.create_product(make_product(f"Row {i}"))
+        db.close()
+
+        assert (tmp_path / SNAPSHOT_FILE).exists()
+        with open(tmp_path / WAL_FILE) as f:
+            assert len(f.readlines()) == 4
+
+    def test_recover_from_snapshot_and_log_tail(self, tmp_path):
+        """Test recovery combines the snapshot with the records logged after it."""
+        db = InMemoryDatabase(data_dir=str(tmp_path), snapshot_every=5)
+        for i in range(6):
+            db.create_product(make_product(f"Row {i}"))
+        db.delete_product(4)
+        db.close()
+
+        recovered = InMemoryDatabase(data_dir=str(tmp_path), snapshot_every=5)
+        assert sorted(recovered.products) == sorted(db.products)
+        assert recovered.next_id == db.next_id
+        recovered.close()
+
+    def test_torn_last_record_is_ignored(self, tmp_path):
+        """Test a partially written final log record does not stop recovery."""
+        db = InMemoryDatabase(data_dir=str(tmp_path))
+        db.create_product(make_product("Whole"))
+        db.close()
+        with open(tmp_path / WAL_FILE, "a") as f:
+            f.write('{"lsn": 99, "op": "ins')
+
+        recovered = InMemoryDatabase(data_dir=str(tmp_path))
+        assert len(recovered.products) == 4
+        recovered.close()
+
+    def test_torn_batch_is_not_half_recovered(self, tmp_path):
+        """Test a bulk create cut short by a crash is recovered whole or not at all."""
+        db = InMemoryDatabase(data_dir=str(tmp_path))
+        db.create_products([make_product(f"Bulk {i}") for i in range(50)])
+        db.close()
+        with open(tmp_path / WAL_FILE) as f:
+            lines = f.readlines()
+        assert len(lines) == 4
+        with open(tmp_path / WAL_FILE, "w") as f:
+            f.writelines(lines[:-1])
+            f.write(lines[-1][:len(lines[-1]) // 2])
+
+        recovered = InMemoryDatabase(data_dir=str(tmp_path))
+        assert sorted(recovered.products) == [1, 2, 3]
+        recovered.close()
+
+    def test_tombstones_keep_delete_time_after_restart(self, tmp_path):
+        """Test replayed deletes keep their tombstone's time and sequence number."""
+        db = InMemoryDatabase(data_dir=str(tmp_path), tombstone_retention=3600)
+        db.delete_product(1)
+        tombstone = db.product_tombstones[1]
+        db.close()
+        # Age the logged tombstone past the retention window
+        deleted_at = tombstone.deleted_at - timedelta(hours=2)
+        with open(tmp_path / WAL_FILE) as f:
+            lines = f.read().replace(tombstone.deleted_at.isoformat(), deleted_at.isoformat())
+        with open(tmp_path / WAL_FILE, "w") as f:
+            f.write(lines)
+
+        recovered = InMemoryDatabase(data_dir=str(tmp_path), tombstone_retention=3600)
+        assert recovered.product_tombstones[1].deleted_at == deleted_at
+        assert recovered.product_tombstones[1].seq == tombstone.seq
+        # The next delete purges it, as it would have without the restart
+        recovered.delete_product(2)
+        assert sorted(recovered.product_tombstones) == [2]
+        assert recovered.tombstone_horizon == tombstone.seq
+        recovered.close()
+
+    @pytest.mark.parametrize("rotation", [[1, 0], [1, 2, 0]], ids=["swap", "rotation"])
+    def test_email_swap_is_recovered(self, tmp_path, rotation):
+        """Test a bulk update that swaps or rotates emails keeps every email's owner after a restart."""
+        emails = [f"user{i}@example.com" for i in range(len(rotation))]
+        db = InMemoryDatabase(data_dir=str(tmp_path))
+        users = db.create_users([UserCreate(name=f"User {i}", email=email, password="secret123")
+                                 for i, email in enumerate(emails)])
+        db.update_users([UserBatchUpdate(id=user.id, email=emails[target]) for user, target in zip(users, rotation)])
+        db.close()
+
+        recovered = InMemoryDatabase(data_dir=str(tmp_path))
+        expected = {emails[target]: user.id for user, target in zip(users, rotation)}
+        assert recovered.users_by_email == expected
+        for email, user_id in expected.items():
+            assert recovered.get_user_by_email(email).id == user_id
+        with pytest.raises(DuplicateKeyError):
+            recovered.create_user(UserCreate(name="Late", email=emails[0], password="secret123"))
+        recovered.close()
+
+    def test_bulk_email_swap_is_logged(self, tmp_path):
+        """Test bulk user updates are replayed."""
+        db = InMemoryDatabase(data_dir=str(tmp_path))
+        a = db.create_user(UserCreate(name="A", email="a@example.com", password="pass"))
+        b = db.create_user(UserCreate(name="B", email="b@example.com", password="pass"))
+        db.update_users([UserBatchUpdate(id=a.id, email="b@example.com"), UserBatchUpdate(id=b.id, email="a@example.com")])
+        db.close()
+
+        recovered = InMemoryDatabase(data_dir=str(tmp_path))
+        assert recovered.get_user_by_email("a@example.com").id == b.id
+        recovered.close()
+
+    @pytest.mark.parametrize("fsync", ["always", "batch", "never"])
+    def test_fsync_policies(self, tmp_path, fsync):
+        """Test every fsync policy writes a readable log."""
+        db = InMemoryDatabase(data_dir=str(tmp_path), fsync=fsync)
+        db.close()
+        with open(tmp_path / WAL_FILE) as f:
+            assert [json.loads(line)["lsn"] for line in f] == [1, 2, 3]
+
+    def test_unknown_fsync_policy(self, tmp_path):
+        """Test an unknown fsync policy is rejected."""
+        with pytest.raises(ValueError):
+            InMemoryDatabase(data_dir=str(tmp_path), fsync="sometimes")
+
+
+def update_in_child_process(path: str):
+    """Open a SQLite database file as another worker would and update a product."""
+    db = SQLiteDatabase(path)
+    db.update_product(1, ProductUpdate(price=1.0))
+    db.close()
+
+
+class TestSQLiteDatabase:
+    """Tests for the SQLite storage engine."""
+
+    def test_data_survives_reopen(self, tmp_path):
+        """Test rows are read back from the file and sample data is only added once."""
+        path = str(tmp_path / "app.sqlite3")
+        db = SQLiteDatabase(path)
+        created = db.create_product(make_product("Stored", tags=["keep"]))
+        db.delete_product(2)
+        db.close()
+
+        reopened = SQLiteDatabase(path)
+        assert [p.id for p in reopened.get_all_products()] == [1, 3, created.id]
+        assert reopened.get_product(created.id) == created
+        assert [p.id for p in reopened.find_products(tags=["keep"])[0]] == [created.id]
+        reopened.close()
+
+    def test_adds_version_column_to_old_files(self, tmp_path):
+        """Test a file created before rows had versions is migrated on open."""
+        path = str(tmp_path / "app.sqlite3")
+        db = SQLiteDatabase(path)
+        with db.pool.connection() as conn:
+            for table in ("products", "users", "settings"):
+                conn.execute(f"ALTER TABLE {table} DROP COLUMN version")
+        db.close()
+
+        reopened = SQLiteDatabase(path)
+        assert reopened.get_product(1).version == 1
+        assert reopened.update_product(1, ProductUpdate(price=1.0)).version == 2
+        reopened.close()
+
+    def test_ids_are_not_reused(self, tmp_path):
+        """Test a deleted last id is not handed out again."""
+        db = SQLiteDatabase(str(tmp_path / "app.sqlite3"))
+        last = db.create_product(make_product("Last"))
+        db.delete_product(last.id)
+        assert db.create_products([make_product("Next")])[0].id == last.id + 1
+        db.close()
+
+    def test_wal_mode_and_indexes(self, tmp_path):
+        """Test the database runs in WAL mode with the lookup indexes in place."""
+        db = SQLiteDatabase(str(tmp_path / "app.sqlite3"))
+        with db.pool.connection() as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            plan = conn.execute("EXPLAIN QUERY PLAN SELECT id FROM products WHERE category = 'x'").fetchall()
+            assert "products_category" in str(plan)
+            plan = conn.execute("EXPLAIN QUERY PLAN SELECT id FROM users WHERE email = 'x'").fetchall()
+            assert "INDEX" in str(plan)
+        db.close()
+
+    def test_failed_batch_is_rolled_back(self, tmp_path):
+        """Test a batch that breaks a unique key leaves no rows behind."""
+        db = SQLiteDatabase(str(tmp_path / "app.sqlite3"))
+        db.create_setting(SettingCreate(key="theme", value="dark"))
+        with pytest.raises(DuplicateKeyError):
+            db.create_settings([SettingCreate(key="lang", value="en"), SettingCreate(key="theme", value="light")])
+        assert [s.key for s in db.get_all_settings()] == ["theme"]
+        db.close()
+
+    def test_concurrent_writers_and_readers(self, tmp_path):
+        """Test threads sharing the connection pool all see consistent results."""
+        db = SQLiteDatabase(str(tmp_path / "app.sqlite3"), pool_size=4)
+        errors = []
+
+        def work(worker: int):
+            try:
+                for i in range(20):
+                    product = db.create_product(make_product(f"W{worker}-{i}", category=f"C{worker}"))
+                    assert db.get_product(product.id).name == product.name
+            except Exception as exc:  # pragma: no cover - reported below
+                errors.append(exc)
+
+        threads = [threading.Thread(target=work, args=(worker,)) for worker in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        assert len(db.get_all_products()) == 3 + 8 * 20
+        assert len(db.find_products(category="C0")[0]) == 20
+        db.close()
+
+    def test_processes_share_collection_versions(self, tmp_path):
+        """Test a write from another process bumps this process's collection counter."""
+        import multiprocessing
+        path = str(tmp_path / "app.sqlite3")
+        db = SQLiteDatabase(path)
+        before = db.collection_version("products")
+        worker = multiprocessing.get_context("spawn").Process(target=update_in_child_process, args=(path,))
+        worker.start()
+        worker.join()
+        assert worker.exitcode == 0
+        assert db.collection_version("products") == before + 1
+        assert db.collection_version("users") == 0
+        assert db.get_product(1).price == 1.0
+        db.close()
+
+    def test_backend_selected_by_config(self, tmp_path, monkeypatch):
+        """Test create_database builds the configured engine."""
+        monkeypatch.setattr(config, "BACKEND", "sqlite")
+        monkeypatch.setattr(config, "SQLITE_PATH", str(tmp_path / "app.sqlite3"))
+        db = database.create_database()
+        assert isinstance(db, SQLiteDatabase)
+        db.close()
+
+        monkeypatch.setattr(config, "BACKEND", "postgres")
+        with pytest.raises(ValueError):
+            database.create_database()
+
+    def test_sample_data_is_opt_in(self, tmp_path, monkeypatch):
+        """Test the configured database starts empty unless DB_SAMPLE_DATA is set."""
+        assert database.create_database().get_all_products() == []
+        monkeypatch.setattr(config, "SAMPLE_DATA", True)
+        assert len(database.create_database().get_all_products()) == 3
+        monkeypatch.setattr(config, "BACKEND", "sqlite")
+        monkeypatch.setattr(config, "SQLITE_PATH", str(tmp_path / "app.sqlite3"))
+        db = database.create_database()
+        assert len(db.get_all_products()) == 3
+        db.close()
+
+
+class TestAsyncDatabase:
+    """Tests for the async wrapper around storage backends."""
+
+    def test_in_memory_calls_run_on_the_event_loop(self):
+        """Test an in-memory backend needs no executor."""
+        async_db = AsyncDatabase(InMemoryDatabase())
+        assert async_db.executor is None
+
+        async def scenario():
+            product = await async_db.create_product(make_product("Async"))
+            return await async_db.get_product(product.id)
+
+        assert asyncio.run(scenario()).name == "Async"
+
+    def test_blocking_calls_run_in_sized_executor(self, tmp_path):
+        """Test SQLite calls run in an executor with one thread per pooled connection."""
+        async_db = AsyncDatabase(SQLiteDatabase(str(tmp_path / "app.sqlite3"), pool_size=3))
+        assert async_db.executor._max_workers == 3
+
+        async def scenario():
+            thread_name = await async_db.run(lambda: threading.current_thread().name)
+            products = await asyncio.gather(*(async_db.create_product(make_product(f"P{i}")) for i in range(20)))
+            await async_db.close()
+            return thread_name, products
+
+        thread_name, products = asyncio.run(scenario())
+        assert thread_name.startswith("db")
+        assert sorted(p.id for p in products) == list(range(4, 24))
+        assert async_db.executor is None
+
+    def test_executor_calls_are_timed_with_metrics(self, tmp_path):
+        """Test calls handed to the executor record their latency by operation, and inline calls do not."""
+        metrics = Metrics()
+        async_db = AsyncDatabase(SQLiteDatabase(str(tmp_path / "app.sqlite3")), metrics)
+        inline_db = AsyncDatabase(InMemoryDatabase(), metrics)
+
+        async def scenario():
+            await async_db.get_product(1)
+            await async_db.get_product(2)
+            await async_db.row_counts()
+            await inline_db.get_product(1)
+            await async_db.close()
+
+        asyncio.run(scenario())
+        assert {name: h.count for name, h in metrics.db_calls.items()} == {"get_product": 2, "row_counts": 1}
+        assert AsyncDatabase(InMemoryDatabase()).metrics is None
+
+    def test_durable_in_memory_uses_executor(self, tmp_path):
+        """Test a logged in-memory backend offloads calls to its executor."""
+        async_db = AsyncDatabase(InMemoryDatabase(data_dir=str(tmp_path)))
+        assert async_db.executor._max_workers == InMemoryDatabase.DURABLE_EXECUTOR_WORKERS
+        asyncio.run(async_db.close())
+
+
+class TestConcurrency:
+    """Stress tests for InMemoryDatabase under many threads."""
+
+    WRITERS = 64
+    ROUNDS = 30
+
+    def run_threads(self, targets):
+        """Run the callables in parallel threads, re-raising the first error."""
+        errors = []
+
+        def guarded(target):
+            try:
+                target()
+            except Exception as exc:  # pragma: no cover - reported below
+                errors.append(exc)
+
+        threads = [threading.Thread(target=guarded, args=(target,)) for target in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def test_concurrent_writers_keep_invariants(self, tmp_path):
+        """Test 64 writers plus readers never corrupt ids, indexes or rows."""
+        db = InMemoryDatabase(data_dir=str(tmp_path), snapshot_every=500)
+        created = [[] for _ in range(self.WRITERS)]
+        stop = threading.Event()
+
+        def writer(worker: int):
+            def run():
+                for i in range(self.ROUNDS):
+                    product = db.create_product(make_product(f"w{worker} {i}", description=f"w{worker} {i}",
+                                                             category=f"C{worker % 4}", tags=[f"t{i % 3}"]))
+                    created[worker].append(product.id)
+                    batch = db.create_products([make_product(f"b{worker} {i}", category="Batch")] * 2)
+                    created[worker].extend(p.id for p in batch)
+                    # Name and description always change together
+                    db.update_products([ProductBatchUpdate(id=product.id, name=f"u{worker} {i}",
+                                                           description=f"u{worker} {i}", category="Updated")])
+                    db.delete_product(batch[0].id)
+                    try:
+                        user = db.create_user(UserCreate(name="U", email=f"shared{i}@example.com", password="p"))
+                        db.update_user(user.id, UserUpdate(name="Renamed"))
+                    except DuplicateKeyError:
+                        pass
+            return run
+
+        reader_errors = []
+
+        def reader():
+            try:
+                while not stop.is_set():
+                    for product in db.get_all_products():
+                        if product.category.startswith("C") or product.category == "Updated":
+                            assert product.name == product.description
+                    page, _ = db.find_products(category="Updated", limit=20)
+                    assert all(p.category == "Updated" for p in page)
+                    db.search_products("w1")
+            except Exception as exc:  # pragma: no cover - reported below
+                reader_errors.append(exc)
+
+        readers = [threading.Thread(target=reader) for _ in range(4)]
+        for thread in readers:
+            thread.start()
+        try:
+            self.run_threads([writer(worker) for worker in range(self.WRITERS)])
+        finally:
+            stop.set()
+            for thread in readers:
+                thread.join()
+        if reader_errors:
+            raise reader_errors[0]
+
+        # Every allocated id is unique and batches got contiguous blocks
+        all_ids = [product_id for ids in created for product_id in ids]
+        assert len(all_ids) == len(set(all_ids)) == self.WRITERS * self.ROUNDS * 3
+        for ids in created:
+            for i in range(self.ROUNDS):
+                assert ids[3 * i + 2] == ids[3 * i + 1] + 1
+        assert db.next_id == max(all_ids) + 1
+
+        # Rows and secondary indexes agree
+        expected = 3 + self.WRITERS * self.ROUNDS * 2
+        assert len(db.products) == expected
+        assert sum(len(ids) for ids in db.products_by_category.values()) == expected
+        assert len(db.products_by_category["Updated"]) == self.WRITERS * self.ROUNDS
+        assert len(db.products_by_price) == expected
+        assert len(db.product_search) == expected
+        assert [p.id for p in db.get_products_page(limit=expected + 1)[0]] == sorted(db.products)
+        # Exactly one writer won each contested email
+        assert sorted(db.users_by_email) == sorted(f"shared{i}@example.com" for i in range(self.ROUNDS))
+        assert all(user.name == "Renamed" for user in db.get_all_users())
+        db.close()
+
+        recovered = InMemoryDatabase(data_dir=str(tmp_path))
+        assert recovered.get_all_products() == db.get_all_products()
+        recovered.close()
+
+    def test_readers_never_see_partial_updates(self):
+        """Test a product fetched before an update is left untouched by it."""
+        db = InMemoryDatabase()
+        before = db.get_product(1)
+        after = db.update_product(1, ProductUpdate(name="Changed", price=1.0))
+        assert before.name == "Wireless Headphones" and before.price == 199.99
+        assert after.name == "Changed" and db.get_product(1) is after
+
+
+class TestColumnarStore:
+    """Test the columnar products table behind the InMemoryDatabase API."""
+
+    def test_rows_round_trip(self):
+        """Test every field reads back as it was stored."""
+        db = InMemoryDatabase(product_store="columnar")
+        assert isinstance(db.products, ColumnarProductTable)
+        created = db.create_product(make_product("Lamp", tags=["home", "light"], in_stock=False, price=12.5))
+        assert db.get_product(created.id) == created
+        assert db.get_all_products()[-1] == created
+        assert db.get_product(999) is None and 999 not in db.products
+
+    def test_aware_created_at_is_stored_as_utc(self):
+        """Test timezone-aware creation times come back as naive UTC."""
+        table = ColumnarProductTable()
+        created_at = datetime(2024, 5, 1, 12, 0, 0, 123456, tzinfo=timezone(timedelta(hours=2)))
+        table[1] = InMemoryDatabase().get_product(1).model_copy(update={"created_at": created_at})
+        assert table[1].created_at == datetime(2024, 5, 1, 10, 0, 0, 123456)
+
+    def test_dictionary_codes_are_freed(self):
+        """Test categories and tag lists no row uses any more are dropped."""
+        db = InMemoryDatabase(product_store="columnar")
+        product = db.create_product(make_product("Lamp", category="Lighting", tags=["lamp"]))
+        assert len(db.products.category_codes) == 4
+        db.update_product(product.id, ProductUpdate(category="Home"))
+        assert "Lighting" not in db.products.category_codes.codes
+        db.delete_product(product.id)
+        assert "Home" not in db.products.category_codes.codes
+        assert ("lamp",) not in db.products.tag_list_codes.codes
+        assert len(db.products) == 3
+
+    def test_recovers_from_log(self, tmp_path):
+        """Test a columnar database recovers the rows written by a durable one."""
+        db = InMemoryDatabase(data_dir=str(tmp_path))
+        db.update_product(1, ProductUpdate(tags=["sale"]))
+        db.delete_product(2)
+        db.close()
+        recovered = InMemoryDatabase(data_dir=str(tmp_path), product_store="columnar")
+        assert recovered.get_all_products() == db.get_all_products()
+        recovered.close()
+
+    def test_point_reads_never_see_partial_updates(self):
+        """Test lock-free reads of a row being updated in place see whole versions."""
+        db = InMemoryDatabase(product_store="columnar")
+        stop = threading.Event()
+        errors = []
+
+        def reader():
+            try:
+                while not stop.is_set():
+                    product = db.get_product(1)
+                    if product.version > 1:
+                        assert product.name == product.description == str(product.version)
+            except Exception as exc:  # pragma: no cover - reported below
+                errors.append(exc)
+
+        readers = [threading.Thread(target=reader) for _ in range(4)]
+        for thread in readers:
+            thread.start()
+        for version in range(2, 3000):
+            db.update_product(1, ProductUpdate(name=str(version), description=str(version)))
+        stop.set()
+        for thread in readers:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def test_unknown_product_store(self):
+        """Test an unknown product store is rejected."""
+        with pytest.raises(ValueError):
+            InMemoryDatabase(product_store="parquet")
+
+
+class TestProductStats:
+    """Test price aggregates stay in sync with product writes."""
+
+    @pytest.fixture(params=["numpy", "python"])
+    def engine(self, request, monkeypatch):
+        """Run with numpy, if installed, and with the pure Python fallback."""
+        import analytics
+        if request.param == "numpy":
+            pytest.importorskip("numpy")
+        else:
+            monkeypatch.setattr(analytics, "np", None)
+
+    @pytest.mark.parametrize("product_store", ["rows", "columnar"])
+    def test_matches_recompute_after_writes(self, engine, product_store):
+        """Test every grouping equals a recompute over the stored rows after mixed writes."""
+        import random
+        rng = random.Random(3)
+        db = InMemoryDatabase(product_store=product_store)
+        products = db.create_products([
+            make_product(f"P{i}", price=rng.uniform(1, 100), category=rng.choice("ABC"),
+                         tags=rng.sample(["x", "y", "z"], rng.randint(0, 2)), in_stock=rng.random() < 0.5)
+            for i in range(300)
+        ])
+        for product in products[:100]:
+            db.update_product(product.id, ProductUpdate(price=rng.uniform(1, 100), category=rng.choice("CD")))
+        db.update_products([ProductBatchUpdate(id=product.id, in_stock=True) for product in products[100:150]])
+        db.delete_products([product.id for product in products[150:200]])
+
+        keys = {
+            None: lambda p: [None],
+            "category": lambda p: [p.category],
+            "in_stock": lambda p: [p.in_stock],
+            "tag": lambda p: set(p.tags),
+        }
+        for group_by, key in keys.items():
+            groups = {}
+            for product in db.get_all_products():
+                for group in key(product):
+                    groups.setdefault(group, []).append(product.price)
+            stats = db.product_stats(group_by)
+            assert [row.group for row in stats] == sorted(groups, key=lambda g: (g is not None, g))
+            for row in stats:
+                prices = groups[row.group]
+                assert row.count == len(prices)
+                assert row.sum == pytest.approx(sum(prices))
+                assert (row.min, row.max) == (min(prices), max(prices))
+
+
+class TestMaterializedViews:
+    """Test views maintained from write deltas match a full recompute."""
+
+    def recompute(self, db, view):
+        totals = {}
+        for product in db.get_all_products():
+            for group in view.groups(product):
+                count, total = totals.get(group, (0, 0.0))
+                totals[group] = (count + 1, total + product.price)
+        return totals
+
+    def assert_views_match(self, db):
+        for view in db.product_views.values():
+            rows = db.product_view(view.name)
+            expected = self.recompute(db, view)
+            assert [row.group for row in rows] == sorted(expected, key=lambda g: (g is not None, g))
+            for row in rows:
+                assert row.count == expected[row.group][0]
+                assert row.sum == pytest.approx(expected[row.group][1])
+
+    @pytest.mark.parametrize("product_store", ["rows", "columnar"])
+    def test_match_recompute_after_writes(self, product_store):
+        """Test every default view after creates, single and bulk updates and deletes."""
+        import random
+        rng = random.Random(5)
+        db = InMemoryDatabase(product_store=product_store)
+        products = db.create_products([
+            make_product(f"P{i}", price=rng.uniform(1, 100), category=rng.choice("ABC"),
+                         tags=rng.sample(["x", "y", "z"], rng.randint(0, 3)), in_stock=rng.random() < 0.5)
+            for i in range(200)
+        ])
+        for product in rng.sample(products, 80):
+            update = rng.choice([
+                ProductUpdate(price=rng.uniform(1, 100)),
+                ProductUpdate(category=rng.choice("CD"), tags=["y"]),
+                ProductUpdate(in_stock=False, price=1.0),
+                ProductUpdate(name="Renamed"),
+            ])
+            db.update_product(product.id, update)
+        db.update_products([ProductBatchUpdate(id=product.id, tags=[]) for product in products[:20]])
+        db.delete_products([product.id for product in products[20:60]])
+        db.delete_product(1)
+        self.assert_views_match(db)
+
+        db.delete_products(list(db.products))
+        assert all(view.totals == {} for view in db.product_views.values())
+
+    def test_register_view_computes_current_rows(self):
+        """Test a view registered after rows exist starts from them and then follows writes."""
+        from analytics import GroupTotalsView
+        db = InMemoryDatabase()
+        db.register_product_view(GroupTotalsView("cheap", ["price"], lambda p: ("cheap",) if p.price < 100 else ()))
+        assert [(row.count, row.sum) for row in db.product_view("cheap")] == [(2, pytest.approx(135.98))]
+        db.update_product(1, ProductUpdate(price=5.0))
+        self.assert_views_match(db)
+        assert db.product_view("missing") is None
+
+    def test_rebuilt_on_recovery(self, tmp_path):
+        """Test views are rebuilt by log replay after a restart."""
+        db = InMemoryDatabase(data_dir=str(tmp_path))
+        db.update_product(1, ProductUpdate(category="Garden"))
+        db.delete_product(2)
+        db.close()
+        recovered = InMemoryDatabase(data_dir=str(tmp_path))
+        assert recovered.product_view("category_totals") == db.product_view("category_totals")
+        self.assert_views_match(recovered)
+        recovered.close()
+
+
+class TestChangeFeed:
+    """Test every backend publishes its committed writes to its change log."""
+
+    @pytest.fixture(params=["memory", "sqlite"])
+    def backend(self, request, tmp_path):
+        if request.param == "sqlite":
+            db = SQLiteDatabase(str(tmp_path / "changes.sqlite3"), pool_size=1)
+        else:
+            db = InMemoryDatabase()
+        yield db
+        db.close()
+
+    def changes(self, db, since=0):
+        return [(e.op, e.table, e.id) for e in db.changes.since(since)]
+
+    def test_writes_are_published(self, backend):
+        """Test creates, updates and deletes of each table appear in commit order; seeding does not."""
+        assert backend.changes.last_seq == 0
+        user = backend.create_user(UserCreate(name="Ann", email="ann@example.com", password="pass"))
+        setting = backend.create_setting(SettingCreate(key="theme", value="dark"))
+        backend.update_product(1, ProductUpdate(price=1.0))
+        backend.update_users([UserBatchUpdate(id=user.id, name="Anna")])
+        backend.delete_setting(setting.id)
+        backend.delete_products([2, 3])
+        assert self.changes(backend) == [
+            ("insert", "users", user.id), ("insert", "settings", setting.id), ("update", "products", 1),
+            ("update", "users", user.id), ("delete", "settings", setting.id),
+            ("delete", "products", 2), ("delete", "products", 3),
+        ]
+        events = backend.changes.since(0)
+        assert events[2].row.price == 1.0 and events[2].row.version == 2
+        assert events[3].row.name == "Anna"
+        assert events[4].row is None
+
+    def test_failed_writes_are_not_published(self, backend):
+        """Test a rejected batch or conditional write publishes nothing."""
+        backend.create_user(UserCreate(name="Ann", email="ann@example.com", password="pass"))
+        last = backend.changes.last_seq
+        with pytest.raises(DuplicateKeyError):
+            backend.create_users([UserCreate(name="Bo", email="ann@example.com", password="pass")])
+        with pytest.raises(NotFoundError):
+            backend.delete_products([1, 999])
+        with pytest.raises(VersionConflictError):
+            backend.update_product(1, ProductUpdate(price=2.0), expected_versions={7})
+        assert backend.changes.last_seq == last
+
+    def test_repeated_id_in_batch(self, backend):
+        """Test each update of an id repeated in one batch carries that step's row."""
+        backend.update_products([ProductBatchUpdate(id=1, price=2.0), ProductBatchUpdate(id=1, price=3.0)])
+        assert [(e.row.price, e.row.version) for e in backend.changes.since(0)] == [(2.0, 2), (3.0, 3)]
+
+    def test_sqlite_feed_is_shared_by_processes(self, tmp_path):
+        """Test every process serving one SQLite file sees all its writes, in one order, under one epoch."""
+        path = str(tmp_path / "shared.sqlite3")
+        first, second = SQLiteDatabase(path), SQLiteDatabase(path)
+        try:
+            assert first.changes.epoch == second.changes.epoch
+            first.update_product(1, ProductUpdate(price=1.0))
+            second.delete_product(2)
+            first.create_user(UserCreate(name="Ann", email="ann@example.com", password="pass"))
+            expected = [("update", "products", 1), ("delete", "products", 2), ("insert", "users", 1)]
+            assert self.changes(first) == expected
+            deadline = time.monotonic() + 5
+            while second.changes.last_seq < 3 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert self.changes(second) == expected
+            assert [e.json() for e in second.changes.since(0)] == [e.json() for e in first.changes.since(0)]
+        finally:
+            first.close()
+            second.close()
+
+    def test_sqlite_feed_survives_restart(self, tmp_path):
+        """Test a reopened SQLite file resumes its feed: same epoch, retained changes, numbering continued."""
+        path = str(tmp_path / "restart.sqlite3")
+        db = SQLiteDatabase(path, change_log_capacity=2)
+        for price in (1.0, 2.0, 3.0):
+            db.update_product(1, ProductUpdate(price=price))
+        epoch = db.changes.epoch
+        db.close()
+        reopened = SQLiteDatabase(path, change_log_capacity=2)
+        try:
+            assert reopened.changes.epoch == epoch
+            assert [(e.seq, e.row["price"]) for e in reopened.changes.since(1)] == [(2, 2.0), (3, 3.0)]
+            with pytest.raises(SequenceExpiredError):
+                reopened.changes.since(0)
+            reopened.delete_product(1)
+            assert [e.seq for e in reopened.changes.since(3)] == [4]
+        finally:
+            reopened.close()
+
+    def test_recovery_is_not_published(self, tmp_path):
+        """Test replaying the write-ahead log starts a fresh, empty change log."""
+        db = InMemoryDatabase(data_dir=str(tmp_path))
+        db.delete_product(1)
+        db.close()
+        recovered = InMemoryDatabase(data_dir=str(tmp_path))
+        assert recovered.changes.last_seq == 0
+
+
+class TestDeltaSync:
+    """Test product changes since a modification sequence watermark."""
+
+    @pytest.fixture(params=["memory", "columnar", "sqlite"])
+    def backend(self, request, tmp_path):
+        if request.param == "sqlite":
+            db = SQLiteDatabase(str(tmp_path / "sync.sqlite3"), pool_size=1)
+        else:
+            db = InMemoryDatabase(product_store="rows" if request.param == "memory" else "columnar")
+        yield db
+        db.close()
+
+    def test_changes_since_watermark(self, backend):
+        """Test only rows written after the watermark come back, each once, with tombstones for deletes."""
+        initial = backend.product_changes(0)
+        assert [p.id for p in initial.products] == [1, 2, 3]
+        assert (initial.seq, initial.deleted, initial.more) == (3, [], False)
+
+        created = backend.create_product(make_product("New"))
+        backend.update_product(1, ProductUpdate(price=1.0))
+        backend.update_product(1, ProductUpdate(price=2.0))
+        backend.delete_product(2)
+        changes = backend.product_changes(initial.seq)
+        assert [(p.id, p.price) for p in changes.products] == [(created.id, 10.0), (1, 2.0)]
+        assert [(t.id, t.seq) for t in changes.deleted] == [(2, 7)]
+        assert changes.seq == 7 and backend.get_product(1).seq == 6
+        assert backend.product_changes(changes.seq).products == []
+
+    def test_limit_pages_in_sequence_order(self, backend):
+        """Test a limited batch returns the watermark of its last change and flags the rest."""
+        backend.delete_products([1, 2])
+        first = backend.product_changes(0, limit=2)
+        assert ([p.id for p in first.products], first.seq, first.more) == ([3], 4, True)
+        assert [t.id for t in first.deleted] == [1]
+        second = backend.product_changes(first.seq, limit=2)
+        assert ([t.id for t in second.deleted], second.seq, second.more) == ([2], 5, False)
+
+    def test_expired_watermarks(self, backend):
+        """Test a watermark ahead of the database, or older than a purged tombstone, is rejected."""
+        with pytest.raises(SequenceExpiredError):
+            backend.product_changes(99)
+        backend.tombstone_retention = 0
+        backend.delete_product(1)
+        backend.delete_product(2)
+        with pytest.raises(SequenceExpiredError):
+            backend.product_changes(3)
+        assert [t.id for t in backend.product_changes(4).deleted] == [2]
+        assert [p.id for p in backend.product_changes(0).products] == [3]
+
+    def test_sequence_survives_restart(self, tmp_path):
+        """Test the counter, row sequence numbers and tombstones are recovered from snapshot and log."""
+        db = InMemoryDatabase(data_dir=str(tmp_path))
+        db.delete_product(2)
+        db.snapshot()
+        db.update_product(1, ProductUpdate(price=3.0))
+        db.delete_product(3)
+        before = db.product_changes(0)
+        db.close()
+        recovered = InMemoryDatabase(data_dir=str(tmp_path))
+        after = recovered.product_changes(0)
+        assert after.products == before.products
+        # Deletes replayed from the log are timed at recovery
+        assert [(t.id, t.seq) for t in after.deleted] == [(t.id, t.seq) for t in before.deleted] == [(2, 4), (3, 6)]
+        assert after.deleted[0].deleted_at == before.deleted[0].deleted_at
+        assert recovered.create_product(make_product("Next")).seq == before.seq + 1
+
+    def test_sqlite_migration_numbers_existing_rows(self, tmp_path):
+        """Test a database file from before delta sync gets sequence numbers in id order."""
+        import sqlite3
+        path = str(tmp_path / "old.sqlite3")
+        SQLiteDatabase(path).close()
+        conn = sqlite3.connect(path)
+        conn.executescript(
+            "DROP INDEX products_seq; ALTER TABLE products DROP COLUMN seq;"
+            " DROP TABLE product_tombstones; DROP TABLE sync_counters;"
+        )
+        conn.close()
+        db = SQLiteDatabase(path)
+        assert [(p.id, p.seq) for p in db.product_changes(0).products] == [(1, 1), (2, 2), (3, 3)]
+        assert db.update_product(1, ProductUpdate(price=1.0)).seq == 4
+        db.close()
+
+
+class TestMappedSnapshot:
+    """Test serving the in-memory tables from a mapped snapshot file."""
+
+    @pytest.fixture
+    def source(self):
+        db = InMemoryDatabase()
+        db.create_product(make_product("Lampe à huile", tags=[], in_stock=False, price=12.5))
+        db.create_users([UserCreate(name="Ann", email="ann@example.com", password="x"),
+                         UserCreate(name="Bob", email="bob@example.com", password="y")])
+        db.create_setting(SettingCreate(key="theme", value="dark"))
+        db.create_setting(SettingCreate(key="lang", value="fr", description="Language"))
+        return db
+
+    @pytest.fixture
+    def path(self, source, tmp_path):
+        path = str(tmp_path / "snapshot.map")
+        source.write_mapped_snapshot(path)
+        return path
+
+    def test_rows_round_trip(self, source, path):
+        """Test every row of every table reads back as it was written."""
+        db = InMemoryDatabase(mapped_snapshot=path)
+        assert isinstance(db.products, OverlayTable)
+        assert db.get_all_products() == source.get_all_products()
+        assert db.get_all_users() == source.get_all_users()
+        assert db.get_all_settings() == source.get_all_settings()
+        assert db.get_setting(1).description is None
+        assert db.get_product(999) is None and 999 not in db.products
+        assert db.get_products_page(2, 1) == ([source.get_product(3)], 3)
+
+    def test_indexes_built_on_first_use(self, source, path):
+        """Test lookups by id and paging leave the secondary indexes unbuilt until a query needs them."""
+        db = InMemoryDatabase(mapped_snapshot=path, index_in_background=False)
+        db.get_product(1)
+        db.find_products(limit=2)
+        assert db._unindexed == {"products", "users", "settings"}
+        assert db.search_products("coffee") == source.search_products("coffee")
+        assert db.find_products(category="Test") == source.find_products(category="Test")
+        assert db.product_stats("category") == source.product_stats("category")
+        assert db.get_user_by_email("bob@example.com").id == 2
+        assert db._unindexed == {"settings"}
+        with pytest.raises(DuplicateKeyError):
+            db.create_setting(SettingCreate(key="lang", value="de"))
+
+    def test_indexes_built_in_background(self, path, monkeypatch):
+        """Test calls run in threads while a background thread builds the indexes, and on the loop after."""
+        started, release = threading.Event(), threading.Event()
+        build = InMemoryDatabase._build_indexes
+
+        def held_build(db):
+            started.set()
+            release.wait()
+            build(db)
+
+        monkeypatch.setattr(InMemoryDatabase, "_build_indexes", held_build)
+        db = InMemoryDatabase(mapped_snapshot=path)
+        async_db = AsyncDatabase(db)
+        started.wait()
+
+        async def calling_thread():
+            return await async_db.run(lambda: threading.current_thread().name)
+
+        assert asyncio.run(calling_thread()).startswith("db")
+        release.set()
+        db._index_thread.join()
+        assert db._unindexed == set() and db.executor_workers is None
+        assert asyncio.run(calling_thread()) == threading.current_thread().name
+        assert db.get_user_by_email("bob@example.com").id == 2
+        asyncio.run(async_db.close())
+
+    def test_writes_stay_in_memory(self, source, path):
+        """Test writes are served over the mapped rows and leave the file unchanged."""
+        db = InMemoryDatabase(mapped_snapshot=path)
+        updated = db.update_product(1, ProductUpdate(price=1.0))
+        db.delete_product(2)
+        created = db.create_product(make_product("New"))
+        db.update_setting(2, SettingUpdate(value="en"))
+        assert created.id == source.next_id and created.seq == source.product_seq + 3
+        assert [p.id for p in db.get_all_products()] == [1, 3, 4, created.id]
+        assert db.get_product(1) == updated and db.get_product(2) is None
+        assert len(db.products) == 4
+        assert [p.id for p in db.find_products(min_price=0, max_price=5)[0]] == [1]
+        assert [t.id for t in db.product_changes(source.product_seq).deleted] == [2]
+        assert InMemoryDatabase(mapped_snapshot=path).get_all_products() == source.get_all_products()
+
+    def test_columnar_overlay(self, path):
+        """Test rows written over the file go to the configured product store."""
+        db = InMemoryDatabase(mapped_snapshot=path, product_store="columnar")
+        db.update_product(1, ProductUpdate(tags=["sale"]))
+        assert isinstance(db.products.overlay, ColumnarProductTable)
+        assert db.get_product(1).tags == ["sale"]
+
+    def test_deleted_rows_expire_watermarks(self, source, tmp_path):
+        """Test clients that synced before a delete the file has no tombstone for must sync from 0."""
+        source.delete_product(2)
+        path = str(tmp_path / "snapshot.map")
+        source.write_mapped_snapshot(path)
+        db = InMemoryDatabase(mapped_snapshot=path)
+        with pytest.raises(SequenceExpiredError):
+            db.product_changes(3)
+        assert db.product_changes(source.product_seq).products == []
+        assert [p.id for p in db.product_changes(0).products] == [1, 3, 4]
+
+    def test_rejects_invalid_files(self, tmp_path):
+        """Test rows out of id order are not written and other files are not opened."""
+        rows = InMemoryDatabase().get_all_products()
+        with pytest.raises(ValueError):
+            write_mapped(str(tmp_path / "bad.map"), {"products": rows[::-1]})
+        (tmp_path / "other").write_bytes(b"not a snapshot")
+        with pytest.raises(ValueError):
+            MappedSnapshot(str(tmp_path / "other"))
+        with pytest.raises(ValueError):
+            InMemoryDatabase(data_dir=str(tmp_path), mapped_snapshot=str(tmp_path / "other"))
+
+    def test_id_index_over_mapped_ids(self):
+        """Test paging continues from a base sequence of ids into ids added later."""
+        index = OrderedIdIndex(base=[2, 4, 6])
+        live = {i: InMemoryDatabase().get_product(1).model_copy(update={"id": i}) for i in (2, 4, 6, 7, 9)}
+        index.add(7)
+        index.add(9)
+        del live[4]
+        index.discard(live)
+        rows, cursor = index.page(live, 2, 2)
+        assert ([p.id for p in rows], cursor) == ([6, 7], 7)
+        assert [p.id for p in index.rows(live)] == [2, 6, 7, 9]
+        index.add(3)
+        live[3] = live[2].model_copy(update={"id": 3})
+        assert [p.id for p in index.page(live, None, None)[0]] == [2, 3, 6, 7, 9]